@@ -0,0 +1,258 @@
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from scipy import signal
+
+from .audio_synchronizer import refine_delay
+from .utils.audio_utils import AudioFilterChain, FILTER_BLOCK_SIZE
+from .logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# Referee whistles, same band as in the whistle filter notebook
+WHISTLE_BAND = (1000, 5000)
+# Claps, same band as filter_claps
+CLAP_BAND = (6500, 8500)
+DEFAULT_BANDS = {'whistle': WHISTLE_BAND, 'clap': CLAP_BAND}
+
+# Events closer than this are treated as the same event in event matching
+MATCH_TOLERANCE_SEC = 0.05
+# Fewer matched events than this are not trusted as a delay estimate
+MIN_EVENT_MATCHES = 5
+# Events of this many seconds from the start are matched, same as the comparison length of calculate_audio_delay
+EVENT_COMPARISON_LENGTH_SEC = 300
+
+
+@dataclass
+class EventIndex:
+    """Sorted onset times in seconds of sharp events in one frequency band, their strength in dB above the
+    background level of the band and how long in seconds they stayed above the detection threshold."""
+    times: np.ndarray = field(default_factory=lambda: np.zeros(0))
+    strengths: np.ndarray = field(default_factory=lambda: np.zeros(0, dtype=np.float32))
+    durations: np.ndarray = field(default_factory=lambda: np.zeros(0, dtype=np.float32))
+
+    def __len__(self) -> int:
+        return len(self.times)
+
+    def select(self, keep: np.ndarray) -> 'EventIndex':
+        return EventIndex(self.times[keep], self.strengths[keep], self.durations[keep])
+
+    def strong(self, min_strength_db: float) -> 'EventIndex':
+        return self.select(self.strengths >= min_strength_db)
+
+    def sustained(self, min_duration_sec: float) -> 'EventIndex':
+        """Events lasting at least min_duration_sec, e.g. whistles instead of claps in the whistle band."""
+        return self.select(self.durations >= min_duration_sec)
+
+    def between(self, start_time: float, end_time: float) -> 'EventIndex':
+        start, end = np.searchsorted(self.times, [start_time, end_time])
+        return self.select(slice(start, end))
+
+
+class BandEventDetector:
+    """Streaming onset detector of one frequency band.
+
+    Band energy is measured in frames of hop_length samples and compared to the background level of the band, an
+    exponential moving average with time constant background_sec. Event is recorded when the level rises more than
+    threshold_db above the background, at most once per min_interval_sec. All state is carried between blocks.
+
+    The rise is also normalised by the spread of the level, the moving average of its absolute deviation from the
+    background with time constant spread_sec. Noise or a quiet microphone flatten the rises of events, so the
+    threshold is the smaller of threshold_db and threshold_spread times the spread.
+    """
+
+    def __init__(self, sr: int, band: Tuple[float, float], hop_length: int = 256, threshold_db: float = 12.0,
+                 threshold_spread: float = 5.0, background_sec: float = 2.0, spread_sec: float = 5.0,
+                 min_interval_sec: float = 0.25):
+        self.sr = sr
+        self.hop_length = hop_length
+        self.threshold_db = threshold_db
+        self.threshold_spread = threshold_spread
+        self.min_interval = min_interval_sec
+        self.chain = AudioFilterChain(sr).add_bandpass(*band)
+        # Background follows the level with bg[n] = (1 - alpha) * bg[n - 1] + alpha * level[n], spread likewise
+        self.background_filter = self._moving_average_filter(background_sec)
+        self.background_state: Optional[np.ndarray] = None
+        self.background = None
+        self.spread_filter = self._moving_average_filter(spread_sec)
+        # Spread starts where the normalised threshold equals threshold_db
+        self.spread = threshold_db / threshold_spread
+        self.spread_state = signal.lfiltic(*self.spread_filter, y=[self.spread])
+        self.remainder = np.zeros(0)
+        self.n_frames = 0
+        self.was_above = False
+        self.last_event_time = -np.inf
+        self.event_open = False
+        self.times: List[float] = []
+        self.strengths: List[float] = []
+        self.durations: List[float] = []
+
+    def _moving_average_filter(self, time_constant_sec: float) -> Tuple[List[float], List[float]]:
+        alpha = min(1.0, self.hop_length / (time_constant_sec * self.sr))
+        return [alpha], [1.0, alpha - 1.0]
+
+    def process(self, block: np.ndarray):
+        filtered = np.concatenate((self.remainder, self.chain.process(np.asarray(block, dtype=np.float64))))
+        n_frames = len(filtered) // self.hop_length
+        self.remainder = filtered[n_frames * self.hop_length:]
+        if n_frames == 0:
+            return
+
+        energy = np.mean(filtered[:n_frames * self.hop_length].reshape(n_frames, self.hop_length) ** 2, axis=1)
+        level = 10 * np.log10(energy + 1e-12)
+        if self.background_state is None:
+            self.background = level[0]
+            self.background_state = signal.lfiltic(*self.background_filter, y=[level[0]])
+
+        # Each frame is compared to the background before it, so the event itself does not raise the background
+        background, self.background_state = signal.lfilter(*self.background_filter, level, zi=self.background_state)
+        previous_background = np.concatenate(([self.background], background[:-1]))
+        self.background = background[-1]
+
+        excess = level - previous_background
+        spread, self.spread_state = signal.lfilter(*self.spread_filter, np.abs(excess), zi=self.spread_state)
+        previous_spread = np.concatenate(([self.spread], spread[:-1]))
+        self.spread = spread[-1]
+
+        above = excess > np.minimum(self.threshold_db, self.threshold_spread * previous_spread)
+        edges = above != np.concatenate(([self.was_above], above[:-1]))
+        self.was_above = bool(above[-1])
+
+        # Only frames where the level crosses the threshold are visited in Python, they are rare
+        for frame in np.flatnonzero(edges):
+            time = (self.n_frames + frame) * self.hop_length / self.sr
+            if not above[frame]:
+                if self.event_open:
+                    self.durations[-1] = time - self.times[-1]
+                    self.event_open = False
+            elif time - self.last_event_time >= self.min_interval:
+                self.times.append(time)
+                self.strengths.append(float(excess[frame]))
+                self.durations.append(0.0)
+                self.last_event_time = time
+                self.event_open = True
+
+        self.n_frames += n_frames
+
+    def index(self) -> EventIndex:
+        durations = np.array(self.durations, dtype=np.float32)
+        if self.event_open:
+            # Event lasts until the end of the audio processed so far
+            durations[-1] = self.n_frames * self.hop_length / self.sr - self.times[-1]
+        return EventIndex(np.array(self.times), np.array(self.strengths, dtype=np.float32), durations)
+
+
+def index_audio_events(audio: np.ndarray, sr: int, bands: Optional[Dict[str, Tuple[float, float]]] = None,
+                       block_size: int = FILTER_BLOCK_SIZE, **detector_kwargs) -> Dict[str, EventIndex]:
+    """Scan mono audio once and index sharp events in every band of bands (default whistles and claps). Audio is
+    read block by block, so it can be a memory map from AudioStore."""
+    bands = bands or DEFAULT_BANDS
+    detectors = {name: BandEventDetector(sr, band, **detector_kwargs) for name, band in bands.items()}
+
+    for start in range(0, len(audio), block_size):
+        block = audio[start:start + block_size]
+        for detector in detectors.values():
+            detector.process(block)
+
+    indexes = {name: detector.index() for name, detector in detectors.items()}
+    logger.debug("Indexed " + ", ".join(f"{len(index)} {name} events" for name, index in indexes.items()))
+    return indexes
+
+
+def merge_event_times(indexes: Dict[str, EventIndex], tolerance_sec: float = MATCH_TOLERANCE_SEC) -> np.ndarray:
+    """Sorted event times of all bands. Events found in several bands, like broadband claps, are kept once."""
+    times = np.sort(np.concatenate([index.times for index in indexes.values()] + [np.zeros(0)]))
+    if len(times) == 0:
+        return times
+    return times[np.concatenate(([True], np.diff(times) > tolerance_sec))]
+
+
+def estimate_delay_from_events(times1: np.ndarray, times2: np.ndarray, max_delay_sec: float = 600.0,
+                               tolerance_sec: float = MATCH_TOLERANCE_SEC) -> Optional[dict]:
+    """
+    Estimate delay by matching event times instead of correlating audio. Every pair of events within max_delay_sec
+    votes for its time difference, and the delay is the median of the densest cluster of votes tolerance_sec wide.
+
+    Returns:
+    dict: Delay in milliseconds (positive if events happen later in times1, same as calculate_audio_delay), share of
+    events matched as confidence and number of matches, or None if less than MIN_EVENT_MATCHES events match
+    """
+    if len(times1) == 0 or len(times2) == 0:
+        return None
+
+    # Differences t1 - t2 of all pairs within max_delay_sec, built without a Python loop
+    lower = np.searchsorted(times2, times1 - max_delay_sec)
+    upper = np.searchsorted(times2, times1 + max_delay_sec)
+    counts = upper - lower
+    if counts.sum() == 0:
+        return None
+    first = np.repeat(lower - np.concatenate(([0], np.cumsum(counts)[:-1])), counts)
+    indices2 = first + np.arange(counts.sum())
+    indices1 = np.repeat(np.arange(len(times1)), counts)
+    differences = times1[indices1] - times2[indices2]
+    order = np.argsort(differences)
+    differences = differences[order]
+
+    cluster_sizes = np.searchsorted(differences, differences + tolerance_sec, side='right') - np.arange(
+        len(differences))
+    best = int(np.argmax(cluster_sizes))
+    cluster = slice(best, best + int(cluster_sizes[best]))
+    # Event can vote more than once within the tolerance, count each event of times1 once
+    n_matches = len(np.unique(indices1[order[cluster]]))
+    if n_matches < MIN_EVENT_MATCHES:
+        return None
+
+    delay = float(np.median(differences[cluster]))
+    return {
+        'delay_ms': delay * 1000,
+        'confidence': n_matches / min(len(times1), len(times2)),
+        'matches': n_matches
+    }
+
+
+def calculate_event_audio_delay(y1: np.ndarray, y2: np.ndarray, sr: int, indexes1: Dict[str, EventIndex],
+                                indexes2: Dict[str, EventIndex],
+                                comparison_length_sec: int = EVENT_COMPARISON_LENGTH_SEC,
+                                refine_window_sec: float = 30.0) -> Optional[dict]:
+    """
+    Calculate delay between two mono signals from their event indexes and refine it at full rate within a short
+    window, so the signals are not correlated as a whole. Like calculate_audio_delay, only events and audio of the
+    first comparison_length_sec seconds are used, so the delay is the delay at the start even if the clocks drift,
+    and indexing only the start of the signals is enough.
+    Returns the same dict as calculate_audio_delay, with confidence of the event matching, or None if the events do
+    not match.
+    """
+    times1 = merge_event_times(indexes1)
+    times2 = merge_event_times(indexes2)
+    event_result = estimate_delay_from_events(times1[times1 < comparison_length_sec],
+                                              times2[times2 < comparison_length_sec])
+    if event_result is None:
+        logger.info("Not enough matching audio events to estimate delay")
+        return None
+
+    min_length = min(len(y1), len(y2), comparison_length_sec * sr)
+    coarse_delay = int(round(event_result['delay_ms'] / 1000 * sr))
+    margin = int(2 * MATCH_TOLERANCE_SEC * sr)
+    refined = refine_delay(y1[:min_length], y2[:min_length], sr, coarse_delay, margin=margin,
+                           window_length=int(refine_window_sec * sr))
+    delay_samples = refined[0] if refined is not None else coarse_delay
+    delay_ms = delay_samples / sr * 1000
+
+    logger.info(f"Delay from {event_result['matches']} matching audio events: {delay_ms:.2f} ms")
+    return {
+        'delay_ms': delay_ms,
+        'confidence': event_result['confidence'],
+        'delay_samples': delay_samples
+    }
+
+
+def suggest_start_and_end_time(whistles: EventIndex, min_strength_db: float = 12.0, min_duration_sec: float = 0.15,
+                               lead_time_sec: float = 10.0) -> Optional[Tuple[float, float]]:
+    """Suggest game start and end time in seconds from the first and last strong whistle, lead_time_sec before and
+    after them. Short events in the whistle band, like claps, are ignored. Returns None if there are less than two
+    strong whistles."""
+    strong = whistles.strong(min_strength_db).sustained(min_duration_sec)
+    if len(strong) < 2:
+        return None
+    return max(0.0, float(strong.times[0]) - lead_time_sec), float(strong.times[-1]) + lead_time_sec
@@ -1,9 +1,8 @@
 from typing import Tuple, Optional
 
-from .utils.audio_utils import butter_bandpass_filter
+from .utils.audio_utils import AudioFilterChain, butter_bandpass_filter
 import numpy as np
 from scipy import fft
-from scipy.signal import correlate
 import soundfile as sf
 import librosa
 from pydub import AudioSegment
@@ -11,20 +10,39 @@ from .logger import setup_logger
 logger = setup_logger(__name__)
 
 
+def circular_cross_correlation(audio1: np.ndarray, audio2: np.ndarray, padsize: int) -> np.ndarray:
+    """Cross-correlation of the signals zero padded to padsize with real FFTs in float32. Value at index m is the
+    correlation at lag m, negative lags wrap around to the end."""
+    spectrum = fft.rfft(np.asarray(audio1, dtype=np.float32), padsize, workers=-1)
+    spectrum *= np.conj(fft.rfft(np.asarray(audio2, dtype=np.float32), padsize, workers=-1))
+    return fft.irfft(spectrum, padsize, workers=-1)
+
+
+def fft_cross_correlation(audio1: np.ndarray, audio2: np.ndarray, mode: str = 'full') -> np.ndarray:
+    """Same as scipy.signal.correlate(audio1, audio2, mode) for real signals with mode 'full' or 'valid', but always
+    with real FFTs in float32, padded to scipy.fft.next_fast_len and computed with all cores."""
+    length1 = len(audio1)
+    length2 = len(audio2)
+    padsize = fft.next_fast_len(length1 + length2 - 1, real=True)
+    correlation = circular_cross_correlation(audio1, audio2, padsize)
+
+    if mode == 'full':
+        # Lags from -(length2 - 1) to length1 - 1
+        return np.concatenate((correlation[padsize - (length2 - 1):], correlation[:length1]))
+    if mode == 'valid':
+        if length2 > length1:
+            raise ValueError("Second signal must not be longer than the first in valid mode")
+        return correlation[:length1 - length2 + 1]
+    raise ValueError(f"Unknown mode {mode}, must be 'full' or 'valid'")
+
+
 def audio_fft_correlation(audio1, audio2):
     audio1_length = len(audio1)
     audio2_length = len(audio2)
 
-    padsize = audio1_length + audio2_length + 1
-    padsize = 2 ** (int(np.log(padsize) / np.log(2)) + 1)
-
-    audio1_pad = np.zeros(padsize)
-    audio1_pad[:audio1_length] = audio1
+    padsize = fft.next_fast_len(audio1_length + audio2_length + 1, real=True)
 
-    audio2_pad = np.zeros(padsize)
-    audio2_pad[:audio2_length] = audio2
-
-    corr = fft.ifft(fft.fft(audio1_pad) * np.conj(fft.fft(audio2_pad)))
+    corr = circular_cross_correlation(audio1, audio2, padsize)
     ca = np.absolute(corr)
     xmax = np.argmax(ca)
 
@@ -70,28 +88,139 @@ def calculate_robust_audio_delay(file1_path, file2_path, comparison_length_sec:
     float: Delay in milliseconds (positive if file2 is delayed relative to file1)
     """
     # Load audio files using librosa (resamples automatically)
-    y1, sr1 = librosa.load(file1_path)
-    y2, sr2 = librosa.load(file2_path)
+    y1, sr = librosa.load(file1_path)
+    y2, sr = librosa.load(file2_path)
+
+    return calculate_audio_delay(y1, y2, sr, comparison_length_sec)
+
+
+def onset_envelope(audio: np.ndarray, hop_length: int, block_frames: int = 4096) -> np.ndarray:
+    """Decimate audio to one value per hop_length samples: positive change of log energy of the pre-emphasized
+    signal. Pre-emphasis removes low frequency rumble like the band-pass filter used at full rate. Audio is
+    processed in blocks of block_frames hops, so the memory use does not grow with the audio length."""
+    n_frames = len(audio) // hop_length
+    log_energy = np.empty(n_frames, dtype=np.float32)
+
+    for start in range(0, n_frames, block_frames):
+        end = min(start + block_frames, n_frames)
+        frames = np.asarray(audio[start * hop_length:end * hop_length], dtype=np.float32).reshape(-1, hop_length)
+        emphasized = frames[:, 1:] - 0.97 * frames[:, :-1]
+        log_energy[start:end] = np.log(np.mean(emphasized ** 2, axis=1) + 1e-10)
+
+    return np.maximum(np.diff(log_energy, prepend=log_energy[:1]), 0)
+
+
+def find_coarse_delay(y1: np.ndarray, y2: np.ndarray, hop_length: int) -> int:
+    """Delay in samples between the signals with a resolution of hop_length samples."""
+    envelope1 = onset_envelope(y1, hop_length)
+    envelope2 = onset_envelope(y2, hop_length)
+    envelope1 -= envelope1.mean()
+    envelope2 -= envelope2.mean()
+
+    correlation = fft_cross_correlation(envelope1, envelope2, mode='full')
+    delay_hops = np.argmax(correlation) - (len(envelope2) - 1)
+    return int(delay_hops * hop_length)
+
+
+def refine_delay(y1: np.ndarray, y2: np.ndarray, sr: int, coarse_delay: int, margin: int,
+                 window_length: int) -> Optional[Tuple[int, float]]:
+    """Search delay within coarse_delay +- margin samples by correlating window_length samples of the band-passed
+    signals at full rate. Returns delay in samples and normalized correlation at the peak, or None if the signals
+    are too short for the window."""
+    # Window of y1 starts at s and is compared to y2 from s - coarse_delay - margin onwards
+    start_min = max(0, coarse_delay + margin)
+    window_length = min(window_length, len(y1) - start_min, len(y2) - start_min + coarse_delay - margin)
+    if window_length <= 0:
+        return None
+    start_max = min(len(y1) - window_length, len(y2) - window_length - margin + coarse_delay)
+    start = (start_min + start_max) // 2
+
+    window1 = butter_bandpass_filter(y1[start:start + window_length], lowcut=300, highcut=8000, samplerate=sr)
+    y2_start = start - coarse_delay - margin
+    window2 = butter_bandpass_filter(y2[y2_start:y2_start + window_length + 2 * margin], lowcut=300, highcut=8000,
+                                     samplerate=sr)
+
+    correlation = fft_cross_correlation(window2, window1, mode='valid')
+    best = int(np.argmax(correlation))
+
+    # Normalize by the energy of the compared parts, so that confidence is 1.0 for identical signals
+    window2_energy = np.sum(window2[best:best + window_length] ** 2)
+    norm = np.sqrt(np.sum(window1 ** 2) * window2_energy)
+    confidence = correlation[best] / norm if norm > 0 else 0.0
+
+    return coarse_delay + margin - best, confidence
+
+
+def calculate_audio_delay(y1: np.ndarray, y2: np.ndarray, sr: int, comparison_length_sec: int = 300,
+                          hop_length: int = 256, refine_window_sec: float = 30.0):
+    """
+    Calculate the delay between two mono audio signals with the same sample rate from coarse to fine.
+
+    The coarse delay is found by correlating onset envelopes decimated by hop_length over the first
+    comparison_length_sec seconds. It is then refined at full rate only within a few hops around the coarse delay,
+    using refine_window_sec seconds of the band-passed signals. Signals are only sliced, so they can be read only
+    views, e.g. from AudioStore. Falls back to calculate_full_rate_audio_delay if signals are too short.
+
+    Returns:
+    dict: Delay in milliseconds (positive if events happen later in y1 than in y2), confidence and delay in samples
+    """
+    # Ensure both arrays are the same length
+    min_length = min(len(y1), len(y2), comparison_length_sec * sr)
+    y1 = y1[:min_length]
+    y2 = y2[:min_length]
+
+    if min_length < 4 * hop_length:
+        return calculate_full_rate_audio_delay(y1, y2, sr, comparison_length_sec)
+
+    coarse_delay = find_coarse_delay(y1, y2, hop_length)
+    logger.debug(f"Coarse delay: {coarse_delay / sr * 1000:.2f} ms")
+
+    refined = refine_delay(y1, y2, sr, coarse_delay, margin=4 * hop_length, window_length=int(refine_window_sec * sr))
+    if refined is None:
+        logger.debug("Audio is too short to refine coarse delay, correlating at full rate")
+        return calculate_full_rate_audio_delay(y1, y2, sr, comparison_length_sec)
+
+    delay_samples, confidence = refined
+    delay_ms = (delay_samples / sr) * 1000
+
+    logger.info(f"Delay: {delay_ms:.2f} ms")
+    logger.info(f"Confidence: {confidence:.2f}")
+
+    return {
+        'delay_ms': delay_ms,
+        'confidence': confidence,
+        'delay_samples': delay_samples
+    }
+
+
+def calculate_full_rate_audio_delay(y1: np.ndarray, y2: np.ndarray, sr: int, comparison_length_sec: int = 300):
+    """
+    Calculate the delay between two mono audio signals by cross-correlating the band-passed signals at full sample
+    rate. Exact, but slow and memory hungry on long recordings, see calculate_audio_delay.
 
+    Returns:
+    dict: Delay in milliseconds (positive if events happen later in y1 than in y2), confidence and delay in samples
+    """
     # Ensure both arrays are the same length
     min_length = min(len(y1), len(y2))
     y1 = y1[:min_length]
     y2 = y2[:min_length]
 
     # Take first 5 minutes of audio or all of it if it's less than 5 minutes
-    y1 = y1[:min(comparison_length_sec * sr1, len(y1))]
-    y2 = y2[:min(comparison_length_sec * sr2, len(y2))]
+    y1 = y1[:min(comparison_length_sec * sr, len(y1))]
+    y2 = y2[:min(comparison_length_sec * sr, len(y2))]
 
-    # Apply existing filters to focus on important frequencies
-    y1_filtered = butter_bandpass_filter(y1, lowcut=300, highcut=8000, samplerate=sr1)
-    y2_filtered = butter_bandpass_filter(y2, lowcut=300, highcut=8000, samplerate=sr2)
+    # Apply existing filters to focus on important frequencies. Causal filters delay both signals equally, so
+    # the delay between them is kept and signals are filtered in blocks without copying them first
+    y1_filtered = AudioFilterChain(sr).add_bandpass(300, 8000).filter(y1)
+    y2_filtered = AudioFilterChain(sr).add_bandpass(300, 8000).filter(y2)
 
     # Normalize the signals
     y1_normalized = y1_filtered / np.sqrt(np.sum(y1_filtered ** 2))
     y2_normalized = y2_filtered / np.sqrt(np.sum(y2_filtered ** 2))
 
     # Compute cross-correlation
-    correlation = correlate(y1_normalized, y2_normalized, mode='full')
+    correlation = fft_cross_correlation(y1_normalized, y2_normalized, mode='full')
 
     # Find the peak in the correlation
     max_correlation_idx = np.argmax(correlation)
@@ -100,7 +229,7 @@ def calculate_robust_audio_delay(file1_path, file2_path, comparison_length_sec:
     delay_samples = max_correlation_idx - (len(y1_normalized) - 1)
 
     # Convert to milliseconds
-    delay_ms = (delay_samples / sr1) * 1000
+    delay_ms = (delay_samples / sr) * 1000
 
     # Calculate confidence score based on correlation peak height
     max_correlation = np.max(correlation)
@@ -128,69 +257,198 @@ def mix_audio_tracks(audio1: np.array, audio2: np.array, mix_ratio=(0.5, 0.5)) -
     return stereo_mix
 
 
-def sync_and_mix_audio(file1_path, file2_path, output_path, mix_ratio=(0.5, 0.5), delay: Optional[float] = None):
+class AudioBlockReader:
+    """Read mono float32 blocks of an audio array or sound file, starting from sample offset.
+
+    Arrays (e.g. memory maps from AudioStore) are sliced without copying the whole signal, sound files are read with
+    soundfile and multichannel blocks are averaged to mono. Only one block is held in memory at a time. With rate
+    other than 1.0, samples are read at fractional positions offset + i * rate with linear interpolation, which
+    stretches the audio to correct clock drift.
+    """
+
+    def __init__(self, source, offset: float = 0, rate: float = 1.0):
+        self.sound_file = None
+        if isinstance(source, np.ndarray):
+            self.array = source
+            self.length = len(source)
+        else:
+            self.sound_file = sf.SoundFile(source)
+            self.length = self.sound_file.frames
+        self.rate = rate
+        self.position = min(offset, self.length)
+
+    @property
+    def remaining(self) -> int:
+        return max(0, int(np.ceil((self.length - self.position) / self.rate)))
+
+    def _read_raw(self, start: int, n_samples: int) -> np.ndarray:
+        """Read samples [start, start + n_samples), zero padded outside the audio."""
+        block = np.zeros(n_samples, dtype=np.float32)
+        read_start = max(0, start)
+        read_end = min(self.length, start + n_samples)
+        if read_end <= read_start:
+            return block
+        if self.sound_file is None:
+            block[read_start - start:read_end - start] = self.array[read_start:read_end]
+        else:
+            self.sound_file.seek(read_start)
+            data = self.sound_file.read(read_end - read_start, dtype='float32', always_2d=True)
+            block[read_start - start:read_start - start + len(data)] = data.mean(axis=1)
+        return block
+
+    def read(self, n_samples: int) -> np.ndarray:
+        """Read next n_samples, zero padded at the end of the audio."""
+        if self.rate == 1.0:
+            block = self._read_raw(int(self.position), n_samples)
+        else:
+            positions = self.position + np.arange(n_samples) * self.rate
+            start = int(np.floor(positions[0]))
+            raw = self._read_raw(start, int(np.ceil(positions[-1])) - start + 2)
+            block = np.interp(positions - start, np.arange(len(raw)), raw).astype(np.float32)
+        self.position += n_samples * self.rate
+        return block
+
+    def peak(self, block_size: int) -> float:
+        """Maximum absolute sample value from the current position to the end, position is kept. Interpolation
+        cannot exceed the peak of the samples, so the samples are scanned without it."""
+        start = max(0, int(self.position))
+        peak = 0.0
+        for block_start in range(start, self.length, block_size):
+            block = self._read_raw(block_start, min(block_size, self.length - block_start))
+            peak = max(peak, float(np.max(np.abs(block))))
+        return peak
+
+    def close(self):
+        if self.sound_file is not None:
+            self.sound_file.close()
+
+
+def delay_to_offsets(delay_samples: int) -> Tuple[int, int]:
+    """Number of samples to cut from the start of first and second audio to synchronize them."""
+    if delay_samples > 0:
+        # Left is ahead - cut start of left audio
+        return delay_samples, 0
+    # Right is ahead - cut start of right audio
+    return 0, abs(delay_samples)
+
+
+def stream_mix_audio(source1, source2, sr: int, output_path, delay_samples: int, mix_ratio=(0.5, 0.5),
+                     block_size: Optional[int] = None, drift: float = 0.0) -> int:
+    """
+    Synchronize two mono audio sources (arrays or sound file paths) by cutting delay_samples from the start of the
+    one that started first and mix them into a stereo PCM_24 file block by block.
+
+    delay_samples is the delay at the start of source1. With drift (delay change per second of source1, see
+    OffsetMap.drift), source2 is stretched to follow source1, so the delay holds over the whole recording.
+
+    Shorter source is padded with silence and both sources are normalized to their peak in the mixed range. Peaks are
+    found in a first pass over the blocks, so peak memory depends on block_size (default 10 seconds) but not on the
+    length of the audio. Returns the number of samples written.
+    """
+    block_size = block_size or 10 * sr
+    offset1, offset2 = delay_to_offsets(delay_samples)
+    reader1 = AudioBlockReader(source1, offset1)
+    # Sample m of the output is sample m + offset1 of source1, which matches source2 at
+    # (m + offset1) * (1 - drift) - delay_samples. Without drift this is m + offset2.
+    reader2 = AudioBlockReader(source2, offset1 * (1 - drift) - delay_samples, rate=1 - drift)
+
+    try:
+        # Now both audios start at the same time, the shorter one is padded to the length of the longer one
+        n_samples = max(reader1.remaining, reader2.remaining)
+
+        # Normalize both signals
+        peak1 = reader1.peak(block_size)
+        peak2 = reader2.peak(block_size)
+        scale1 = 1 / peak1 if peak1 > 0 else 1.0
+        scale2 = 1 / peak2 if peak2 > 0 else 1.0
+
+        with sf.SoundFile(output_path, 'w', samplerate=sr, channels=2, subtype='PCM_24') as output:
+            for start in range(0, n_samples, block_size):
+                n_block = min(block_size, n_samples - start)
+                block1 = reader1.read(n_block) * scale1
+                block2 = reader2.read(n_block) * scale2
+                output.write(mix_audio_tracks(block1, block2, mix_ratio))
+    finally:
+        reader1.close()
+        reader2.close()
+
+    return n_samples
+
+
+def sync_and_mix_audio(file1_path, file2_path, output_path, mix_ratio=(0.5, 0.5), delay: Optional[float] = None,
+                       comparison_length_sec: int = 300):
     """
     Synchronize two audio files and mix them into a stereo file with specified balance.
+    Files must have the same sample rate, which is also used for the output. Only the first comparison_length_sec
+    seconds are loaded for delay calculation, mixing is streamed in blocks.
 
     Parameters:
     file1_path (str): Path to first audio file
     file2_path (str): Path to second audio file
     output_path (str): Path to save mixed stereo file
     mix_ratio (tuple): (left_ratio, right_ratio) for mixing the files (default: 0.5, 0.5)
+    delay (float): Delay in milliseconds, calculated from the audio if not given
     """
-    # Calculate delay
+    info1 = sf.info(file1_path)
+    info2 = sf.info(file2_path)
 
-    logger.info(f"Calculating delay between {file1_path} and {file2_path}")
+    if info1.frames == 0:
+        raise ValueError(f"Left audio file is empty: {file1_path}")
+    if info2.frames == 0:
+        raise ValueError(f"Right audio file is empty: {file2_path}")
+    if info1.samplerate != info2.samplerate:
+        raise ValueError(f"Audio files have different sample rates: {info1.samplerate} and {info2.samplerate}")
 
-    # Load both files
-    y1, sr = librosa.load(file1_path, mono=True)
-    y2, sr = librosa.load(file2_path, mono=True)
+    sr = info1.samplerate
 
+    if delay is None:
+        # Calculate delay
+        logger.info(f"Calculating delay between {file1_path} and {file2_path}")
+        y1, _ = sf.read(file1_path, frames=comparison_length_sec * sr, dtype='float32', always_2d=True)
+        y2, _ = sf.read(file2_path, frames=comparison_length_sec * sr, dtype='float32', always_2d=True)
+        result = calculate_audio_delay(y1.mean(axis=1), y2.mean(axis=1), sr, comparison_length_sec)
+    else:
+        result = None
+
+    return _mix_with_delay(file1_path, file2_path, sr, output_path, mix_ratio, delay, result)
+
+
+def sync_and_mix_audio_arrays(y1: np.ndarray, y2: np.ndarray, sr: int, output_path, mix_ratio=(0.5, 0.5),
+                              delay: Optional[float] = None, drift: float = 0.0):
+    """
+    Same as sync_and_mix_audio for mono signals that are already decoded at sample rate sr, e.g. from AudioStore.
+    Delay is calculated from the same signals if not given, so the audio is not loaded again. Delay is the delay at
+    the start of y1 and drift the change of the delay per second, see OffsetMap.
+    """
     if len(y1) == 0:
-        raise ValueError(f"Left audio file is empty: {file1_path}")
+        raise ValueError("Left audio is empty")
     if len(y2) == 0:
-        raise ValueError(f"Right audio file is empty: {file2_path}")
+        raise ValueError("Right audio is empty")
 
-    if delay is None:
-        result = calculate_robust_audio_delay(file1_path, file2_path)
-        delay_samples = result['delay_samples']
-        delay_ms = result['delay_ms']
-        confidence = result['confidence']
+    result = calculate_audio_delay(y1, y2, sr) if delay is None else None
+
+    return _mix_with_delay(y1, y2, sr, output_path, mix_ratio, delay, result, drift)
+
+
+def _mix_with_delay(source1, source2, sr: int, output_path, mix_ratio, delay: Optional[float],
+                    delay_result: Optional[dict], drift: float = 0.0):
+    if delay_result is not None:
+        delay_samples = delay_result['delay_samples']
+        delay_ms = delay_result['delay_ms']
+        confidence = delay_result['confidence']
     else:
         logger.debug(f"Using delay from command line: {delay} ms")
         delay_ms = delay
-        delay_samples = int(delay_ms / 1000) * sr
+        delay_samples = int(round(delay_ms / 1000 * sr))
         confidence = 1.0
 
-    # First synchronize by cutting the delayed audio
-    if delay_samples > 0:
-        # Left is ahead - cut start of left audio
-        y1 = y1[delay_samples:]
-    else:
-        # Right is ahead - cut start of right audio
-        delay_samples = abs(delay_samples)
-        y2 = y2[delay_samples:]
-
-    # Now both audios start at the same time
-    # Make them the same length by padding the shorter one
-    max_length = max(len(y1), len(y2))
-    y1 = np.pad(y1, (0, max_length - len(y1)), mode='constant')
-    y2 = np.pad(y2, (0, max_length - len(y2)), mode='constant')
-
-    # Normalize both signals
-    y1 = y1 / np.max(np.abs(y1)) if np.max(np.abs(y1)) > 0 else y1
-    y2 = y2 / np.max(np.abs(y2)) if np.max(np.abs(y2)) > 0 else y2
-
-    # Create stereo mix
-    stereo_mix = mix_audio_tracks(y1, y2, mix_ratio)
-    
-    sf.write(output_path, stereo_mix, sr, 'PCM_24')
+    n_samples = stream_mix_audio(source1, source2, sr, output_path, delay_samples, mix_ratio, drift=drift)
 
     return {
         'delay_ms': delay_ms,
         'confidence': confidence,
         'sample_rate': sr,
-        'duration': len(stereo_mix) / sr
+        'duration': n_samples / sr
     }
 
 
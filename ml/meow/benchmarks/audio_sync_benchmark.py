@@ -0,0 +1,175 @@
+"""Benchmark speed and accuracy of audio delay estimators on synthetic tracks with known delay.
+
+Every scenario generates a pair of tracks with known delay and, depending on the scenario, noise, gain difference or
+clock drift, and runs each estimator on it. Reports wall time, peak traced memory and error in milliseconds. Run
+from the repository root:
+
+    python -m ml.meow.benchmarks.audio_sync_benchmark --durations 60 600 7200 --output audio_sync_benchmark.json
+
+Each estimator runs once with tracemalloc enabled, so long tracks are not processed twice.
+"""
+import argparse
+import json
+import os
+import platform
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from .mixer_benchmark import get_git_commit
+from .synthetic_audio import SyntheticAudioPair, generate_synthetic_audio_pair
+from ..audio_event_indexer import EVENT_COMPARISON_LENGTH_SEC, calculate_event_audio_delay, index_audio_events
+from ..audio_synchronizer import (calculate_audio_delay, calculate_full_rate_audio_delay,
+                                  calculate_robust_audio_delay, calculate_synchronization_delay)
+from ..drift_analyzer import estimate_offset_map
+from ..utils.audio_store import DEFAULT_SAMPLE_RATE
+from ..logger import setup_logger
+
+logger = setup_logger(__name__)
+
+SCENARIOS = {
+    "clean": {"noise_level": 0.01, "gain": 1.0, "drift_ppm": 0.0},
+    "noisy": {"noise_level": 0.2, "gain": 1.0, "drift_ppm": 0.0},
+    "gain": {"noise_level": 0.01, "gain": 0.1, "drift_ppm": 0.0},
+    "drift": {"noise_level": 0.01, "gain": 1.0, "drift_ppm": 50.0}
+}
+
+
+def synchronization_delay(pair: SyntheticAudioPair, audio1, audio2, wav_paths) -> Dict:
+    # Offset is positive if audio 1 needs delay, which is the opposite sign of the delay of calculate_audio_delay
+    return {"delay_ms": -calculate_synchronization_delay(audio1, audio2, pair.sample_rate) * 1000}
+
+
+def robust_audio_delay(pair: SyntheticAudioPair, audio1, audio2, wav_paths) -> Dict:
+    return {"delay_ms": calculate_robust_audio_delay(*wav_paths)['delay_ms']}
+
+
+def audio_delay(pair: SyntheticAudioPair, audio1, audio2, wav_paths) -> Dict:
+    return {"delay_ms": calculate_audio_delay(audio1, audio2, pair.sample_rate)['delay_ms']}
+
+
+def full_rate_audio_delay(pair: SyntheticAudioPair, audio1, audio2, wav_paths) -> Dict:
+    return {"delay_ms": calculate_full_rate_audio_delay(audio1, audio2, pair.sample_rate)['delay_ms']}
+
+
+def offset_map_delay(pair: SyntheticAudioPair, audio1, audio2, wav_paths) -> Dict:
+    offset_map = estimate_offset_map(audio1, audio2, pair.sample_rate)
+    return {"delay_ms": offset_map.base_delay_ms, "drift_ppm": offset_map.drift_ppm}
+
+
+def event_delay(pair: SyntheticAudioPair, audio1, audio2, wav_paths) -> Dict:
+    # Only the start of the tracks is matched, like in meow.py when events are not needed for trimming
+    comparison_length = EVENT_COMPARISON_LENGTH_SEC * pair.sample_rate
+    indexes1 = index_audio_events(audio1[:comparison_length], pair.sample_rate)
+    indexes2 = index_audio_events(audio2[:comparison_length], pair.sample_rate)
+    result = calculate_event_audio_delay(audio1, audio2, pair.sample_rate, indexes1, indexes2)
+    return {"delay_ms": result['delay_ms'] if result is not None else None}
+
+
+ESTIMATORS: Dict[str, Callable] = {
+    "synchronization_delay": synchronization_delay,
+    "robust_audio_delay": robust_audio_delay,
+    "audio_delay": audio_delay,
+    "full_rate_audio_delay": full_rate_audio_delay,
+    "offset_map": offset_map_delay,
+    "event_delay": event_delay
+}
+
+
+def measure(estimator: Callable, pair: SyntheticAudioPair, wav_paths: Optional[List[str]]) -> Dict:
+    audio1, audio2 = pair.load()
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        result = estimator(pair, audio1, audio2, wav_paths)
+    finally:
+        wall_time = time.perf_counter() - start
+        _, peak_memory = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    delay_ms = result["delay_ms"]
+    result.update({
+        "wall_time": wall_time,
+        "peak_memory_mb": peak_memory / (1024 * 1024),
+        "error_ms": abs(delay_ms - pair.delay_ms) if delay_ms is not None else None
+    })
+    if "drift_ppm" in result:
+        result["drift_error_ppm"] = abs(result["drift_ppm"] - pair.drift_ppm)
+    return result
+
+
+def run_benchmark(durations: List[float], scenarios: List[str], estimators: List[str], delay_sec: float,
+                  sample_rate: int, seed: int, work_dir: str) -> List[Dict]:
+    results = []
+    for duration in durations:
+        for scenario in scenarios:
+            logger.info(f"Generating {duration:.0f} s {scenario} pair")
+            pair = generate_synthetic_audio_pair(work_dir, duration=duration, sample_rate=sample_rate,
+                                                 delay_sec=delay_sec, seed=seed, **SCENARIOS[scenario])
+            # File based estimators get WAV files written before timing
+            wav_paths = pair.write_wav(work_dir) if "robust_audio_delay" in estimators else None
+
+            for name in estimators:
+                result = measure(ESTIMATORS[name], pair, wav_paths)
+                result.update({"estimator": name, "duration": duration, "scenario": scenario,
+                               "true_delay_ms": pair.delay_ms, "true_drift_ppm": pair.drift_ppm})
+                error = f"{result['error_ms']:.2f} ms" if result['error_ms'] is not None else "failed"
+                logger.info(f"{duration:>6.0f} s {scenario:<6} {name:<22} {result['wall_time']:7.2f} s "
+                            f"{result['peak_memory_mb']:7.0f} MB error {error}")
+                results.append(result)
+
+            for path in [pair.audio1_path, pair.audio2_path] + (wav_paths or []):
+                os.remove(path)
+    return results
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Benchmark audio delay estimators on synthetic tracks")
+    parser.add_argument("--durations", nargs="+", default=[60, 600, 1800, 7200], type=float,
+                        help="lengths of the synthetic tracks in seconds")
+    parser.add_argument("--scenarios", nargs="+", default=list(SCENARIOS), choices=list(SCENARIOS),
+                        help="scenarios to run (default all)")
+    parser.add_argument("--estimators", nargs="+", default=list(ESTIMATORS), choices=list(ESTIMATORS),
+                        help="estimators to run (default all)")
+    parser.add_argument("--delay", default=1.2345, type=float, dest="delay_sec",
+                        help="delay between the tracks in seconds")
+    parser.add_argument("--sample-rate", default=DEFAULT_SAMPLE_RATE, type=int, help="sample rate of the tracks")
+    parser.add_argument("--seed", default=0, type=int, help="seed of the synthetic tracks")
+    parser.add_argument("--work-dir", default=None, help="directory for the tracks (default temporary directory)")
+    parser.add_argument("--output", default="audio_sync_benchmark.json", help="path of the JSON result file")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        work_dir = args.work_dir or temp_dir
+        os.makedirs(work_dir, exist_ok=True)
+        results = run_benchmark(args.durations, args.scenarios, args.estimators, args.delay_sec, args.sample_rate,
+                                args.seed, work_dir)
+
+    report = {
+        "timestamp": datetime.now().isoformat(),
+        "commit": get_git_commit(),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "cpu_count": os.cpu_count(),
+        "sample_rate": args.sample_rate,
+        "delay_sec": args.delay_sec,
+        "scenarios": {name: SCENARIOS[name] for name in args.scenarios},
+        "results": results
+    }
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    logger.info(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""Micro-benchmark of the cross-correlation used in audio synchronization.
+
+Compares fft_cross_correlation with the two implementations it replaced: complex FFT in float64 padded to the next
+power of two, and scipy.signal.correlate in full mode. Run from the repository root:
+
+    python -m ml.meow.benchmarks.correlation_benchmark --durations 10 60 300
+"""
+import argparse
+import json
+import time
+import tracemalloc
+from typing import Callable, Dict, List
+
+import numpy as np
+from scipy.signal import correlate
+
+from ..audio_synchronizer import fft_cross_correlation
+from ..utils.audio_store import DEFAULT_SAMPLE_RATE
+from ..logger import setup_logger
+
+logger = setup_logger(__name__)
+
+
+def power_of_two_correlation(audio1: np.ndarray, audio2: np.ndarray) -> int:
+    """Previous audio_fft_correlation: complex FFT of float64 signals zero padded to the next power of two."""
+    padsize = len(audio1) + len(audio2) + 1
+    padsize = 2 ** (int(np.log(padsize) / np.log(2)) + 1)
+
+    audio1_pad = np.zeros(padsize)
+    audio1_pad[:len(audio1)] = audio1
+    audio2_pad = np.zeros(padsize)
+    audio2_pad[:len(audio2)] = audio2
+
+    corr = np.fft.ifft(np.fft.fft(audio1_pad) * np.conj(np.fft.fft(audio2_pad)))
+    xmax = int(np.argmax(np.absolute(corr)))
+    # Convert circular lag to the same convention as the other implementations
+    return xmax - padsize if xmax > padsize // 2 else xmax
+
+
+def scipy_correlation(audio1: np.ndarray, audio2: np.ndarray) -> int:
+    """Previous calculate_robust_audio_delay: scipy.signal.correlate in full mode, method chosen by scipy."""
+    correlation = correlate(audio1, audio2, mode='full')
+    return int(np.argmax(correlation)) - (len(audio2) - 1)
+
+
+def real_fft_correlation(audio1: np.ndarray, audio2: np.ndarray) -> int:
+    correlation = fft_cross_correlation(audio1, audio2, mode='full')
+    return int(np.argmax(correlation)) - (len(audio2) - 1)
+
+
+IMPLEMENTATIONS: Dict[str, Callable[[np.ndarray, np.ndarray], int]] = {
+    "power_of_two_complex_fft": power_of_two_correlation,
+    "scipy_correlate": scipy_correlation,
+    "real_fft_next_fast_len": real_fft_correlation
+}
+
+
+def create_delayed_pair(duration: float, delay_samples: int, sample_rate: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    n_samples = int(duration * sample_rate)
+    offset = abs(delay_samples)
+    source = rng.standard_normal(n_samples + 2 * offset)
+    # Events happen delay_samples later in audio1 than in audio2
+    audio1 = source[offset - delay_samples:offset - delay_samples + n_samples]
+    audio2 = source[offset:offset + n_samples]
+    noise = rng.standard_normal((2, n_samples)) * 0.5
+    # Signals are float64 like the band-pass filtered signals in the sync path
+    return audio1 + noise[0], audio2 + noise[1]
+
+
+def measure(implementation: Callable, audio1: np.ndarray, audio2: np.ndarray, repeats: int) -> Dict:
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        lag = implementation(audio1, audio2)
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    implementation(audio1, audio2)
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {"lag": lag, "best_time": min(times), "peak_memory_mb": peak_memory / (1024 * 1024)}
+
+
+def run_benchmark(durations: List[float], delay_samples: int, sample_rate: int, repeats: int) -> List[Dict]:
+    results = []
+    for duration in durations:
+        audio1, audio2 = create_delayed_pair(duration, delay_samples, sample_rate)
+        for name, implementation in IMPLEMENTATIONS.items():
+            result = measure(implementation, audio1, audio2, repeats)
+            result.update({"implementation": name, "duration": duration, "correct": result["lag"] == delay_samples})
+            logger.info(f"{duration:>6.0f} s {name:<26} {result['best_time']:.3f} s "
+                        f"{result['peak_memory_mb']:.0f} MB lag {result['lag']}")
+            results.append(result)
+    return results
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Benchmark cross-correlation implementations for audio sync")
+    parser.add_argument("--durations", nargs="+", default=[10, 60, 300], type=float,
+                        help="lengths of the correlated signals in seconds")
+    parser.add_argument("--delay-samples", default=12345, type=int, help="delay between the signals in samples")
+    parser.add_argument("--sample-rate", default=DEFAULT_SAMPLE_RATE, type=int, help="sample rate of the signals")
+    parser.add_argument("--repeats", default=3, type=int, help="timed runs per implementation, best is reported")
+    parser.add_argument("--output", default=None, help="path of the JSON result file")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    results = run_benchmark(args.durations, args.delay_samples, args.sample_rate, args.repeats)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({"sample_rate": args.sample_rate, "results": results}, f, indent=2)
+        logger.info(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
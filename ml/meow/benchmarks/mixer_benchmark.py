@@ -0,0 +1,306 @@
+"""Benchmark mixer engines on synthetic two camera footage.
+
+Run from the repository root:
+
+    python -m ml.meow.benchmarks.mixer_benchmark --duration 60 --output mixer_benchmark.json
+
+Each mixer runs in its own process, so peak RSS is measured separately for every mixer. Pass a previous result file
+with --compare to print the change in throughput. With --threaded-io, mixers run mix_video with threaded decoding
+and encoding, and only the wall time is measured.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import cv2
+import numpy as np
+
+from .synthetic_footage import SyntheticMatch, generate_synthetic_match
+from ..mixer_registry import available_mixers, get_mixer
+from ..logger import setup_logger
+
+logger = setup_logger(__name__)
+
+
+class StageTimer:
+    """Accumulate wall time spent in wrapped functions per stage."""
+
+    def __init__(self):
+        self.totals = defaultdict(float)
+
+    def wrap(self, func, stage: str):
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.totals[stage] += time.perf_counter() - start
+        return timed
+
+
+class TimedCapture:
+    """cv2.VideoCapture that adds the time spent decoding to the decode stage."""
+
+    def __init__(self, video_capture: cv2.VideoCapture, timer: StageTimer):
+        self.video_capture = video_capture
+        self.read = timer.wrap(video_capture.read, "decode")
+        self.grab = timer.wrap(video_capture.grab, "decode")
+        self.retrieve = timer.wrap(video_capture.retrieve, "decode")
+
+    def get(self, prop_id):
+        return self.video_capture.get(prop_id)
+
+    def release(self):
+        self.video_capture.release()
+
+
+class TimedWriter:
+    """cv2.VideoWriter that adds the time spent encoding to the encode stage."""
+
+    def __init__(self, video_writer: cv2.VideoWriter, timer: StageTimer):
+        self.video_writer = video_writer
+        self.write = timer.wrap(video_writer.write, "encode")
+
+    def release(self):
+        self.video_writer.release()
+
+
+def get_peak_rss_mb() -> float:
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    return peak_rss / (1024 * 1024) if sys.platform == "darwin" else peak_rss / 1024
+
+
+def get_git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def count_switches(cameras: List[int]) -> int:
+    return int(np.count_nonzero(np.diff(cameras))) if len(cameras) > 1 else 0
+
+
+def run_mixer_benchmark(mixer_type: str, match: SyntheticMatch, output_path: str) -> Dict:
+    """Mix the synthetic match with mixer_type sequentially and measure it. Frames are read and written on the
+    calling thread, so that the stage times add up to the wall time."""
+    timer = StageTimer()
+    mixer = get_mixer(mixer_type)
+
+    # score is measured as the time in vote() that is not spent preparing frames, decide as the time in decide()
+    # that is not spent in vote()
+    mixer.prepare = timer.wrap(mixer.prepare, "prepare")
+    mixer.vote = timer.wrap(mixer.vote, "vote")
+    cameras = []
+    decide = timer.wrap(mixer.decide, "decide_total")
+    reset = mixer.reset
+
+    def record_decision(frame_index, frame_left, frame_right):
+        camera = decide(frame_index, frame_left, frame_right)
+        cameras.append(camera)
+        return camera
+
+    def record_first_decision(frame_left, frame_right):
+        camera = reset(frame_left, frame_right)
+        cameras.append(camera)
+        return camera
+
+    mixer.decide = record_decision
+    mixer.reset = record_first_decision
+
+    video_capture_left = TimedCapture(cv2.VideoCapture(match.video_left_path), timer)
+    video_capture_right = TimedCapture(cv2.VideoCapture(match.video_right_path), timer)
+    video_output = TimedWriter(cv2.VideoWriter(output_path, cv2.VideoWriter_fourcc('M', 'J', 'P', 'G'), match.fps,
+                                               (match.width, match.height)), timer)
+
+    total_frames = len(match.ground_truth)
+    start = time.perf_counter()
+    try:
+        _, first_left = video_capture_left.read()
+        _, first_right = video_capture_right.read()
+
+        setup_start = time.perf_counter()
+        mixer.setup(first_left, first_right, match.fps)
+        timer.totals["setup"] += time.perf_counter() - setup_start
+
+        mixer.mix_frames(video_capture_left, video_capture_right, video_output, first_left, first_right,
+                         start_frame=0, end_frame=total_frames)
+    finally:
+        video_capture_left.release()
+        video_capture_right.release()
+        video_output.release()
+    wall_time = time.perf_counter() - start
+
+    n_frames = len(cameras)
+    ground_truth = match.ground_truth[:n_frames]
+
+    stages = {
+        "setup": timer.totals["setup"],
+        "decode": timer.totals["decode"],
+        "prepare": timer.totals["prepare"],
+        "score": timer.totals["vote"] - timer.totals["prepare"],
+        "decide": timer.totals["decide_total"] - timer.totals["vote"],
+        "encode": timer.totals["encode"]
+    }
+
+    return {
+        "mixer": mixer_type,
+        "frames": n_frames,
+        "wall_time": wall_time,
+        "fps": n_frames / wall_time if wall_time > 0 else None,
+        "stages": stages,
+        "other": wall_time - sum(stages.values()),
+        "peak_rss_mb": get_peak_rss_mb(),
+        "accuracy": float(np.mean(np.array(cameras) == np.array(ground_truth))) if n_frames else None,
+        "switches": count_switches(cameras),
+        "ground_truth_switches": count_switches(ground_truth)
+    }
+
+
+def run_threaded_mixer_benchmark(mixer_type: str, match: SyntheticMatch, output_path: str) -> Dict:
+    """Mix the synthetic match with mixer_type with mix_video and threaded_io, so decoding, analysis and encoding
+    overlap. Stages overlap too, so only the wall time is measured."""
+    mixer = get_mixer(mixer_type)
+    cameras = []
+    decide = mixer.decide
+    reset = mixer.reset
+
+    def record_decision(frame_index, frame_left, frame_right):
+        camera = decide(frame_index, frame_left, frame_right)
+        cameras.append(camera)
+        return camera
+
+    def record_first_decision(frame_left, frame_right):
+        camera = reset(frame_left, frame_right)
+        cameras.append(camera)
+        return camera
+
+    mixer.decide = record_decision
+    mixer.reset = record_first_decision
+
+    start = time.perf_counter()
+    mixer.mix_video(cv2.VideoCapture(match.video_left_path), cv2.VideoCapture(match.video_right_path), output_path,
+                    input_fps=match.fps, output_fps=match.fps, output_height=match.height, output_width=match.width,
+                    threaded_io=True)
+    wall_time = time.perf_counter() - start
+
+    n_frames = len(cameras)
+    ground_truth = match.ground_truth[:n_frames]
+
+    return {
+        "mixer": mixer_type,
+        "threaded_io": True,
+        "frames": n_frames,
+        "wall_time": wall_time,
+        "fps": n_frames / wall_time if wall_time > 0 else None,
+        "peak_rss_mb": get_peak_rss_mb(),
+        "accuracy": float(np.mean(np.array(cameras) == np.array(ground_truth))) if n_frames else None,
+        "switches": count_switches(cameras),
+        "ground_truth_switches": count_switches(ground_truth)
+    }
+
+
+def run_benchmarks(mixer_types: List[str], match: SyntheticMatch, work_dir: str,
+                   threaded_io: bool = False) -> List[Dict]:
+    results = []
+    benchmark = run_threaded_mixer_benchmark if threaded_io else run_mixer_benchmark
+    # Fresh process for every mixer, so that peak RSS is not shared between them
+    context = multiprocessing.get_context("spawn")
+    for mixer_type in mixer_types:
+        logger.info(f"Benchmarking {mixer_type} mixer")
+        output_path = os.path.join(work_dir, f"mixed_{mixer_type}.avi")
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            result = executor.submit(benchmark, mixer_type, match, output_path).result()
+        logger.info(f"{mixer_type}: {result['fps']:.1f} fps, accuracy {result['accuracy']:.3f}, "
+                    f"peak RSS {result['peak_rss_mb']:.0f} MB")
+        results.append(result)
+    return results
+
+
+def compare_results(results: List[Dict], previous_path: str):
+    with open(previous_path, 'r') as f:
+        previous = {result['mixer']: result for result in json.load(f)['results']}
+
+    for result in results:
+        if result['mixer'] not in previous:
+            continue
+        old = previous[result['mixer']]
+        logger.info(f"{result['mixer']}: {old['fps']:.1f} -> {result['fps']:.1f} fps "
+                    f"({result['fps'] / old['fps']:.2f}x), accuracy {old['accuracy']:.3f} -> "
+                    f"{result['accuracy']:.3f}")
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Benchmark mixers on synthetic two camera footage")
+    parser.add_argument("--mixers", nargs="+", default=None, choices=available_mixers(),
+                        help="mixers to benchmark (default all)")
+    parser.add_argument("--duration", default=60, type=float, help="length of the synthetic match in seconds")
+    parser.add_argument("--fps", default=30, type=int, help="fps of the synthetic match")
+    parser.add_argument("--width", default=1280, type=int, help="frame width of the synthetic match")
+    parser.add_argument("--height", default=720, type=int, help="frame height of the synthetic match")
+    parser.add_argument("--segment-duration", default=10, type=float,
+                        help="average time in seconds before the action changes side")
+    parser.add_argument("--seed", default=0, type=int, help="seed of the synthetic match")
+    parser.add_argument("--work-dir", default=None, help="directory for the clips (default temporary directory)")
+    parser.add_argument("--output", default="mixer_benchmark.json", help="path of the JSON result file")
+    parser.add_argument("--compare", default=None, help="previous JSON result file to compare against")
+    parser.add_argument("--threaded-io", default=False, action='store_true', dest="threaded_io",
+                        help="mix with mix_video and threaded I/O, measures only the wall time")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    mixer_types = args.mixers or available_mixers()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        work_dir = args.work_dir or temp_dir
+        os.makedirs(work_dir, exist_ok=True)
+
+        logger.info(f"Generating {args.duration} s synthetic match at {args.width}x{args.height}")
+        match = generate_synthetic_match(work_dir, duration=args.duration, fps=args.fps, width=args.width,
+                                         height=args.height, segment_duration=args.segment_duration, seed=args.seed)
+
+        results = run_benchmarks(mixer_types, match, work_dir, args.threaded_io)
+
+    report = {
+        "timestamp": datetime.now().isoformat(),
+        "commit": get_git_commit(),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "opencv": cv2.__version__,
+        "cpu_count": os.cpu_count(),
+        "footage": {
+            "duration": args.duration,
+            "fps": args.fps,
+            "width": args.width,
+            "height": args.height,
+            "segment_duration": args.segment_duration,
+            "seed": args.seed
+        },
+        "results": results
+    }
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    logger.info(f"Results written to {args.output}")
+
+    if args.compare:
+        compare_results(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
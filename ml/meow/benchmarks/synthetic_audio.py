@@ -0,0 +1,111 @@
+import os
+from dataclasses import dataclass
+
+import numpy as np
+import soundfile as sf
+
+from ..utils.audio_utils import AudioFilterChain
+
+# Audio is generated and written this many seconds at a time, so 2 hour tracks do not have to fit in memory
+GENERATE_BLOCK_SEC = 60
+
+
+@dataclass
+class SyntheticAudioPair:
+    """Two mono float32 tracks of the same match stored as raw files like AudioStore, with known delay and drift.
+
+    delay_ms is the delay at the start of the first track, positive if events happen later in the first track, and
+    drift_ppm the change of the delay in parts per million of time, same as OffsetMap.
+    """
+    audio1_path: str
+    audio2_path: str
+    sample_rate: int
+    duration: float
+    delay_ms: float
+    drift_ppm: float
+
+    def load(self):
+        """Tracks as read only memory maps."""
+        return (np.memmap(self.audio1_path, dtype=np.float32, mode='r'),
+                np.memmap(self.audio2_path, dtype=np.float32, mode='r'))
+
+    def write_wav(self, work_dir: str):
+        """Write both tracks as 16 bit WAV files for estimators that load audio files. Returns the paths."""
+        paths = []
+        for name, audio in zip(("audio1", "audio2"), self.load()):
+            path = os.path.join(work_dir, f"{name}.wav")
+            with sf.SoundFile(path, 'w', self.sample_rate, 1, 'PCM_16') as f:
+                block_size = GENERATE_BLOCK_SEC * self.sample_rate
+                for start in range(0, len(audio), block_size):
+                    f.write(np.clip(audio[start:start + block_size], -1, 1))
+            paths.append(path)
+        return paths
+
+
+def generate_source_block(n_samples: int, sample_rate: int, chain: AudioFilterChain,
+                          rng: np.random.Generator) -> np.ndarray:
+    """Crowd noise with slowly changing level, occasional whistles and frequent short broadband hits like kicks and
+    claps."""
+    crowd = chain.process(rng.standard_normal(n_samples))
+    level = np.interp(np.arange(n_samples), np.linspace(0, n_samples, 8), rng.uniform(0.05, 0.2, 8))
+    block = crowd * level
+
+    duration = n_samples / sample_rate
+    for _ in range(rng.poisson(duration / 30)):
+        start = int(rng.integers(0, n_samples))
+        t = np.arange(min(int(rng.uniform(0.3, 1.0) * sample_rate), n_samples - start)) / sample_rate
+        block[start:start + len(t)] += 0.4 * np.sin(2 * np.pi * rng.uniform(2500, 3500) * t)
+
+    for _ in range(rng.poisson(duration * 2)):
+        start = int(rng.integers(0, n_samples))
+        length = min(int(0.01 * sample_rate), n_samples - start)
+        hit = rng.standard_normal(length) * np.exp(-np.arange(length) / (0.002 * sample_rate))
+        block[start:start + length] += rng.uniform(0.2, 0.8) * hit
+
+    return block
+
+
+def generate_synthetic_audio_pair(work_dir: str, duration: float = 60, sample_rate: int = 22050,
+                                  delay_sec: float = 1.2345, drift_ppm: float = 0.0, noise_level: float = 0.01,
+                                  gain: float = 1.0, seed: int = 0,
+                                  block_sec: float = GENERATE_BLOCK_SEC) -> SyntheticAudioPair:
+    """
+    Generate two tracks of duration seconds from the same source. Second track is scaled by gain, and both get
+    independent white noise of noise_level. Track 1 at time t matches track 2 at t * (1 - drift) - delay_sec.
+    """
+    rng = np.random.default_rng(seed)
+    drift = drift_ppm * 1e-6
+    n_samples = int(duration * sample_rate)
+    block_size = int(block_sec * sample_rate)
+    delay_samples = delay_sec * sample_rate
+
+    # Source covers both tracks: track 1 starts at pad and track 2 maps to pad + (u + delay) / (1 - drift)
+    pad = int(max(0.0, -delay_samples)) + sample_rate
+    source_length = pad + int(abs(delay_samples) + n_samples * (1 + 2 * abs(drift))) + 2 * sample_rate
+    source_path = os.path.join(work_dir, "source.f32")
+    source = np.memmap(source_path, dtype=np.float32, mode='w+', shape=(source_length,))
+    chain = AudioFilterChain(sample_rate).add_lowpass(3000)
+    for start in range(0, source_length, block_size):
+        source[start:start + block_size] = generate_source_block(min(block_size, source_length - start),
+                                                                 sample_rate, chain, rng)
+    source.flush()
+
+    audio1_path = os.path.join(work_dir, "audio1.f32")
+    audio2_path = os.path.join(work_dir, "audio2.f32")
+    audio1 = np.memmap(audio1_path, dtype=np.float32, mode='w+', shape=(n_samples,))
+    audio2 = np.memmap(audio2_path, dtype=np.float32, mode='w+', shape=(n_samples,))
+    for start in range(0, n_samples, block_size):
+        end = min(start + block_size, n_samples)
+        audio1[start:end] = source[pad + start:pad + end] + rng.standard_normal(end - start) * noise_level
+
+        positions = pad + (np.arange(start, end) + delay_samples) / (1 - drift)
+        first = int(np.floor(positions[0]))
+        samples = source[first:int(np.ceil(positions[-1])) + 2]
+        audio2[start:end] = (gain * np.interp(positions - first, np.arange(len(samples)), samples)
+                             + rng.standard_normal(end - start) * noise_level)
+    audio1.flush()
+    audio2.flush()
+    del source
+    os.remove(source_path)
+
+    return SyntheticAudioPair(audio1_path, audio2_path, sample_rate, duration, delay_sec * 1000, drift_ppm)
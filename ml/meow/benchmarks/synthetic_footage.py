@@ -0,0 +1,138 @@
+import os
+from dataclasses import dataclass, field
+from typing import List, Tuple
+
+import cv2
+import numpy as np
+
+from ..switch_history import LEFT_CAMERA, RIGHT_CAMERA
+
+FIELD_COLOR = (60, 170, 60)
+STANDS_COLOR = (30, 30, 30)
+PLAYER_COLORS = ((255, 255, 255), (40, 40, 220))
+
+
+@dataclass
+class SyntheticMatch:
+    """Synchronized left and right camera clips with the camera that shows the action on each frame."""
+    video_left_path: str
+    video_right_path: str
+    fps: int
+    width: int
+    height: int
+    ground_truth: List[int] = field(default_factory=list)
+
+
+def create_action_timeline(n_frames: int, fps: int, segment_duration: float, rng: np.random.Generator) -> List[int]:
+    """Alternate the action between cameras in segments of 0.5 - 1.5 times segment_duration."""
+    ground_truth = []
+    camera = LEFT_CAMERA
+    while len(ground_truth) < n_frames:
+        segment_frames = max(1, round(rng.uniform(0.5, 1.5) * segment_duration * fps))
+        ground_truth.extend([camera] * segment_frames)
+        camera = RIGHT_CAMERA if camera == LEFT_CAMERA else LEFT_CAMERA
+    return ground_truth[:n_frames]
+
+
+class PlayerGroup:
+    """Blobs moving inside horizontal range (x_min, x_max) of the frame, given as fractions of the frame width.
+    Active groups run around the range, passive groups only jitter in place."""
+
+    def __init__(self, n_players: int, x_range: Tuple[float, float], width: int, height: int, field_top: int,
+                 active: bool, rng: np.random.Generator):
+        self.x_min = int(x_range[0] * width)
+        self.x_max = int(x_range[1] * width)
+        self.y_min = field_top + height // 20
+        self.y_max = height - height // 20
+        self.active = active
+        self.rng = rng
+        self.positions = np.column_stack([
+            rng.uniform(self.x_min, self.x_max, n_players),
+            rng.uniform(self.y_min, self.y_max, n_players)
+        ])
+        speed = width / 640
+        self.velocities = rng.uniform(-8, 8, (n_players, 2)) * speed if active else np.zeros((n_players, 2))
+
+    def step(self):
+        if self.active:
+            self.positions += self.velocities
+            for axis, (low, high) in enumerate(((self.x_min, self.x_max), (self.y_min, self.y_max))):
+                out_of_range = (self.positions[:, axis] < low) | (self.positions[:, axis] > high)
+                self.velocities[out_of_range, axis] *= -1
+                self.positions[:, axis] = np.clip(self.positions[:, axis], low, high)
+        else:
+            self.positions += self.rng.integers(-1, 2, self.positions.shape)
+
+    def draw(self, frame: np.ndarray, radius: int):
+        for i, (x, y) in enumerate(self.positions.astype(int)):
+            cv2.circle(frame, (int(x), int(y)), radius, PLAYER_COLORS[i % 2], -1)
+
+
+def create_background(width: int, height: int) -> Tuple[np.ndarray, int]:
+    """Green field with dark stands on top, so that field detection finds the field."""
+    background = np.empty((height, width, 3), np.uint8)
+    background[:] = FIELD_COLOR
+    field_top = height // 6
+    background[:field_top] = STANDS_COLOR
+    return background, field_top
+
+
+def generate_synthetic_match(work_dir: str, duration: float = 60, fps: int = 30, width: int = 640,
+                             height: int = 360, segment_duration: float = 10, n_players: int = 8,
+                             seed: int = 0) -> SyntheticMatch:
+    """Render deterministic left and right camera clips of a match on a green field.
+
+    Left camera covers the left half of the field and right camera the right half. When the action is on one half,
+    players in that camera run around, while the players seen by the other camera stand near the centre line. Same
+    seed gives the same clips.
+    """
+    rng = np.random.default_rng(seed)
+    n_frames = round(duration * fps)
+    ground_truth = create_action_timeline(n_frames, fps, segment_duration, rng)
+
+    background, field_top = create_background(width, height)
+    radius = max(2, height // 40)
+
+    # Centre line is at the right edge of left camera and at the left edge of right camera
+    active_ranges = {LEFT_CAMERA: (0.05, 0.55), RIGHT_CAMERA: (0.45, 0.95)}
+    passive_ranges = {LEFT_CAMERA: (0.7, 0.95), RIGHT_CAMERA: (0.05, 0.3)}
+
+    match = SyntheticMatch(
+        video_left_path=os.path.join(work_dir, f"synthetic_left_{seed}.avi"),
+        video_right_path=os.path.join(work_dir, f"synthetic_right_{seed}.avi"),
+        fps=fps,
+        width=width,
+        height=height,
+        ground_truth=ground_truth
+    )
+
+    fourcc = cv2.VideoWriter_fourcc('M', 'J', 'P', 'G')
+    writers = {
+        LEFT_CAMERA: cv2.VideoWriter(match.video_left_path, fourcc, fps, (width, height)),
+        RIGHT_CAMERA: cv2.VideoWriter(match.video_right_path, fourcc, fps, (width, height))
+    }
+
+    groups = {}
+    action_camera = None
+
+    try:
+        for camera in ground_truth:
+            if camera != action_camera:
+                # Players move to the new positions when the action changes side
+                action_camera = camera
+                groups = {
+                    view: PlayerGroup(n_players, active_ranges[view] if view == camera else passive_ranges[view],
+                                      width, height, field_top, view == camera, rng)
+                    for view in (LEFT_CAMERA, RIGHT_CAMERA)
+                }
+
+            for view, writer in writers.items():
+                groups[view].step()
+                frame = background.copy()
+                groups[view].draw(frame, radius)
+                writer.write(frame)
+    finally:
+        for writer in writers.values():
+            writer.release()
+
+    return match
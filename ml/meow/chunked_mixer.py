@@ -0,0 +1,149 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Callable, Dict, List, Optional
+
+import cv2
+
+from .mixer_registry import get_mixer
+from .utils.file_utils import create_temporary_file_name_with_extension
+from .utils.video_utils import ffmpeg_concatenate_video_clips
+from .logger import setup_logger
+
+logger = setup_logger(__name__)
+
+
+def split_to_chunks(total_frames: int, chunk_frames: int, frames_per_flow: int) -> List[Dict]:
+    """Split frame range to chunks whose boundaries are on flow calculation frames."""
+    chunk_frames = max(frames_per_flow, chunk_frames - chunk_frames % frames_per_flow)
+    return [
+        {'start_frame': start_frame, 'end_frame': min(start_frame + chunk_frames, total_frames)}
+        for start_frame in range(0, total_frames, chunk_frames)
+    ]
+
+
+def mix_chunk(chunk: Dict) -> str:
+    """Mix frames [start_frame, end_frame) of the videos to chunk output path.
+
+    Engine is set up with the setup state, e.g. field masks, that mix_video_in_chunks detected once from the first
+    frames of the videos, so every chunk uses the same masks as when mixing the whole video in one go. Decision history
+    is rebuilt by analysing history_length flow frames before the chunk without writing them, so the camera choice
+    at chunk start is the same as when mixing the whole video. With hysteresis, minimum dwell time or smoothing the
+    choice can differ for a moment after the chunk boundary, because those depend on decisions made before the warm
+    up.
+    """
+    # Chunks run in parallel processes, avoid oversubscribing cores with OpenCV threads
+    cv2.setNumThreads(1)
+
+    start_frame = chunk['start_frame']
+    end_frame = chunk['end_frame']
+    mixer = get_mixer(chunk['mixer_type'], **chunk['mixer_kwargs'])
+
+    video_capture_left = cv2.VideoCapture(chunk['video_left_path'])
+    video_capture_right = cv2.VideoCapture(chunk['video_right_path'])
+    video_output = cv2.VideoWriter(chunk['output_path'], chunk['fourcc'], chunk['output_fps'],
+                                   (chunk['output_width'], chunk['output_height']))
+
+    try:
+        _, first_left = video_capture_left.read()
+        _, first_right = video_capture_right.read()
+
+        if first_left is None or first_right is None:
+            raise ValueError("Could not read first frames from videos")
+
+        mixer.setup(first_left, first_right, chunk['input_fps'], chunk['setup_state'])
+
+        warmup_start = max(0, start_frame - mixer.history_length * mixer.frames_per_flow)
+        warmup_start -= warmup_start % mixer.frames_per_flow
+
+        if warmup_start > 0:
+            video_capture_left.set(cv2.CAP_PROP_POS_FRAMES, warmup_start)
+            video_capture_right.set(cv2.CAP_PROP_POS_FRAMES, warmup_start)
+            _, first_left = video_capture_left.read()
+            _, first_right = video_capture_right.read()
+
+            if first_left is None or first_right is None:
+                raise ValueError(f"Could not read frame {warmup_start} from videos")
+
+        # During warm up only the frames used for analysis are decoded
+        mixer.mix_frames(video_capture_left, video_capture_right, video_output, first_left, first_right,
+                         start_frame=warmup_start, end_frame=end_frame, write_start=start_frame)
+    finally:
+        video_capture_left.release()
+        video_capture_right.release()
+        video_output.release()
+
+    return chunk['output_path']
+
+
+def mix_video_in_chunks(video_left_path: str, video_right_path: str, video_output_path: str, temp_dir: str,
+                        file_type: str, mixer_type: str = "abs_diff", mixer_kwargs: Optional[Dict] = None,
+                        n_workers: Optional[int] = None, chunk_duration: float = 300, input_fps: int = 30,
+                        output_fps: int = 30, output_height: int = 1080, output_width: int = 1920,
+                        fourcc: cv2.VideoWriter_fourcc = cv2.VideoWriter_fourcc('M', 'J', 'P', 'G'),
+                        progress_callback: Optional[Callable[[int], None]] = None) -> str:
+    """Mix synchronized videos with mixer engine mixer_type like VideoMixerBase.mix_video, but split them to chunks
+    of chunk_duration seconds that are mixed in parallel processes. mixer_kwargs are passed to the engine in every
+    worker. Chunk outputs are joined with the concat demuxer. Both videos are seeked to the same frame index, so
+    chunks stay synchronized."""
+
+    if output_fps > input_fps:
+        raise ValueError("Output fps cannot be higher than input fps")
+
+    video_capture_left = cv2.VideoCapture(video_left_path)
+    video_capture_right = cv2.VideoCapture(video_right_path)
+
+    left_n_frames = int(video_capture_left.get(cv2.CAP_PROP_FRAME_COUNT)) - 1
+    right_n_frames = int(video_capture_right.get(cv2.CAP_PROP_FRAME_COUNT)) - 1
+    total_frames = min(left_n_frames, right_n_frames)
+
+    _, first_left = video_capture_left.read()
+    _, first_right = video_capture_right.read()
+
+    video_capture_left.release()
+    video_capture_right.release()
+
+    if first_left is None or first_right is None:
+        raise ValueError("Could not read first frames from videos")
+
+    mixer_kwargs = mixer_kwargs or {}
+    # Field masks are detected once here and passed to the workers
+    mixer = get_mixer(mixer_type, **mixer_kwargs)
+    mixer.setup(first_left, first_right, input_fps)
+    # Chunk boundaries are aligned to analysis frames of the engine
+    chunks = split_to_chunks(total_frames, round(chunk_duration * input_fps), mixer.frames_per_flow)
+
+    for chunk in chunks:
+        chunk.update({
+            'video_left_path': video_left_path,
+            'video_right_path': video_right_path,
+            'output_path': create_temporary_file_name_with_extension(temp_dir, file_type),
+            'mixer_type': mixer_type,
+            'mixer_kwargs': mixer_kwargs,
+            'setup_state': mixer.get_setup_state(),
+            'input_fps': input_fps,
+            'fourcc': fourcc,
+            'output_fps': output_fps,
+            'output_width': output_width,
+            'output_height': output_height
+        })
+
+    n_workers = n_workers or os.cpu_count()
+    logger.info(f"Mixing {total_frames} frames in {len(chunks)} chunks with {n_workers} workers")
+
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        futures = [executor.submit(mix_chunk, chunk) for chunk in chunks]
+        for n_done, future in enumerate(as_completed(futures), start=1):
+            # Raise errors from workers
+            future.result()
+            if progress_callback:
+                progress_callback(int((n_done / len(chunks)) * 100))
+
+    chunk_paths = [chunk['output_path'] for chunk in chunks]
+    if len(chunk_paths) == 1:
+        os.replace(chunk_paths[0], video_output_path)
+    else:
+        ffmpeg_concatenate_video_clips(chunk_paths, output_path=video_output_path)
+        for chunk_path in chunk_paths:
+            os.remove(chunk_path)
+
+    return video_output_path
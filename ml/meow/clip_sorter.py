@@ -1,216 +1,249 @@
-from typing import Mapping, List
-import sys
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Mapping, List, Optional
+import re
 import os
 
-from .utils.video_utils import get_video_info, get_last_frame
-import cv2
+from .utils.video_utils import get_video_metadata, read_thumbnail, timecode_to_seconds
 import numpy as np
+from scipy.optimize import linear_sum_assignment
 from .logger import setup_logger
 
 logger = setup_logger(__name__)
 
+# GOPRxxxx is the first chapter of recording xxxx on older GoPros, GPccxxxx the following chapters, and GHccxxxx
+# (H.264) or GXccxxxx (HEVC) chapter cc on HERO6 and newer
+GOPRO_CHAPTER_PATTERN = re.compile(r'^(?:GOPR|G[PHX](?P<chapter>\d{2}))(?P<recording>\d{4})\.', re.IGNORECASE)
 
-def calculate_video_file_linking(video_file_paths: List[str], similarity_threshold: float = 5) -> List:
+# Width of the grayscale thumbnails compared when clips are linked by their frames
+THUMBNAIL_WIDTH = 320
+
+# Clips ordered by recording time may overlap this much, as creation time has one second resolution
+METADATA_OVERLAP_TOLERANCE = 2.0
+
+# Pixels whose gray levels differ more than this are counted as different in frame distances
+PIXEL_DIFFERENCE_THRESHOLD = 50
+
+# Bounds the memory of the broadcasted frame distances to this many pixel differences at a time
+MAX_DISTANCE_BLOCK_ELEMENTS = 1 << 26
+
+# Cost of links that are not allowed in the chain assignment, larger than any frame distance
+FORBIDDEN_LINK_COST = 1e6
+
+# Default number of files probed and thumbnails extracted in parallel, each runs its own ffprobe/ffmpeg process
+DEFAULT_SORT_WORKERS = min(8, os.cpu_count() or 1)
+
+
+def calculate_video_file_linking(video_file_paths: List[str], n_workers: Optional[int] = None) -> List:
+    """Order clips of one camera. Tries GoPro chapter file names first, then recording time metadata of the clips,
+    and only if neither gives a consistent order, links clips by comparing their first and last frames. Files are
+    probed and frames extracted with n_workers parallel workers (default DEFAULT_SORT_WORKERS)."""
     logger.info("Calculating video file links")
 
     # Trivial case: only one video
     if len(video_file_paths) == 1:
         return video_file_paths
 
-    # Extract frames first
-    frame_mapping = extract_end_frames(video_file_paths)
-    
-    # Calculate similarity matrix
-    similarity_matrix = calculate_similarity_matrix(video_file_paths, frame_mapping)
-    
-    n_files = len(video_file_paths)
-
-    # Find N-1 best matches (excluding diagonal and duplicates)
-    matches = set()  # Use set to avoid duplicates
-    for i in range(2 * n_files):
-        for j in range(2 * n_files):
-            # Skip diagonal elements and lower triangle
-            if i//2 < j//2:  # Different files, upper triangle only
-                matches.add((i, j, similarity_matrix[i][j]))
-    
-    # Sort by similarity score
-    matches = sorted(matches, key=lambda x: x[2])
-    best_matches = matches[:n_files-1]
-    
-    # Build video mapping from best matches
-    video_end_to_start_mapping = {}
-    for i, j, score in best_matches:
-        # If comparing first frame of file i (i is even)
-        # then file j's last frame matches file i's first frame
-        # so the link should be from j to i
-        if i % 2 == 0:
-            file1 = video_file_paths[j//2]  # From file with matching last frame
-            file2 = video_file_paths[i//2]  # To file with matching first frame
-        # If comparing last frame of file i (i is odd)
-        # then file i's last frame matches file j's first frame
-        # so the link should be from i to j
-        else:
-            file1 = video_file_paths[i//2]  # From file with matching last frame
-            file2 = video_file_paths[j//2]  # To file with matching first frame
-            
-        logger.debug(f"Best match: {os.path.basename(file1)} -> {os.path.basename(file2)} (score: {score:.4f})")
-        add_edge(video_end_to_start_mapping, file1, file2)
-    
-    try:
-        video_file_linking = find_linking(video_end_to_start_mapping)
-        return video_file_linking
-    except RuntimeError as e:
-        logger.error("Failed to find valid video linking with best matches")
-        raise
+    chapter_order = order_by_gopro_chapters(video_file_paths)
+    if chapter_order is not None:
+        logger.info("Ordered videos by GoPro chapter numbers")
+        return chapter_order
 
+    video_infos = probe_videos(video_file_paths, n_workers)
+    metadata_order = order_by_recording_time(video_file_paths, video_infos)
+    if metadata_order is not None:
+        logger.info("Ordered videos by recording time metadata")
+        return metadata_order
 
-def extract_end_frames(video_file_paths: List[str]) -> Mapping:
-    frame_mapping = {}
+    logger.info("Linking videos by comparing first and last frames")
 
+    # Extract frames first
+    frame_mapping = extract_end_frames(video_file_paths, video_infos, n_workers)
+    
+    firsts, lasts, missing = stack_thumbnails(video_file_paths, frame_mapping)
+    link_costs = calculate_link_costs(lasts, firsts)
+    # Clips whose frames could not be read get the highest cost to every other clip
+    link_costs[missing, :] = 255.0
+    link_costs[:, missing] = 255.0
+
+    order = solve_chain(link_costs)
+    for previous, current in zip(order, order[1:]):
+        logger.debug(f"Link: {os.path.basename(video_file_paths[previous])} -> "
+                     f"{os.path.basename(video_file_paths[current])} (score: {link_costs[previous, current]:.4f})")
+    return [video_file_paths[i] for i in order]
+
+
+def order_by_gopro_chapters(video_file_paths: List[str]) -> Optional[List[str]]:
+    """Order chapters of one GoPro recording by their file names. Returns None unless all files are consecutive
+    chapters of the same recording."""
+    chapters = {}
+    recordings = set()
     for file_path in video_file_paths:
+        match = GOPRO_CHAPTER_PATTERN.match(os.path.basename(file_path))
+        if match is None:
+            return None
+        chapter = int(match.group('chapter') or 0)
+        if chapter in chapters:
+            return None
+        chapters[chapter] = file_path
+        recordings.add(match.group('recording'))
+
+    first_chapter = min(chapters)
+    if len(recordings) != 1 or sorted(chapters) != list(range(first_chapter, first_chapter + len(chapters))):
+        return None
+    return [chapters[chapter] for chapter in sorted(chapters)]
+
+
+def get_sort_workers(n_files: int, n_workers: Optional[int] = None) -> int:
+    return max(1, min(n_workers or DEFAULT_SORT_WORKERS, n_files))
+
+
+def probe_videos(video_file_paths: List[str], n_workers: Optional[int] = None) -> Dict[str, dict]:
+    """Video info with recording time metadata of all files, probed in parallel."""
+    with ThreadPoolExecutor(max_workers=get_sort_workers(len(video_file_paths), n_workers)) as executor:
+        return dict(zip(video_file_paths, executor.map(get_video_metadata, video_file_paths)))
+
+
+def order_by_recording_time(video_file_paths: List[str], video_infos: Mapping) -> Optional[List[str]]:
+    """Order clips by recording start time. Returns None if a clip has no recording time, or if the clips are not
+    consecutive: start times must differ and a clip must not start before the previous one has ended."""
+    # Timecodes and creation times are not comparable, so use timecodes only if every clip has one
+    use_timecode = all(video_infos[path]['timecode'] is not None for path in video_file_paths)
+    starts = {}
+    for path in video_file_paths:
+        video_info = video_infos[path]
+        if use_timecode:
+            starts[path] = timecode_to_seconds(video_info['timecode'], video_info['frame_rate'])
+        elif video_info['creation_time'] is not None:
+            starts[path] = video_info['creation_time'].timestamp()
+        else:
+            return None
+
+    order = sorted(video_file_paths, key=lambda path: starts[path])
+    for previous, current in zip(order, order[1:]):
+        previous_end = starts[previous] + video_infos[previous]['duration']
+        if starts[current] <= starts[previous] or starts[current] < previous_end - METADATA_OVERLAP_TOLERANCE:
+            logger.debug(f"Recording times of {os.path.basename(previous)} and {os.path.basename(current)} "
+                         f"overlap, cannot order by metadata")
+            return None
+    return order
 
-        video_info = get_video_info(file_path)
-        duration = video_info['duration']
-
-        capture = cv2.VideoCapture(file_path)
 
-        # Read first frame
-        capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
-        ret_first, first_frame = capture.read()
+def extract_end_frames(video_file_paths: List[str], video_infos: Mapping, n_workers: Optional[int] = None) -> Mapping:
+    """First frame and last keyframe of every file as small grayscale thumbnails, extracted in parallel without
+    reading the files through. Full resolution frames are never kept, so memory stays bounded for many files."""
 
-        # Read last frame
-        ret_last, last_frame = get_last_frame(capture, duration)
+    def extract(file_path):
+        video_info = video_infos[file_path]
+        width = THUMBNAIL_WIDTH
+        # Even height keeps the aspect ratio of the video
+        height = max(2, int(round(video_info['frame_height'] * width / video_info['frame_width'] / 2)) * 2)
+        first_frame = read_thumbnail(file_path, width, height, gray=True)
+        last_frame = read_thumbnail(file_path, width, height, last=True, gray=True)
 
-        if ret_first is False or ret_last is False:
-            logger.error(f"Failed to read frame from video {file_path}, first frame: {ret_first}, last frame: {ret_last}")
+        if first_frame is None or last_frame is None:
+            logger.error(f"Failed to read frame from video {file_path}, first frame: {first_frame is not None}, "
+                         f"last frame: {last_frame is not None}")
 
-        frame_mapping[file_path] = {
+        return {
             'first_frame': first_frame,
             'last_frame': last_frame
         }
 
-        capture.release()
+    with ThreadPoolExecutor(max_workers=get_sort_workers(len(video_file_paths), n_workers)) as executor:
+        return dict(zip(video_file_paths, executor.map(extract, video_file_paths)))
 
-    return frame_mapping
 
+def stack_thumbnails(video_file_paths: List[str], frame_mapping: Mapping):
+    """Stack first and last thumbnails of all files into (n_files, n_pixels) arrays. Frames that could not be read
+    are zeros and marked in the returned boolean mask."""
+    frames = [frame_mapping[path][key] for path in video_file_paths for key in ('first_frame', 'last_frame')]
+    shape = next((frame.shape for frame in frames if frame is not None), (1, 1))
+    missing = np.array([frame is None or frame.shape != shape for frame in frames]).reshape(-1, 2).any(axis=1)
 
-def calculate_similarity_matrix(video_file_paths: List[str], frame_mapping: Mapping) -> List[List[float]]:
-    # Build similarity matrix
-    n_files = len(video_file_paths)
-    similarity_matrix = [[0.0] * (2 * n_files) for _ in range(2 * n_files)]
-    
-    # Calculate similarities between all frames
-    for i, file1 in enumerate(video_file_paths):
-        frames1 = frame_mapping[file1]
-        for j, file2 in enumerate(video_file_paths):
-            frames2 = frame_mapping[file2]
-            
-            # Only calculate upper triangle to avoid duplicates
-            if i < j:
-                # Compare first frame of file1 to both frames of file2
-                similarity_matrix[i*2][j*2] = calculate_frame_similarity(
-                    frames1['first_frame'], frames2['first_frame'])
-                similarity_matrix[i*2][j*2+1] = calculate_frame_similarity(
-                    frames1['first_frame'], frames2['last_frame'])
-                
-                # Compare last frame of file1 to both frames of file2
-                similarity_matrix[i*2+1][j*2] = calculate_frame_similarity(
-                    frames1['last_frame'], frames2['first_frame'])
-                similarity_matrix[i*2+1][j*2+1] = calculate_frame_similarity(
-                    frames1['last_frame'], frames2['last_frame'])
-                
-                # Mirror the values to lower triangle
-                similarity_matrix[j*2][i*2] = similarity_matrix[i*2][j*2]
-                similarity_matrix[j*2][i*2+1] = similarity_matrix[i*2][j*2+1]
-                similarity_matrix[j*2+1][i*2] = similarity_matrix[i*2+1][j*2]
-                similarity_matrix[j*2+1][i*2+1] = similarity_matrix[i*2+1][j*2+1]
-
-    return similarity_matrix
-
-
-def calculate_frame_similarity(frame1, frame2):
-    gray1 = cv2.cvtColor(frame1, cv2.COLOR_BGR2GRAY)
-    gray2 = cv2.cvtColor(frame2, cv2.COLOR_BGR2GRAY)
-
-    frame_height = gray1.shape[0]
-    frame_width = gray1.shape[1]
-
-    n_pixels = frame_height * frame_width
-
-    diff_frame = cv2.absdiff(frame1, frame2)
-
-    thresh_frame = cv2.threshold(src=diff_frame, thresh=50, maxval=255, type=cv2.THRESH_BINARY)[1]
-
-    difference = np.sum(thresh_frame)
-    difference_per_pixel = difference / n_pixels
-
-    return difference_per_pixel
-
-
-def add_edge(mapping, node1, node2):
-    if node1 in mapping:
-        mapping[node1].append(node2)
-    else:
-        mapping[node1] = [node2]
-
-
-def find_linking(mapping) -> List[str]:
-    valid_linking = check_linking_valid(mapping)
-    if valid_linking is False:
-        raise RuntimeError("Cannot find linked list for videos mapping")
-
-    childs = [value[0] for value in mapping.values()]
-    keys = list(mapping.keys())
-
-    root_node = list(set(keys) - set(childs))[0]
-    order = [root_node]
-
-    next_node = None
-    last_node = root_node
-    for _ in range(len(mapping)):
-        next_node = mapping[last_node][0]
-        order.append(next_node)
-        last_node = next_node
+    stacked = np.zeros((len(frames), int(np.prod(shape))), dtype=np.uint8)
+    for i, frame in enumerate(frames):
+        if not missing[i // 2]:
+            stacked[i] = frame.reshape(-1)
+    return stacked[0::2], stacked[1::2], missing
 
-    return order
 
+def calculate_link_costs(frames1: np.ndarray, frames2: np.ndarray) -> np.ndarray:
+    """
+    Distances between all pairs of frames1 and frames2, given as (n_frames, n_pixels) uint8 arrays of gray frames.
+    Distance is the share of pixels differing more than PIXEL_DIFFERENCE_THRESHOLD gray levels, scaled to 0-255.
+
+    Computed with one broadcasted difference per block of frames1, blocks sized to keep memory bounded.
+    """
+    n_pixels = frames1.shape[1]
+    block_size = max(1, MAX_DISTANCE_BLOCK_ELEMENTS // max(1, len(frames2) * n_pixels))
+    frames2 = frames2.astype(np.int16)
+    costs = np.empty((len(frames1), len(frames2)))
+    for start in range(0, len(frames1), block_size):
+        block = frames1[start:start + block_size, None, :].astype(np.int16)
+        different = np.abs(block - frames2[None, :, :]) > PIXEL_DIFFERENCE_THRESHOLD
+        costs[start:start + block_size] = np.count_nonzero(different, axis=2) * 255.0 / n_pixels
+    return costs
+
+
+def solve_chain(link_costs: np.ndarray) -> List[int]:
+    """
+    Order of n nodes forming a chain, where link_costs[i, j] is the cost of node j following node i. Always returns
+    every node exactly once.
 
-def check_linking_valid(mapping):
-    """We want to check that
-        a) there is only one root node
-        b) the chain is not broken e.g. each node links to another node
-        c) there is only one child node that doesn't exist in keys
-        d) each node has exactly one parent except root node and each node has exactly one child
+    Successors are first chosen with a minimum cost assignment including a dummy node, which precedes the first and
+    follows the last node of the chain. Assignment can split into several cycles, which are merged pairwise by the
+    cheapest exchange of successors until a single cycle through the dummy node remains. Merging is a heuristic, so
+    the chain has the lowest total cost only if the assignment is a single cycle already.
     """
+    n_nodes = len(link_costs)
+    dummy = n_nodes
+    costs = np.zeros((n_nodes + 1, n_nodes + 1))
+    costs[:n_nodes, :n_nodes] = link_costs
+    np.fill_diagonal(costs, FORBIDDEN_LINK_COST)
+
+    _, successors = linear_sum_assignment(costs)
+    successors = successors.tolist()
+
+    cycles = find_cycles(successors)
+    if len(cycles) > 1:
+        logger.debug(f"Merging {len(cycles)} cycles of the clip assignment")
+    while len(cycles) > 1:
+        best = None
+        for a in range(len(cycles)):
+            for b in range(a + 1, len(cycles)):
+                nodes1 = np.array(cycles[a])
+                nodes2 = np.array(cycles[b])
+                next1 = np.array([successors[node] for node in nodes1])
+                next2 = np.array([successors[node] for node in nodes2])
+                # Cost change of linking node1 to the successor of node2 and node2 to the successor of node1
+                delta = (costs[nodes1[:, None], next2[None, :]] + costs[nodes2[None, :], next1[:, None]]
+                         - costs[nodes1, next1][:, None] - costs[nodes2, next2][None, :])
+                i, j = np.unravel_index(int(np.argmin(delta)), delta.shape)
+                if best is None or delta[i, j] < best[0]:
+                    best = (delta[i, j], int(nodes1[i]), int(nodes2[j]))
+        _, node1, node2 = best
+        successors[node1], successors[node2] = successors[node2], successors[node1]
+        cycles = find_cycles(successors)
+
+    order = []
+    node = successors[dummy]
+    while node != dummy:
+        order.append(node)
+        node = successors[node]
+    return order
+
 
-    childs = [value[0] for value in mapping.values()]
-    keys = list(mapping.keys())
-
-    # a)
-    root_nodes = list(set(keys) - set(childs))
-    if len(root_nodes) != 1:
-        return False
-
-    # b)
-    visited_nodes = []
-    last_node = root_nodes[0]
-    next_node = None
-    for _ in range(len(mapping)):
-        next_nodes = mapping[last_node]
-        if len(next_nodes) != 1:
-            logger.error("Cannot determine video linking")
-            logger.debug(f"Video mapping: {mapping}")
-            sys.exit(1)
-        next_node = next_nodes[0]
-        visited_nodes.append(next_node)
-        last_node = next_node
-
-    if len(visited_nodes) != len(mapping):
-        return False
-
-    # c)
-    leafs = list(set(childs) - set(keys))
-    if len(leafs) != 1:
-        return False
-
-    return True
+def find_cycles(successors: List[int]) -> List[List[int]]:
+    cycles = []
+    visited = set()
+    for start in range(len(successors)):
+        if start in visited:
+            continue
+        cycle = []
+        node = start
+        while node not in visited:
+            visited.add(node)
+            cycle.append(node)
+            node = successors[node]
+        cycles.append(cycle)
+    return cycles
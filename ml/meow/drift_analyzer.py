@@ -0,0 +1,168 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from typing import List, Optional
+
+import numpy as np
+
+from .audio_synchronizer import calculate_audio_delay, refine_delay
+from .logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# Windows with lower normalized correlation than this are reported but not used in the drift fit
+MIN_WINDOW_CONFIDENCE = 0.05
+
+# Windows further than this from the fitted line are treated as outliers, e.g. echoes or announcements
+MAX_RESIDUAL_MS = 20.0
+
+
+@dataclass
+class OffsetWindow:
+    """Delay measured in one analysis window. Time is the middle of the window in the first audio in seconds."""
+    time: float
+    delay_ms: float
+    confidence: float
+    used: bool = False
+    residual_ms: Optional[float] = None
+
+
+@dataclass
+class OffsetMap:
+    """Time-varying delay between two recordings, modelled as a line fitted to windowed delay measurements.
+
+    delay_at(t) is the delay in milliseconds at time t seconds of the first audio, positive if events happen later in
+    the first audio than in the second, same as calculate_audio_delay. drift is the change of the delay per second,
+    i.e. the relative clock rate difference of the cameras.
+    """
+    base_delay_ms: float
+    drift: float
+    windows: List[OffsetWindow] = field(default_factory=list)
+
+    def delay_at(self, time: float) -> float:
+        return self.base_delay_ms + self.drift * time * 1000
+
+    @property
+    def drift_ms_per_hour(self) -> float:
+        return self.drift * 3600 * 1000
+
+    @property
+    def drift_ppm(self) -> float:
+        return self.drift * 1e6
+
+    @property
+    def confidence(self) -> float:
+        """Mean confidence of the windows used in the fit."""
+        used = [window.confidence for window in self.windows if window.used]
+        return float(np.mean(used)) if used else 0.0
+
+    def report(self) -> dict:
+        return {
+            'base_delay_ms': self.base_delay_ms,
+            'drift_ppm': self.drift_ppm,
+            'drift_ms_per_hour': self.drift_ms_per_hour,
+            'confidence': self.confidence,
+            'windows': [asdict(window) for window in self.windows]
+        }
+
+    def write_report(self, path: str):
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+        logger.debug(f"Sync report written to {path}")
+
+
+def measure_window_delay(y1: np.ndarray, y2: np.ndarray, sr: int, start: int, window_length: int,
+                         expected_delay: int, margin: int) -> Optional[OffsetWindow]:
+    """Measure delay of window_length samples of y1 from start, searching expected_delay +- margin samples. Returns
+    None if the window does not fit in both signals."""
+    y2_start = start - expected_delay - margin
+    y2_end = y2_start + window_length + 2 * margin
+    if y2_start < 0 or y2_end > len(y2) or start + window_length > len(y1):
+        return None
+
+    # Slices are aligned so that the window delay is expected_delay + margin - lag
+    refined = refine_delay(y1[start:start + window_length], y2[y2_start:y2_end], sr, coarse_delay=-margin,
+                           margin=margin, window_length=window_length)
+    if refined is None:
+        return None
+    lag, confidence = refined
+    delay_samples = expected_delay + margin + lag
+    return OffsetWindow(time=(start + window_length / 2) / sr, delay_ms=delay_samples / sr * 1000, confidence=float(confidence))
+
+
+def fit_drift(windows: List[OffsetWindow], min_confidence: float = MIN_WINDOW_CONFIDENCE,
+              max_residual_ms: float = MAX_RESIDUAL_MS) -> Optional[np.ndarray]:
+    """Fit delay_ms = intercept + slope * time to confident windows weighted by confidence, refitting once without
+    outliers. Marks the windows used in the fit and sets their residuals. Returns (slope, intercept) or None if less
+    than two windows are usable."""
+    candidates = [window for window in windows if window.confidence >= min_confidence]
+    if len(candidates) < 2:
+        return None
+
+    times = np.array([window.time for window in candidates])
+    delays = np.array([window.delay_ms for window in candidates])
+    weights = np.array([window.confidence for window in candidates])
+
+    coefficients = np.polyfit(times, delays, 1, w=weights)
+    inliers = np.abs(delays - np.polyval(coefficients, times)) <= max_residual_ms
+    if np.count_nonzero(inliers) >= 2 and not np.all(inliers):
+        coefficients = np.polyfit(times[inliers], delays[inliers], 1, w=weights[inliers])
+        inliers = np.abs(delays - np.polyval(coefficients, times)) <= max_residual_ms
+
+    for window in windows:
+        window.residual_ms = float(window.delay_ms - np.polyval(coefficients, window.time))
+    for window, inlier in zip(candidates, inliers):
+        window.used = bool(inlier)
+
+    return coefficients
+
+
+def estimate_offset_map(y1: np.ndarray, y2: np.ndarray, sr: int, window_sec: float = 30.0,
+                        interval_sec: float = 120.0, search_margin_sec: float = 0.5,
+                        n_workers: Optional[int] = None) -> OffsetMap:
+    """
+    Estimate delay between two mono signals in windows of window_sec seconds every interval_sec seconds over the
+    whole recording and fit a drift model to them.
+
+    Global delay from the start of the recording is used as the expected delay of every window, and windows search
+    search_margin_sec seconds around it at full rate. Windows are measured in parallel threads, as the FFTs and
+    filters release the GIL. Signals are only sliced, so they can be memory maps from AudioStore.
+
+    Falls back to the global delay without drift if less than two windows are usable, e.g. for short recordings.
+    """
+    global_result = calculate_audio_delay(y1, y2, sr)
+    expected_delay = int(global_result['delay_samples'])
+
+    window_length = int(window_sec * sr)
+    margin = int(search_margin_sec * sr)
+    # Only windows whose matching part of y2 starts after the search margin
+    first_start = max(0, expected_delay + margin)
+    last_start = min(len(y1), len(y2) + expected_delay - margin) - window_length
+    starts = list(range(first_start, last_start + 1, int(interval_sec * sr)))
+
+    logger.info(f"Measuring delay in {len(starts)} windows of {window_sec:.0f} s")
+    with ThreadPoolExecutor(max_workers=n_workers or os.cpu_count()) as executor:
+        measured = list(executor.map(
+            lambda start: measure_window_delay(y1, y2, sr, start, window_length, expected_delay, margin), starts))
+    windows = [window for window in measured if window is not None]
+
+    coefficients = fit_drift(windows)
+    if coefficients is None:
+        logger.warning("Not enough confident windows to estimate drift, using delay from the start of the audio")
+        return OffsetMap(base_delay_ms=global_result['delay_ms'], drift=0.0, windows=windows)
+
+    slope, intercept = coefficients
+    offset_map = OffsetMap(base_delay_ms=float(intercept), drift=float(slope) / 1000, windows=windows)
+    log_offset_map(offset_map)
+    return offset_map
+
+
+def log_offset_map(offset_map: OffsetMap):
+    used = sum(window.used for window in offset_map.windows)
+    logger.info(f"Delay at start: {offset_map.base_delay_ms:.2f} ms, drift: {offset_map.drift_ms_per_hour:.1f} ms "
+                f"per hour ({offset_map.drift_ppm:.1f} ppm) from {used}/{len(offset_map.windows)} windows")
+    for window in offset_map.windows:
+        residual = f"{window.residual_ms:+.2f} ms" if window.residual_ms is not None else "-"
+        logger.debug(f"Window at {window.time:8.1f} s: delay {window.delay_ms:9.2f} ms, "
+                     f"confidence {window.confidence:.2f}, residual {residual}{'' if window.used else ' (not used)'}")
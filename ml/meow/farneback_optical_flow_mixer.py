@@ -1,21 +1,93 @@
+from typing import Dict, Optional, Tuple
+
 import cv2
 import numpy as np
-from tqdm import tqdm
-
-from .video_mixer_base import VideoMixerBase
 
+from .video_mixer_base import VideoMixerBase, MixerCostProfile, register_mixer
+from .abs_diff_optical_flow_mixer import prepare_field_mask
+from .optical_flow import resize_for_analysis, resize_to_size, is_grayscale
+from .switch_history import SwitchHistory, LEFT_CAMERA, RIGHT_CAMERA, dwell_time_to_steps
+from .logger import setup_logger
+
+logger = setup_logger(__name__)
+
+FLOW_METHODS = ("farneback", "dis")
+
+
+def get_field_roi(mask: np.ndarray) -> Optional[Tuple[int, int, int, int]]:
+    """Return bounding box (x, y, width, height) of the field mask or None if the mask is empty."""
+    x, y, width, height = cv2.boundingRect(mask)
+    if width == 0 or height == 0:
+        return None
+    return x, y, width, height
+
+
+def prepare_flow_frame(frame: np.ndarray, analysis_scale: float = 1.0,
+                       roi: Optional[Tuple[int, int, int, int]] = None, pyramid_level: int = 0,
+                       analysis_size: Optional[Tuple[int, int]] = None) -> np.ndarray:
+    """Convert frame to grayscale, downscale it by analysis_scale, crop it to roi and downsample it pyramid_level
+    times with cv2.pyrDown. roi is given in analysis scale coordinates. If analysis_size (width, height) is given,
+    frame is resized to it instead of scaling."""
+    if not is_grayscale(frame):
+        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    if analysis_size is None:
+        frame = resize_for_analysis(frame, analysis_scale)
+    else:
+        frame = resize_to_size(frame, analysis_size)
+    if roi is not None:
+        x, y, width, height = roi
+        frame = frame[y:y + height, x:x + width]
+    for _ in range(pyramid_level):
+        frame = cv2.pyrDown(frame)
+    return frame
+
+
+@register_mixer("farneback")
 class FarnebackOpticalFlowMixer(VideoMixerBase):
+    """Track action center with dense optical flow and switch to the camera that covers it.
+
+    Action center is detected from frames downscaled by analysis_scale. With use_field_roi, flow is computed only
+    inside the bounding box of the field mask, after downsampling it pyramid_level times. Votes are smoothed with
+    exponential moving average, see SwitchHistory for hysteresis and min_dwell_time (in seconds).
+    """
+
+    cost_profile = MixerCostProfile(analysis_fps=30, analysis_scale=0.25, frame_cost=4.0)
+
+    def __init__(self, flow_method: str = "farneback", history_length: int = 12, pyramid_level: int = 1,
+                 use_field_roi: bool = True, **kwargs):
+        """flow_method is either "farneback" for dense Farneback flow or "dis" for the faster DIS optical flow
+        with ultrafast preset."""
+        super().__init__(history_length=history_length, **kwargs)
+        if flow_method not in FLOW_METHODS:
+            raise ValueError(f"Unknown flow method {flow_method}, must be one of {FLOW_METHODS}")
+        self.flow_method = flow_method
+        self.pyramid_level = pyramid_level
+        self.use_field_roi = use_field_roi
+        self.dis_optical_flow = None
+        if flow_method == "dis":
+            self.dis_optical_flow = cv2.DISOpticalFlow_create(cv2.DISOPTICAL_FLOW_PRESET_ULTRAFAST)
+
+        self.roi_left = None
+        self.roi_right = None
+        self.prev_frame_left = None
+        self.prev_frame_right = None
+
+    def calculate_flow(self, prev_gray: np.ndarray, curr_gray: np.ndarray) -> np.ndarray:
+        if self.dis_optical_flow is not None:
+            return self.dis_optical_flow.calc(prev_gray, curr_gray, None)
+        return cv2.calcOpticalFlowFarneback(
+            prev_gray, curr_gray, None, 0.5, 3, 15, 3, 5, 1.2, 0
+        )
 
     def detect_action_hotspot(self, frame, prev_frame):
-        """Detect where the action is happening based on player clusters and movement"""
+        """Detect where the action is happening based on player clusters and movement.
+        Frames can be BGR or already converted to grayscale with prepare_flow_frame."""
         # Convert frames to grayscale for processing
-        curr_gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        prev_gray = cv2.cvtColor(prev_frame, cv2.COLOR_BGR2GRAY)
+        curr_gray = frame if is_grayscale(frame) else cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        prev_gray = prev_frame if is_grayscale(prev_frame) else cv2.cvtColor(prev_frame, cv2.COLOR_BGR2GRAY)
         
         # 1. Calculate motion using optical flow
-        flow = cv2.calcOpticalFlowFarneback(
-            prev_gray, curr_gray, None, 0.5, 3, 15, 3, 5, 1.2, 0
-        )
+        flow = self.calculate_flow(prev_gray, curr_gray)
         magnitude, _ = cv2.cartToPolar(flow[..., 0], flow[..., 1])
         
         # 2. Detect player clusters
@@ -45,98 +117,76 @@ class FarnebackOpticalFlowMixer(VideoMixerBase):
         # Return normalized x-position of action center
         return cx / frame.shape[1]
 
-    def mix_video(self, video_capture_left: cv2.VideoCapture,
-                                        video_capture_right: cv2.VideoCapture,
-                                        video_output_path: str,
-                                        flow_fps=30,
-                                        history_length=12,
-                                        input_fps: int = 30,
-                                        output_fps: int = 30,
-                                        output_height: int = 1080,
-                                        output_width: int = 1920,
-                                        fourcc: cv2.VideoWriter_fourcc = cv2.VideoWriter_fourcc('M', 'J', 'P', 'G'),
-                                        progress_callback=None) -> cv2.VideoWriter:
-            """
-            Mix videos by tracking action center and switching between cameras.
-            """
-            if output_fps > input_fps:
-                raise ValueError("Output fps cannot be higher than input fps")
-
-            # Get total frames
-            left_n_frames = int(video_capture_left.get(cv2.CAP_PROP_FRAME_COUNT)) - 1
-            right_n_frames = int(video_capture_right.get(cv2.CAP_PROP_FRAME_COUNT)) - 1
-            total_frames = min(left_n_frames, right_n_frames)
-
-            # Initialize video writer
-            video_output = cv2.VideoWriter(video_output_path, fourcc, output_fps, (output_width, output_height))
-
-            # Initialize first frames
-            _, first_left = video_capture_left.read()
-            _, first_right = video_capture_right.read()
-            
-            if first_left is None or first_right is None:
-                raise ValueError("Could not read first frames from videos")
-
-            # Initialize tracking variables
-            prev_frame_left = first_left
-            prev_frame_right = first_right
-            optical_flow_history = [0]  # Start with left camera
-            frames_per_flow = max(1, round(input_fps / flow_fps))
-            smoothed_score = 0.5  # Start in the middle
-            
-            # Write first frame
-            video_output.write(first_left)
-            
-            logger.debug(f"Processing {total_frames} frames with flow calculation every {frames_per_flow} frames")
-
-            # Process remaining frames
-            for i in tqdm(range(1, total_frames)):
-                res_left, frame_left = video_capture_left.read()
-                res_right, frame_right = video_capture_right.read()
-
-                if res_left is False or res_right is False:
-                    break
-
-                # Calculate action position on regular intervals
-                if i % frames_per_flow == 0:
-                    # Get action position for both cameras
-                    left_action_pos = self.detect_action_hotspot(frame_left, prev_frame_left)
-                    right_action_pos = self.detect_action_hotspot(frame_right, prev_frame_right)
-                    
-                    # Determine which camera has the action
-                    # Assuming left camera covers left half, right camera covers right half
-                    # Add overlap in the middle (0.4-0.6) to prevent rapid switching
-                    use_left = (left_action_pos < 0.6 or  # Action clearly in left half
-                            (right_action_pos < 0.4))   # Action not visible in right camera
-                    
-                    optical_flow_history.append(0 if use_left else 1)
-                    if len(optical_flow_history) > history_length:
-                        optical_flow_history = optical_flow_history[-history_length:]
-                    
-                    # Smooth transitions using exponential moving average
-                    alpha = 0.7  # Smoothing factor
-                    current_score = np.mean(optical_flow_history)
-                    smoothed_score = alpha * current_score + (1 - alpha) * smoothed_score
-                    
-                    # Update previous frames for next iteration
-                    prev_frame_left = frame_left
-                    prev_frame_right = frame_right
-
-                # Write frame based on smoothed history
-                use_left = smoothed_score < 0.5
-                video_output.write(frame_left if use_left else frame_right)
-
-                # Handle frame rate conversion if needed
-                if output_fps < input_fps and i % (input_fps // output_fps) != 0:
-                    continue
-
-                if progress_callback:
-                    progress = int((i / total_frames) * 100)
-                    progress_callback(progress)
-
-            # Cleanup
-            video_capture_left.release()
-            video_capture_right.release()
-            video_output.release()
-
-            return video_output
\ No newline at end of file
+    @staticmethod
+    def to_frame_position(roi_position: float, roi: Optional[Tuple[int, int, int, int]], frame_width: int) -> float:
+        """Convert normalized x-position inside roi to normalized x-position in the whole frame."""
+        if roi is None:
+            return roi_position
+        x, _, width, _ = roi
+        return (x + roi_position * width) / frame_width
+
+    def setup(self, first_left: np.ndarray, first_right: np.ndarray, input_fps: float,
+              setup_state: Optional[Dict] = None):
+        super().setup(first_left, first_right, input_fps, setup_state)
+        if self.use_field_roi and setup_state is not None:
+            self.roi_left = setup_state['roi_left']
+            self.roi_right = setup_state['roi_right']
+        elif self.use_field_roi:
+            self.roi_left = get_field_roi(prepare_field_mask(first_left, self.analysis_scale))
+            self.roi_right = get_field_roi(prepare_field_mask(first_right, self.analysis_scale))
+        logger.debug(f"Calculating flow inside {self.roi_left} for left and {self.roi_right} for right")
+
+    def get_setup_state(self) -> Dict:
+        return {'roi_left': self.roi_left, 'roi_right': self.roi_right}
+
+    def create_history(self) -> SwitchHistory:
+        # Smooth transitions using exponential moving average
+        return SwitchHistory(
+            self.history_length,
+            initial_vote=LEFT_CAMERA,  # Start with left camera
+            hysteresis=self.hysteresis,
+            min_dwell=dwell_time_to_steps(self.min_dwell_time, self.input_fps, self.frames_per_flow),
+            smoothing=0.7,
+            initial_score=0.5  # Start in the middle
+        )
+
+    def prepare(self, frame: np.ndarray, roi: Optional[Tuple[int, int, int, int]]) -> np.ndarray:
+        return prepare_flow_frame(frame, self.analysis_scale, roi, self.pyramid_level, self.analysis_size)
+
+    def start_analysis(self, frame_left: np.ndarray, frame_right: np.ndarray):
+        # Previous frames are kept in grayscale
+        self.prev_frame_left = self.prepare(frame_left, self.roi_left)
+        self.prev_frame_right = self.prepare(frame_right, self.roi_right)
+
+    def vote(self, frame_left: np.ndarray, frame_right: np.ndarray) -> int:
+        analysis_left = self.prepare(frame_left, self.roi_left)
+        analysis_right = self.prepare(frame_right, self.roi_right)
+        analysis_width = self.analysis_size[0]
+
+        # Get action position for both cameras, relative to the whole frame width
+        left_action_pos = self.to_frame_position(
+            self.detect_action_hotspot(analysis_left, self.prev_frame_left), self.roi_left, analysis_width)
+        right_action_pos = self.to_frame_position(
+            self.detect_action_hotspot(analysis_right, self.prev_frame_right), self.roi_right, analysis_width)
+
+        # Update previous frames for next iteration
+        self.prev_frame_left = analysis_left
+        self.prev_frame_right = analysis_right
+
+        # Determine which camera has the action
+        # Assuming left camera covers left half, right camera covers right half
+        # Add overlap in the middle (0.4-0.6) to prevent rapid switching
+        action_on_left = (left_action_pos < 0.6 or  # Action clearly in left half
+                (right_action_pos < 0.4))   # Action not visible in right camera
+
+        return LEFT_CAMERA if action_on_left else RIGHT_CAMERA
+
+
+@register_mixer("dis")
+class DISOpticalFlowMixer(FarnebackOpticalFlowMixer):
+    """FarnebackOpticalFlowMixer with DIS optical flow, which is several times faster than Farneback."""
+
+    cost_profile = MixerCostProfile(analysis_fps=30, analysis_scale=0.25, frame_cost=1.5)
+
+    def __init__(self, **kwargs):
+        super().__init__(flow_method="dis", **kwargs)
@@ -0,0 +1,143 @@
+import queue
+import threading
+from typing import Callable, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from .logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# Sentinel pushed to the queues when a stream has ended
+_END_OF_STREAM = object()
+
+
+def read_frame(video_capture, retrieve: bool = True) -> Tuple[bool, Optional[np.ndarray]]:
+    """Advance capture by one frame. The frame is converted to BGR image only if retrieve is True, otherwise it is
+    only grabbed and None is returned as frame."""
+    if retrieve:
+        return video_capture.read()
+    return video_capture.grab(), None
+
+
+class ThreadedFrameReader:
+    """Decode frames of a cv2.VideoCapture on a background thread into a bounded queue.
+
+    Has the same read(), grab(), get() and release() interface as cv2.VideoCapture so it can be used in place of the
+    capture in the mixing loops. The queue size bounds how many decoded frames are held in memory at a time.
+
+    If retrieve_frame is given, it is called on the decoding thread with the index of every frame in the capture.
+    Frames it returns False for are only grabbed, and read() returns None in place of the frame.
+    """
+
+    def __init__(self, video_capture: cv2.VideoCapture, queue_size: int = 32,
+                 retrieve_frame: Optional[Callable[[int], bool]] = None):
+        self.video_capture = video_capture
+        self.retrieve_frame = retrieve_frame
+        self.frame_queue = queue.Queue(maxsize=queue_size)
+        self.stopped = threading.Event()
+        self.exhausted = False
+        self.error: Optional[BaseException] = None
+        self.thread = threading.Thread(target=self._decode_loop, daemon=True)
+        self.thread.start()
+
+    def _put(self, item) -> bool:
+        # Use timeout so that the thread notices release() even when the consumer has stopped reading
+        while not self.stopped.is_set():
+            try:
+                self.frame_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _decode_loop(self):
+        try:
+            frame_index = 0
+            while not self.stopped.is_set():
+                retrieve = self.retrieve_frame is None or self.retrieve_frame(frame_index)
+                res, frame = read_frame(self.video_capture, retrieve=retrieve)
+                if res is False or (retrieve and frame is None):
+                    break
+                # Frames that were only grabbed are queued as None, so the consumer stays in step with the capture
+                if not self._put(frame):
+                    break
+                frame_index += 1
+        except Exception as e:
+            logger.error(f"Decoding frames failed: {str(e)}")
+            self.error = e
+        finally:
+            self._put(_END_OF_STREAM)
+
+    def read(self) -> Tuple[bool, Optional[np.ndarray]]:
+        if self.exhausted:
+            return False, None
+
+        item = self.frame_queue.get()
+        if item is _END_OF_STREAM:
+            self.exhausted = True
+            if self.error is not None:
+                raise self.error
+            return False, None
+
+        return True, item
+
+    def grab(self) -> bool:
+        # Frames are decoded ahead on the decoding thread, so skipping a frame just drops it from the queue
+        res, _ = self.read()
+        return res
+
+    def get(self, prop_id: int) -> float:
+        return self.video_capture.get(prop_id)
+
+    def release(self):
+        self.stopped.set()
+        self.thread.join()
+        self.video_capture.release()
+
+
+class ThreadedFrameWriter:
+    """Encode frames with a cv2.VideoWriter on a background thread.
+
+    Has the same write() and release() interface as cv2.VideoWriter. release() waits until all queued frames have
+    been written.
+    """
+
+    def __init__(self, video_writer: cv2.VideoWriter, queue_size: int = 32):
+        self.video_writer = video_writer
+        self.frame_queue = queue.Queue(maxsize=queue_size)
+        self.error: Optional[BaseException] = None
+        self.released = False
+        self.thread = threading.Thread(target=self._encode_loop, daemon=True)
+        self.thread.start()
+
+    def _encode_loop(self):
+        while True:
+            frame = self.frame_queue.get()
+            if frame is _END_OF_STREAM:
+                break
+            # Keep draining the queue after a failure so that write() never blocks forever
+            if self.error is not None:
+                continue
+            try:
+                self.video_writer.write(frame)
+            except Exception as e:
+                logger.error(f"Encoding frames failed: {str(e)}")
+                self.error = e
+
+    def write(self, frame: np.ndarray):
+        if self.error is not None:
+            raise self.error
+        self.frame_queue.put(frame)
+
+    def release(self):
+        if self.released:
+            return
+        self.released = True
+        self.frame_queue.put(_END_OF_STREAM)
+        self.thread.join()
+        self.video_writer.release()
+
+        if self.error is not None:
+            raise self.error
@@ -2,6 +2,7 @@ import os
 from moviepy.editor import VideoFileClip, CompositeVideoClip, TextClip
 import ffmpeg
 from typing import Optional, List, Literal
+from .utils.video_utils import probe_video
 from .logger import setup_logger
 import cv2
 import numpy as np
@@ -78,7 +79,7 @@ def burn_logo_ffmpeg(video_path: str, gif_path: str, output_path: str, text: Opt
     main = ffmpeg.input(video_path, **{'thread_queue_size': '1024'})
     
     # Get video dimensions and duration
-    probe = ffmpeg.probe(video_path)
+    probe = probe_video(video_path)
     video_info = next(s for s in probe['streams'] if s['codec_type'] == 'video')
     width = int(video_info['width'])
     height = int(video_info['height'])
@@ -276,7 +277,7 @@ def burn_team_images(video_path: str, output_path: str, team_image_paths: List[s
     main = ffmpeg.input(video_path, **{'thread_queue_size': '1024'})
     
     # Get video info
-    probe = ffmpeg.probe(video_path)
+    probe = probe_video(video_path)
     video_info = next(s for s in probe['streams'] if s['codec_type'] == 'video')
     width = int(video_info['width'])
     height = int(video_info['height'])
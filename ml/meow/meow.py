@@ -7,16 +7,23 @@ import re
 import os
 from dotenv import load_dotenv
 import contextlib
-from moviepy.audio.io.AudioFileClip import AudioFileClip
 
 from .fast_stitching import call_image_stitching
 from .clip_sorter import calculate_video_file_linking
 from .video_synchronizer import synchronize_videos
 from .utils.video_utils import ffmpeg_concatenate_video_clips, get_video_info, cut_clips_with_ffmpeg, merge_video_and_audio, transform_video_fps
 from .utils.file_utils import create_temporary_file_name_with_extension
-from .audio_synchronizer import sync_and_mix_audio
+from .audio_synchronizer import sync_and_mix_audio_arrays
+from .drift_analyzer import estimate_offset_map
+from .audio_event_indexer import (index_audio_events, calculate_event_audio_delay, suggest_start_and_end_time,
+                                  EVENT_COMPARISON_LENGTH_SEC)
+from .utils.audio_store import AudioStore
+from .utils.sync_cache import SyncCache, fingerprint_sources
+from .utils.metadata_cache import get_metadata_cache
 from .utils.audio_utils import cut_audio_clip
-from .abs_diff_optical_flow_mixer import AbsoluteDifferenceOpticalFlowMixer
+from .mixer_registry import get_mixer, get_mixer_class, available_mixers
+from .timeline_mixer import TimelineMixer
+from .chunked_mixer import mix_video_in_chunks
 from .logo_burner import burn_logo
 from .utils.prompt_utils import prompt_continue
 from .youtube_uploader import upload_video
@@ -30,6 +37,8 @@ load_dotenv()
 
 CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
 LOGO_FOLDER = os.path.join(os.path.dirname(os.path.dirname(CURRENT_DIR)), 'frontend/assets')
+# Mixers that analyse more than this (see MixerCostProfile.analysis_cost) are run in parallel chunks by default
+STREAMING_MIXER_MAX_ANALYSIS_COST = 1.0
 
 logger = setup_logger(__name__)
 
@@ -42,9 +51,12 @@ class TaskStatus(str, Enum):
 def run_with_args(left_videos: List[str], right_videos: List[str], output_name: str = 'meow_output', 
                   use_mixer: bool = True, use_panorama_stitching: bool = False, upload_to_Youtube: bool = False,
                   output_file_type: Optional[str] = None, output_fps: int = 30, save_intermediate: bool = False,
-                  mixer_type: str = "farneback", output_directory: Optional[str] = None, start_time: Optional[float] = None, end_time: Optional[float] = None,
+                  mixer_type: str = "abs_diff", output_directory: Optional[str] = None, start_time: Optional[float] = None, end_time: Optional[float] = None,
                   progress_callback: Optional[Callable[[str, TaskStatus, int], None]] = None, determine_output_file_type: bool = True, delay: Optional[float] = None,
-                  youtube_title: str = "Meow Match Video", use_logo: bool = False, make_sample: bool = False, auto_yes: bool = False, *args, **kwargs):
+                  youtube_title: str = "Meow Match Video", use_logo: bool = False, make_sample: bool = False, auto_yes: bool = False,
+                  two_pass_mixing: bool = False, mixer_workers: Optional[int] = None, correct_drift: bool = False, use_sync_cache: bool = True,
+                  use_event_sync: bool = False, auto_trim: bool = False, sort_workers: Optional[int] = None,
+                  use_metadata_cache: bool = True, *args, **kwargs):
     """Run meow process:
         1. Sort videos
         2. Concatenate videos
@@ -60,6 +72,21 @@ def run_with_args(left_videos: List[str], right_videos: List[str], output_name:
 
     print(locals())
 
+    if use_mixer:
+        # Fail early on unknown mixer type instead of after synchronizing the videos
+        mixer_cost_profile = get_mixer_class(mixer_type).cost_profile
+        if mixer_workers is None and not two_pass_mixing \
+                and mixer_cost_profile.analysis_cost > STREAMING_MIXER_MAX_ANALYSIS_COST:
+            mixer_workers = os.cpu_count()
+            logger.info(f"Mixer {mixer_type} analyses too much to keep up in one process, "
+                        f"mixing with {mixer_workers} parallel workers")
+
+    # Settings of the shared metadata cache apply to this run only and are undone when it ends
+    run_scope = contextlib.ExitStack()
+    metadata_cache = get_metadata_cache()
+    if not use_metadata_cache:
+        run_scope.enter_context(metadata_cache.in_memory_only())
+
     try:
         if progress_callback:
             progress_callback("Video processing", TaskStatus.STARTED, 5)
@@ -109,8 +136,8 @@ def run_with_args(left_videos: List[str], right_videos: List[str], output_name:
             progress_callback("Sorting videos", TaskStatus.STARTED, 5)
 
         logger.info("Calculating video linking")
-        left_videos_sorted = calculate_video_file_linking(left_videos)
-        right_videos_sorted = calculate_video_file_linking(right_videos)
+        left_videos_sorted = calculate_video_file_linking(left_videos, n_workers=sort_workers)
+        right_videos_sorted = calculate_video_file_linking(right_videos, n_workers=sort_workers)
         logger.debug(f"Sorted left videos: {left_videos_sorted}")
         logger.debug(f"Sorted right videos: {right_videos_sorted}")
 
@@ -122,7 +149,7 @@ def run_with_args(left_videos: List[str], right_videos: List[str], output_name:
         with (contextlib.nullcontext(output_directory)
             if save_intermediate is True
             else tempfile.TemporaryDirectory(dir=base_temp_dir)
-        ) as temp_dir:
+        ) as temp_dir, metadata_cache.transient_dir(temp_dir):
 
             # Make sure temp_dir exists
             os.makedirs(temp_dir, exist_ok=True)
@@ -140,10 +167,10 @@ def run_with_args(left_videos: List[str], right_videos: List[str], output_name:
             else:
                 left_video_path = ffmpeg_concatenate_video_clips(left_videos_sorted, temp_dir=temp_dir, file_type=output_file_type)
 
-            # Write audio as mono for synchronization
+            # Decode audio once as mono PCM, shared by synchronization and mixing
+            audio_store = AudioStore(temp_dir=temp_dir)
             logger.info("Extracting left audio")
-            left_audio_path = create_temporary_file_name_with_extension(temp_dir, 'wav')
-            AudioFileClip(left_video_path).write_audiofile(left_audio_path, ffmpeg_params=["-ac", "1"])
+            audio_store.add('left', left_video_path)
 
             if needs_fps_transform:
                 temp_path = transform_video_fps(left_video_path, output_fps, temp_dir=temp_dir, file_type=output_file_type)
@@ -155,10 +182,7 @@ def run_with_args(left_videos: List[str], right_videos: List[str], output_name:
                 right_video_path = ffmpeg_concatenate_video_clips(right_videos_sorted, temp_dir=temp_dir, file_type=output_file_type)
 
             logger.info("Extracting right audio")
-            right_audio_path = create_temporary_file_name_with_extension(temp_dir, 'wav')
-            AudioFileClip(right_video_path).write_audiofile(right_audio_path, ffmpeg_params=["-ac", "1"])
-            
-            logger.debug(f"Extracted audio, files found from {left_audio_path} for left and {right_audio_path} for right")
+            audio_store.add('right', right_video_path)
 
             if needs_fps_transform:
                 temp_path = transform_video_fps(right_video_path, output_fps, temp_dir=temp_dir, file_type=output_file_type)
@@ -186,18 +210,99 @@ def run_with_args(left_videos: List[str], right_videos: List[str], output_name:
             if progress_callback:
                 progress_callback("Mixing audio", TaskStatus.STARTED, 20)
 
+            offset_map = None
+            event_result = None
+            drift = 0.0
+            delay_from_command_line = delay is not None
+
+            # Delay of the same sources is reused from earlier runs, e.g. with other start and end times
+            sync_cache = SyncCache() if use_sync_cache and delay is None else None
+            cached_sync = None
+            if sync_cache is not None:
+                sync_cache_key = fingerprint_sources(left_videos, right_videos, sample_rate=audio_store.sample_rate)
+                cached_sync = sync_cache.get(sync_cache_key)
+                if cached_sync is not None and correct_drift and cached_sync.get('drift') is None:
+                    logger.debug("Cached delay was calculated without drift, estimating drift")
+                    cached_sync = None
+
+            # Whistles and claps are indexed in one pass over the decoded audio. Game start and end need events of
+            # the whole left track, delay only events of the start of both tracks
+            event_indexes = {}
+            if auto_trim and start_time is None and end_time is None and not make_sample:
+                logger.info("Indexing audio events")
+                event_indexes['left'] = index_audio_events(audio_store.get('left'), audio_store.sample_rate)
+                suggestion = suggest_start_and_end_time(event_indexes['left']['whistle'])
+                if suggestion is None:
+                    logger.warning("No whistles found for game start and end time, using full video")
+                else:
+                    start_time, end_time = suggestion[0], min(suggestion[1], audio_store.duration('left'))
+                    logger.info(f"Game start and end time from whistles: {start_time:.0f}s - {end_time:.0f}s")
+            elif auto_trim:
+                logger.info("Start or end time is given, not detecting game start and end time")
+
+            if cached_sync is not None:
+                logger.info(f"Using cached delay {cached_sync['delay_ms']:.2f} ms "
+                            f"(confidence {cached_sync['confidence']:.2f})")
+                delay = cached_sync['delay_ms']
+                if correct_drift:
+                    drift = cached_sync['drift']
+            elif correct_drift and delay is None:
+                logger.info("Estimating delay and drift over the whole recording")
+                offset_map = estimate_offset_map(audio_store.get('left'), audio_store.get('right'),
+                                                 audio_store.sample_rate)
+                # Report is kept next to the output video, temp_dir is removed when the run ends
+                report_directory = output_directory or os.path.dirname(os.path.abspath(full_output_name))
+                os.makedirs(report_directory, exist_ok=True)
+                report_path = os.path.join(report_directory, f"{os.path.basename(output_name)}_sync_report.json")
+                offset_map.write_report(report_path)
+                logger.info(f"Sync report written to {report_path}")
+                delay = offset_map.base_delay_ms
+                drift = offset_map.drift
+            elif correct_drift:
+                logger.warning("Delay is given, not estimating drift")
+            elif use_event_sync and delay is None:
+                comparison_length = EVENT_COMPARISON_LENGTH_SEC * audio_store.sample_rate
+                if 'left' not in event_indexes:
+                    event_indexes['left'] = index_audio_events(audio_store.get('left')[:comparison_length],
+                                                               audio_store.sample_rate)
+                event_indexes['right'] = index_audio_events(audio_store.get('right')[:comparison_length],
+                                                            audio_store.sample_rate)
+                event_result = calculate_event_audio_delay(audio_store.get('left'), audio_store.get('right'),
+                                                           audio_store.sample_rate, event_indexes['left'],
+                                                           event_indexes['right'])
+                if event_result is not None:
+                    delay = event_result['delay_ms']
+                else:
+                    logger.info("Falling back to correlating audio")
+
             merged_audio_path = create_temporary_file_name_with_extension(temp_dir, 'wav')
-            audio_result = sync_and_mix_audio(
-                left_audio_path, 
-                right_audio_path, 
+            audio_result = sync_and_mix_audio_arrays(
+                audio_store.get('left'),
+                audio_store.get('right'),
+                audio_store.sample_rate,
                 merged_audio_path,
-                delay=delay
+                delay=delay,
+                drift=drift
             )
             logger.info(f"Audio synchronized and mixed in: {merged_audio_path}")
+            if sync_cache is not None and cached_sync is None:
+                confidence = audio_result['confidence']
+                if offset_map is not None:
+                    confidence = offset_map.confidence
+                elif event_result is not None:
+                    confidence = event_result['confidence']
+                sync_cache.put(sync_cache_key, {
+                    'delay_ms': audio_result['delay_ms'],
+                    'confidence': confidence,
+                    'sample_rate': audio_result['sample_rate'],
+                    'drift': offset_map.drift if offset_map is not None else None
+                })
+
             if delay is None:
                 delay = audio_result["delay_ms"] / 1000  # Convert to seconds
             else:
-                logger.info(f"Using delay from command line: {delay} ms")
+                if delay_from_command_line:
+                    logger.info(f"Using delay from command line: {delay} ms")
                 delay = delay / 1000
 
             if progress_callback:
@@ -207,7 +312,7 @@ def run_with_args(left_videos: List[str], right_videos: List[str], output_name:
                 progress_callback("Synchronizing videos", TaskStatus.STARTED, 20)
 
             logger.info("Synchronizing videos")
-            synchronized_left_video_path, synchronized_right_video_path = synchronize_videos(video1_path=left_video_path, video2_path=right_video_path, delay=delay, temp_dir=temp_dir, output_file_type=output_file_type)
+            synchronized_left_video_path, synchronized_right_video_path = synchronize_videos(video1_path=left_video_path, video2_path=right_video_path, delay=delay, temp_dir=temp_dir, output_file_type=output_file_type, drift=drift)
 
             if progress_callback:
                 progress_callback("Synchronizing videos", TaskStatus.FINISHED, 25)
@@ -254,22 +359,52 @@ def run_with_args(left_videos: List[str], right_videos: List[str], output_name:
             if use_mixer:
                 if progress_callback:
                     progress_callback("Mixing videos using optical flow", TaskStatus.STARTED, 30)
-                left_stream = cv2.VideoCapture(preprocessed_video_left_path)
-                right_stream = cv2.VideoCapture(preprocessed_video_right_path)
-
-                optical_flow_mixer = AbsoluteDifferenceOpticalFlowMixer()
                 processed_video_path = create_temporary_file_name_with_extension(temp_dir, output_file_type)
 
-                logger.info("Starting mixing")
-                optical_flow_mixer.mix_video_with_field_mask(
-                    video_capture_left=left_stream,
-                    video_capture_right=right_stream,
-                    video_output_path=processed_video_path,
-                    input_fps=input_fps,
-                    output_fps=output_fps,
-                    progress_callback=lambda p: progress_callback("Mixing videos", TaskStatus.STARTED,
-                                                                  int(30 + 50 * (p / 100))) if progress_callback else None
-                )
+                if two_pass_mixing:
+                    # Decide camera switches from low resolution analysis and cut the original files with ffmpeg
+                    logger.info("Starting two-pass mixing")
+                    TimelineMixer(mixer_type).mix_video_files(
+                        video_left_path=preprocessed_video_left_path,
+                        video_right_path=preprocessed_video_right_path,
+                        video_output_path=processed_video_path,
+                        temp_dir=temp_dir,
+                        file_type=output_file_type,
+                        timeline_path=os.path.join(temp_dir, 'switch_timeline.json'),
+                        progress_callback=lambda p: progress_callback("Mixing videos", TaskStatus.STARTED,
+                                                                      int(30 + 50 * (p / 100))) if progress_callback else None
+                    )
+                elif mixer_workers is not None and mixer_workers > 1:
+                    logger.info(f"Starting mixing with {mixer_workers} parallel workers")
+                    mix_video_in_chunks(
+                        video_left_path=preprocessed_video_left_path,
+                        video_right_path=preprocessed_video_right_path,
+                        video_output_path=processed_video_path,
+                        temp_dir=temp_dir,
+                        file_type=output_file_type,
+                        mixer_type=mixer_type,
+                        n_workers=mixer_workers,
+                        input_fps=input_fps,
+                        output_fps=output_fps,
+                        progress_callback=lambda p: progress_callback("Mixing videos", TaskStatus.STARTED,
+                                                                      int(30 + 50 * (p / 100))) if progress_callback else None
+                    )
+                else:
+                    left_stream = cv2.VideoCapture(preprocessed_video_left_path)
+                    right_stream = cv2.VideoCapture(preprocessed_video_right_path)
+
+                    optical_flow_mixer = get_mixer(mixer_type)
+
+                    logger.info(f"Starting mixing with {mixer_type} mixer")
+                    optical_flow_mixer.mix_video(
+                        video_capture_left=left_stream,
+                        video_capture_right=right_stream,
+                        video_output_path=processed_video_path,
+                        input_fps=input_fps,
+                        output_fps=output_fps,
+                        progress_callback=lambda p: progress_callback("Mixing videos", TaskStatus.STARTED,
+                                                                      int(30 + 50 * (p / 100))) if progress_callback else None
+                    )
             elif use_panorama_stitching:
                 if progress_callback:
                     progress_callback("Stitching panorama video", TaskStatus.STARTED, 30)
@@ -359,6 +494,8 @@ def run_with_args(left_videos: List[str], right_videos: List[str], output_name:
         if progress_callback:
             progress_callback(f"Error", TaskStatus.FAILED, 0, error=str(e))
         raise
+    finally:
+        run_scope.close()
 
 
 def parse_arguments():
@@ -396,8 +533,24 @@ def parse_arguments():
                         help="end time of the game as HH:MM:SS string")
     parser.add_argument("--delay", default=None, dest="delay",
                         help="delay in milliseconds between left and right videos, example 500 would be half a second delay")
-    parser.add_argument("-mt", "--mixer-type", default="farneback", dest="mixer_type",
-                        help="type of mixer to use, either farneback or abs_diff")
+    parser.add_argument("-mt", "--mixer-type", default="abs_diff", dest="mixer_type", choices=available_mixers(),
+                        help="type of mixer to use")
+    parser.add_argument("--two-pass", default=False, action='store_true', dest="two_pass_mixing",
+                        help="mix by first deciding camera switches from low resolution analysis and then cutting the original videos with ffmpeg")
+    parser.add_argument("--mixer-workers", default=None, type=int, dest="mixer_workers",
+                        help="number of parallel processes used for mixing, video is mixed in chunks if more than 1")
+    parser.add_argument("--correct-drift", default=False, action='store_true', dest="correct_drift",
+                        help="estimate delay over the whole recording and correct clock drift between the cameras")
+    parser.add_argument("--event-sync", default=False, action='store_true', dest="use_event_sync",
+                        help="estimate delay by matching whistles and claps between the cameras, falls back to correlating audio")
+    parser.add_argument("--auto-trim", default=False, action='store_true', dest="auto_trim",
+                        help="cut video from the first to the last whistle if start and end time are not given")
+    parser.add_argument("--no-sync-cache", default=True, action='store_false', dest="use_sync_cache",
+                        help="always calculate delay instead of reusing it from earlier runs with the same videos")
+    parser.add_argument("--no-metadata-cache", default=True, action='store_false', dest="use_metadata_cache",
+                        help="always probe videos and read thumbnails instead of reusing them from earlier runs")
+    parser.add_argument("--sort-workers", default=None, type=int, dest="sort_workers",
+                        help="number of videos probed and read in parallel when sorting clips")
     parser.add_argument("--use-logo", default=False, action='store_true', dest="use_logo",
                         help="burn logo on video")
     parser.add_argument("--sample", default=False, action='store_true', dest="make_sample",
@@ -0,0 +1,21 @@
+from typing import List, Type
+
+from .video_mixer_base import MIXER_REGISTRY, VideoMixerBase
+# Engines register themselves when their module is imported
+from . import abs_diff_optical_flow_mixer  # noqa: F401
+from . import farneback_optical_flow_mixer  # noqa: F401
+
+
+def available_mixers() -> List[str]:
+    return sorted(MIXER_REGISTRY)
+
+
+def get_mixer_class(mixer_type: str) -> Type[VideoMixerBase]:
+    if mixer_type not in MIXER_REGISTRY:
+        raise ValueError(f"Unknown mixer type {mixer_type}, must be one of {available_mixers()}")
+    return MIXER_REGISTRY[mixer_type]
+
+
+def get_mixer(mixer_type: str, **kwargs) -> VideoMixerBase:
+    """Create mixer engine registered with name mixer_type. kwargs are passed to the engine constructor."""
+    return get_mixer_class(mixer_type)(**kwargs)
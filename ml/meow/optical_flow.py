@@ -1,3 +1,5 @@
+from typing import Tuple
+
 import numpy as np
 import cv2
 
@@ -8,6 +10,28 @@ def is_grayscale(frame: np.ndarray) -> bool:
     return False
 
 
+def resize_for_analysis(frame: np.ndarray, scale: float, interpolation: int = cv2.INTER_AREA) -> np.ndarray:
+    """Resize frame by scale for motion analysis. Use cv2.INTER_NEAREST for masks to keep them binary."""
+    if scale == 1.0:
+        return frame
+    height, width = frame.shape[:2]
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    return cv2.resize(frame, size, interpolation=interpolation)
+
+
+def resize_to_size(frame: np.ndarray, size: Tuple[int, int], interpolation: int = cv2.INTER_AREA) -> np.ndarray:
+    """Resize frame to size (width, height). Frames that already have the size are returned as is."""
+    if (frame.shape[1], frame.shape[0]) == size:
+        return frame
+    return cv2.resize(frame, size, interpolation=interpolation)
+
+
+def scaled_kernel_size(kernel_size: int, scale: float) -> int:
+    """Scale kernel size defined for full resolution frames to analysis scale, keeping it odd and at least 3."""
+    size = max(3, int(round(kernel_size * scale)))
+    return size if size % 2 == 1 else size + 1
+
+
 def farneback_optical_flow(frame1: np.ndarray, frame2: np.ndarray) -> np.ndarray:
     if not is_grayscale(frame1):
         frame1 = cv2.cvtColor(frame1, cv2.COLOR_BGR2GRAY)
@@ -29,14 +53,32 @@ def farneback_optical_flow(frame1: np.ndarray, frame2: np.ndarray) -> np.ndarray
     return flow
 
 
-def absolute_difference_optical_flow(frame1, frame2):
-    diff_frame = cv2.absdiff(frame1, frame2)
+class MotionScorer:
+    """Score movement between two grayscale frames with absolute difference.
+
+    Difference is dilated and thresholded, and the score is the number of changed pixels. Kernel and intermediate
+    frames are kept between calls, so scoring frames of the same size does not allocate new arrays.
+    """
+
+    def __init__(self, threshold: int = 30, kernel_size: int = 5):
+        self.threshold = threshold
+        self.kernel = np.ones((kernel_size, kernel_size), np.uint8)
+        self.diff_frame = None
+        self.dilated_frame = None
+        self.thresh_frame = None
 
-    kernel = np.ones((5, 5))
-    diff_frame = cv2.dilate(diff_frame, kernel, 1)
+    def _allocate_buffers(self, frame: np.ndarray):
+        if self.diff_frame is None or self.diff_frame.shape != frame.shape or self.diff_frame.dtype != frame.dtype:
+            self.diff_frame = np.empty_like(frame)
+            self.dilated_frame = np.empty_like(frame)
+            self.thresh_frame = np.empty_like(frame)
 
-    thresh_frame = cv2.threshold(src=diff_frame, thresh=30, maxval=255, type=cv2.THRESH_BINARY)[1]
-    return thresh_frame
+    def score(self, frame1: np.ndarray, frame2: np.ndarray) -> int:
+        self._allocate_buffers(frame1)
+        cv2.absdiff(frame1, frame2, dst=self.diff_frame)
+        cv2.dilate(self.diff_frame, self.kernel, dst=self.dilated_frame, iterations=1)
+        cv2.threshold(self.dilated_frame, self.threshold, 255, cv2.THRESH_BINARY, dst=self.thresh_frame)
+        return cv2.countNonZero(self.thresh_frame)
 
 
 def calculate_flow_metric(flow):
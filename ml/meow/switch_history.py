@@ -0,0 +1,81 @@
+import math
+from typing import Optional
+
+LEFT_CAMERA = 0
+RIGHT_CAMERA = 1
+
+
+def dwell_time_to_steps(min_dwell_time: float, input_fps: float, frames_per_flow: int) -> int:
+    """Convert minimum dwell time in seconds to number of history updates."""
+    return math.ceil(min_dwell_time * input_fps / frames_per_flow)
+
+
+class SwitchHistory:
+    """Decide which camera to show from the latest camera votes.
+
+    Votes (0 for left, 1 for right camera) are kept in a fixed size ring buffer with a running sum, so adding a vote
+    and reading the decision are constant time. The decision is updated only when a vote is added.
+
+    Camera changes to right when the score reaches 0.5 + hysteresis and back to left when it drops below
+    0.5 - hysteresis. Camera is not changed again before min_dwell votes have been added after the previous switch.
+    With smoothing, the score is an exponential moving average of the mean vote, otherwise the mean itself.
+    """
+
+    def __init__(self, history_length: int, initial_vote: int = LEFT_CAMERA, hysteresis: float = 0.0,
+                 min_dwell: int = 0, smoothing: Optional[float] = None, initial_score: Optional[float] = None):
+        if history_length < 1:
+            raise ValueError("History length must be at least 1")
+
+        self.history_length = history_length
+        self.hysteresis = hysteresis
+        self.min_dwell = min_dwell
+        self.smoothing = smoothing
+
+        self.votes = [0] * history_length
+        self.index = 0
+        self.count = 0
+        self.total = 0
+
+        self._add_vote(initial_vote)
+        self.score = self.mean if initial_score is None else initial_score
+        self.camera = LEFT_CAMERA if self.score < 0.5 else RIGHT_CAMERA
+        self.steps_since_switch = 0
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count
+
+    @property
+    def use_left(self) -> bool:
+        return self.camera == LEFT_CAMERA
+
+    def _add_vote(self, vote: int):
+        if self.count == self.history_length:
+            self.total -= self.votes[self.index]
+        else:
+            self.count += 1
+        self.votes[self.index] = vote
+        self.total += vote
+        self.index = (self.index + 1) % self.history_length
+
+    def push(self, vote: int) -> int:
+        """Add camera vote and return the camera to show."""
+        self._add_vote(vote)
+
+        if self.smoothing is None:
+            self.score = self.mean
+        else:
+            self.score = self.smoothing * self.mean + (1 - self.smoothing) * self.score
+
+        self.steps_since_switch += 1
+        if self.steps_since_switch < self.min_dwell:
+            return self.camera
+
+        if self.camera == LEFT_CAMERA and self.score >= 0.5 + self.hysteresis:
+            self.camera = RIGHT_CAMERA
+            self.steps_since_switch = 0
+        elif self.camera == RIGHT_CAMERA and self.score < 0.5 - self.hysteresis:
+            self.camera = LEFT_CAMERA
+            self.steps_since_switch = 0
+
+        return self.camera
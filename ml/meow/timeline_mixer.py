@@ -0,0 +1,217 @@
+import json
+import os
+from typing import Callable, Dict, List, Optional, Tuple
+
+import cv2
+import ffmpeg
+import numpy as np
+
+from .mixer_registry import get_mixer
+from .switch_history import LEFT_CAMERA, RIGHT_CAMERA
+from .utils.file_utils import create_temporary_file_name_with_extension
+from .utils.eval_utils import eval_expr
+from .utils.video_utils import get_video_info, get_video_stream, smart_cut_with_ffmpeg, ffmpeg_concatenate_video_clips
+from .logger import setup_logger
+
+logger = setup_logger(__name__)
+
+CAMERA_NAMES = {LEFT_CAMERA: "left", RIGHT_CAMERA: "right"}
+
+
+def read_first_frame(video_path: str) -> np.ndarray:
+    capture = cv2.VideoCapture(video_path)
+    res, first_frame = capture.read()
+    capture.release()
+
+    if res is False or first_frame is None:
+        raise ValueError(f"Could not read first frame from video {video_path}")
+
+    return first_frame
+
+
+def open_analysis_stream(video_path: str, analysis_fps: float, analysis_size: Tuple[int, int]):
+    """Start ffmpeg process that decodes the video at analysis fps and size as raw grayscale frames to stdout."""
+    width, height = analysis_size
+    return (
+        ffmpeg
+        .input(video_path)
+        .filter('fps', fps=analysis_fps)
+        .filter('scale', width, height)
+        .output('pipe:', format='rawvideo', pix_fmt='gray')
+        .global_args('-nostdin', '-loglevel', 'error')
+        .run_async(pipe_stdout=True)
+    )
+
+
+def read_analysis_frame(process, analysis_size: Tuple[int, int]) -> Optional[np.ndarray]:
+    width, height = analysis_size
+    frame_bytes = process.stdout.read(width * height)
+    if len(frame_bytes) < width * height:
+        return None
+    return np.frombuffer(frame_bytes, np.uint8).reshape((height, width))
+
+
+def decisions_to_timeline(decisions: List[int], analysis_fps: float, duration: float,
+                          min_segment_duration: float = 0.0) -> List[Dict]:
+    """Merge consecutive per analysis frame decisions into segments. Segments shorter than min_segment_duration are
+    merged to the previous segment to avoid cuts that are shorter than the keyframe interval."""
+    timeline = []
+    for i, camera in enumerate(decisions):
+        start = i / analysis_fps
+        if start >= duration:
+            break
+        if timeline and timeline[-1]['camera'] == camera:
+            continue
+        if timeline and start - timeline[-1]['start'] < min_segment_duration:
+            # Previous segment is too short, let it continue with the new camera
+            timeline[-1]['camera'] = camera
+            if len(timeline) > 1 and timeline[-2]['camera'] == camera:
+                timeline.pop()
+            continue
+        timeline.append({'start': start, 'camera': camera})
+
+    for i, segment in enumerate(timeline):
+        segment['end'] = timeline[i + 1]['start'] if i + 1 < len(timeline) else duration
+
+    return timeline
+
+
+def write_timeline(timeline: List[Dict], timeline_path: str):
+    with open(timeline_path, 'w') as f:
+        json.dump([{**segment, 'camera_name': CAMERA_NAMES[segment['camera']]} for segment in timeline], f, indent=2)
+
+
+def read_timeline(timeline_path: str) -> List[Dict]:
+    with open(timeline_path, 'r') as f:
+        timeline = json.load(f)
+    return [{'start': segment['start'], 'end': segment['end'], 'camera': segment['camera']} for segment in timeline]
+
+
+class TimelineMixer:
+    """Two pass "decide then cut" mixer.
+
+    Pass one decodes both videos at low fps and resolution with ffmpeg, lets the mixer engine mixer_type decide the
+    camera for every decoded frame and writes a camera switch timeline. Pass two cuts the segments from the original
+    files with ffmpeg and joins them with the concat demuxer, so full resolution frames are never decoded in Python.
+
+    Segments are cut frame accurately with smart_cut_with_ffmpeg, which stream copies whole GOPs and re-encodes only
+    the partial GOPs at the switches, so segments never overlap and the video stays in sync with the audio.
+    """
+
+    def __init__(self, mixer_type: str = "abs_diff"):
+        self.mixer_type = mixer_type
+
+    def create_switch_timeline(self, video_left_path: str, video_right_path: str, analysis_fps: float = 5,
+                               analysis_width: int = 320, history_length: int = 24, hysteresis: float = 0.0,
+                               min_segment_duration: float = 2.0,
+                               progress_callback: Optional[Callable[[int], None]] = None) -> List[Dict]:
+        left_info = get_video_info(video_left_path)
+        right_info = get_video_info(video_right_path)
+        duration = min(left_info['duration'], right_info['duration'])
+
+        if (right_info['frame_width'], right_info['frame_height']) != (left_info['frame_width'], left_info['frame_height']):
+            logger.warning("Left and right videos have different resolutions, analysing both at the same size")
+
+        # Every decoded frame is an analysis frame. Minimum segment duration already prevents short segments, so no
+        # dwell time here
+        mixer = get_mixer(
+            self.mixer_type,
+            analysis_fps=analysis_fps,
+            analysis_scale=min(analysis_width, left_info['frame_width']) / left_info['frame_width'],
+            history_length=history_length,
+            hysteresis=hysteresis
+        )
+        mixer.setup(read_first_frame(video_left_path), read_first_frame(video_right_path), analysis_fps)
+        analysis_size = mixer.analysis_size
+
+        total_frames = int(duration * analysis_fps)
+        logger.info(f"Analysing {total_frames} frames at {analysis_fps} fps and size {analysis_size} "
+                    f"with {self.mixer_type} mixer")
+
+        left_process = open_analysis_stream(video_left_path, analysis_fps, analysis_size)
+        right_process = open_analysis_stream(video_right_path, analysis_fps, analysis_size)
+
+        decisions = []
+
+        try:
+            while True:
+                frame_left = read_analysis_frame(left_process, analysis_size)
+                frame_right = read_analysis_frame(right_process, analysis_size)
+                if frame_left is None or frame_right is None:
+                    break
+
+                if decisions:
+                    decisions.append(mixer.decide(len(decisions), frame_left, frame_right))
+                else:
+                    decisions.append(mixer.reset(frame_left, frame_right))
+
+                if progress_callback and total_frames > 0:
+                    progress_callback(min(100, int((len(decisions) / total_frames) * 100)))
+        finally:
+            for process in (left_process, right_process):
+                process.stdout.close()
+                process.kill()
+                process.wait()
+
+        timeline = decisions_to_timeline(decisions, analysis_fps, duration, min_segment_duration)
+        logger.info(f"Created timeline with {len(timeline)} segments from {len(decisions)} analysed frames")
+
+        return timeline
+
+    def render_timeline(self, timeline: List[Dict], video_left_path: str, video_right_path: str,
+                        video_output_path: str, temp_dir: str, file_type: str) -> str:
+        video_paths = {LEFT_CAMERA: video_left_path, RIGHT_CAMERA: video_right_path}
+
+        segment_paths = []
+        for segment in timeline:
+            segment_path = create_temporary_file_name_with_extension(temp_dir, file_type)
+            smart_cut_with_ffmpeg(video_paths[segment['camera']], segment_path, segment['start'], segment['end'],
+                                  temp_dir)
+            segment_paths.append(segment_path)
+
+        if len(segment_paths) == 1:
+            os.replace(segment_paths[0], video_output_path)
+        else:
+            ffmpeg_concatenate_video_clips(segment_paths, output_path=video_output_path)
+            for segment_path in segment_paths:
+                os.remove(segment_path)
+
+        # Rendered video must be as long as the timeline, or the video would drift from the merged audio
+        frame_rate = eval_expr(get_video_stream(video_left_path)['avg_frame_rate'])
+        timeline_duration = timeline[-1]['end'] - timeline[0]['start']
+        rendered_duration = float(ffmpeg.probe(video_output_path)['format']['duration'])
+        if abs(rendered_duration - timeline_duration) > 1.5 / frame_rate:
+            raise RuntimeError(f"Rendered video lasts {rendered_duration:.3f} s but timeline {timeline_duration:.3f} s")
+
+        return video_output_path
+
+    def mix_video_files(self, video_left_path: str, video_right_path: str, video_output_path: str, temp_dir: str,
+                        file_type: str, timeline_path: Optional[str] = None, analysis_fps: float = 5,
+                        analysis_width: int = 320, history_length: int = 24, hysteresis: float = 0.0,
+                        min_segment_duration: float = 2.0,
+                        progress_callback: Optional[Callable[[int], None]] = None) -> str:
+        """Create switch timeline from the synchronized videos and build output video from it. If timeline_path is
+        given, the timeline is also written there as JSON."""
+
+        timeline = self.create_switch_timeline(
+            video_left_path,
+            video_right_path,
+            analysis_fps=analysis_fps,
+            analysis_width=analysis_width,
+            history_length=history_length,
+            hysteresis=hysteresis,
+            min_segment_duration=min_segment_duration,
+            # Analysis takes most of the time, cutting re-encodes only the GOPs around the switches
+            progress_callback=lambda p: progress_callback(int(p * 0.9)) if progress_callback else None
+        )
+
+        if timeline_path is not None:
+            write_timeline(timeline, timeline_path)
+            logger.info(f"Switch timeline written to {timeline_path}")
+
+        self.render_timeline(timeline, video_left_path, video_right_path, video_output_path, temp_dir, file_type)
+
+        if progress_callback:
+            progress_callback(100)
+
+        return video_output_path
@@ -0,0 +1,99 @@
+import os
+from typing import Dict, Optional
+
+import ffmpeg
+import numpy as np
+
+from .file_utils import create_temporary_file_name_with_extension
+from ..logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# Same as the default of librosa.load, which was used for synchronization and mixing before
+DEFAULT_SAMPLE_RATE = 22050
+
+# Bytes read from ffmpeg at a time, about 12 seconds of mono float32 audio at the default sample rate
+READ_CHUNK_SIZE = 1 << 20
+
+
+def open_audio_stream(media_path: str, sample_rate: int):
+    """Start ffmpeg process that decodes the first audio stream of the file as mono float32 PCM to stdout."""
+    return (
+        ffmpeg
+        .input(media_path)
+        .output('pipe:', format='f32le', acodec='pcm_f32le', ac=1, ar=sample_rate, map='0:a:0')
+        .global_args('-nostdin', '-loglevel', 'error')
+        .run_async(pipe_stdout=True)
+    )
+
+
+def decode_audio(media_path: str, sample_rate: int = DEFAULT_SAMPLE_RATE,
+                 output_path: Optional[str] = None) -> np.ndarray:
+    """Decode audio of a video or audio file to mono float32 samples at sample_rate with one ffmpeg process.
+
+    If output_path is given, the samples are streamed to that raw file and returned as a read only memory map, so
+    long matches do not have to fit in memory. Otherwise the samples are returned as an in-memory array.
+    """
+    process = open_audio_stream(media_path, sample_rate)
+
+    try:
+        if output_path is None:
+            data = process.stdout.read()
+        else:
+            with open(output_path, 'wb') as f:
+                while True:
+                    chunk = process.stdout.read(READ_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    f.write(chunk)
+    finally:
+        process.stdout.close()
+        return_code = process.wait()
+
+    if return_code != 0:
+        raise RuntimeError(f"ffmpeg failed to decode audio from {media_path}")
+
+    if output_path is None:
+        # Drop possible partial sample at the end
+        return np.frombuffer(data[:len(data) - len(data) % 4], dtype=np.float32)
+
+    n_samples = os.path.getsize(output_path) // 4
+    if n_samples == 0:
+        return np.zeros(0, dtype=np.float32)
+    return np.memmap(output_path, dtype=np.float32, mode='r', shape=(n_samples,))
+
+
+class AudioStore:
+    """Mono PCM audio of the inputs, decoded once per input and shared by delay estimation and mixing.
+
+    Audio is decoded with decode_audio at sample_rate. With temp_dir, samples are memory mapped from raw files in
+    temp_dir, otherwise kept in memory. Arrays returned by get() are read only and slicing them does not copy.
+    """
+
+    def __init__(self, sample_rate: int = DEFAULT_SAMPLE_RATE, temp_dir: Optional[str] = None):
+        self.sample_rate = sample_rate
+        self.temp_dir = temp_dir
+        self.audios: Dict[str, np.ndarray] = {}
+
+    def add(self, name: str, media_path: str) -> np.ndarray:
+        output_path = None
+        if self.temp_dir is not None:
+            output_path = create_temporary_file_name_with_extension(self.temp_dir, 'f32')
+
+        logger.info(f"Decoding audio of {media_path} at {self.sample_rate} Hz")
+        audio = decode_audio(media_path, self.sample_rate, output_path)
+        logger.debug(f"Decoded {len(audio) / self.sample_rate:.1f} seconds of audio for {name}")
+
+        self.audios[name] = audio
+        return audio
+
+    def get(self, name: str) -> np.ndarray:
+        if name not in self.audios:
+            raise KeyError(f"No audio named {name} in audio store")
+        return self.audios[name]
+
+    def duration(self, name: str) -> float:
+        return len(self.get(name)) / self.sample_rate
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.audios
@@ -1,18 +1,25 @@
 import moviepy.editor as mp
 import os
+from functools import lru_cache
 from scipy.io.wavfile import read
 import numpy as np
-from typing import Tuple, Optional
+from typing import List, Tuple, Optional, Union
 import subprocess
 from .file_utils import create_temporary_file_name_with_extension
 from pydub import AudioSegment
 from scipy import signal
+from scipy import fft as sp_fft
 import pyloudnorm as pyln
+from pyloudnorm.iirfilter import IIRfilter
 from ..logger import setup_logger
 import librosa
+import soundfile as sf
 
 logger = setup_logger(__name__)
 
+# Samples processed at a time by the streaming filters, about 3 seconds at 44.1 kHz
+FILTER_BLOCK_SIZE = 1 << 17
+
 
 def extract_audio(video_path) -> mp.AudioClip:
     video = mp.VideoFileClip(video_path)
@@ -62,19 +69,43 @@ def contrast_audio(audio_array: np.ndarray, exponent=2):
 
 
 def preprocess_audio(audio_file_path: str, to_mono=True, z_normalize=False, normalize=False,
-                     high_pass=False, low_pass=False) -> Tuple[int, np.ndarray]:
-    samplerate, audio = read(audio_file_path)
-    audio_data = np.array(audio, dtype=float)
-    if to_mono:
-        audio_data = stereo_to_mono(audio_data)
+                     high_pass=False, low_pass=False, block_size: int = FILTER_BLOCK_SIZE) -> Tuple[int, np.ndarray]:
+    """Read a WAV file and preprocess it block by block with the WAV memory mapped, so only the result is held in
+    memory. Filters are causal and run in an AudioFilterChain, loudness is measured with StreamingLoudnessMeter."""
+    samplerate, audio = read(audio_file_path, mmap=True)
+    n_samples = len(audio)
+
+    def blocks():
+        for start in range(0, n_samples, block_size):
+            block = np.array(audio[start:start + block_size], dtype=float)
+            yield stereo_to_mono(block) if to_mono else block
+
+    # Affine transform of z-normalization and loudness gain are found in separate passes before filtering
+    offset, scale = 0.0, 1.0
     if z_normalize:
-        audio_data = z_normalization(audio_data)
+        minimum = min(np.min(block) for block in blocks())
+        maximum = max(np.max(block) for block in blocks())
+        scale = 2. / (maximum - minimum)
+        offset = -minimum * scale - 1
     if normalize:
-        audio_data = normalize_audio(audio_data, samplerate)
+        meter = StreamingLoudnessMeter(samplerate)
+        for block in blocks():
+            meter.process(block * scale + offset)
+        gain = loudness_normalization_gain(meter.integrated_loudness())
+        scale *= gain
+        offset *= gain
+
+    chain = AudioFilterChain(samplerate)
     if low_pass:
-        audio_data = butter_lowpass_filter(audio_data, 5000, samplerate)
+        chain.add_lowpass(5000)
     if high_pass:
-        audio_data = butter_highpass_filter(audio_data, 1000, samplerate)
+        chain.add_highpass(1000)
+
+    audio_data = np.empty((n_samples,) + (() if to_mono or audio.ndim == 1 else audio.shape[1:]))
+    position = 0
+    for block in blocks():
+        audio_data[position:position + len(block)] = chain.process(block * scale + offset)
+        position += len(block)
 
     return samplerate, audio_data
 
@@ -91,34 +122,161 @@ def normalize_audio(data: np.ndarray, samplerate: int, loudness_reduction=-12.0)
     return loudness_normalized_audio
 
 
-def butter_lowpass_filter(data: np.ndarray, cutoff: float, samplerate: float, order: int = 5) -> np.ndarray:
+def loudness_normalization_gain(loudness: float, target_loudness: float = -12.0) -> float:
+    """Linear gain that changes loudness to target_loudness, same as pyln.normalize.loudness."""
+    return 10.0 ** ((target_loudness - loudness) / 20.0)
+
+
+@lru_cache(maxsize=None)
+def butter_sos(order: int, cutoff: Union[float, Tuple[float, float]], samplerate: float, btype: str) -> np.ndarray:
+    """Butterworth filter as second-order sections. Designs are cached, as the same filters are applied to every
+    window and block. Returned array is shared between callers and must not be modified."""
     nyq = 0.5 * samplerate
-    normal_cutoff = cutoff / nyq
-    b, a = signal.butter(order, normal_cutoff, btype='low', analog=False)
-    y = signal.filtfilt(b, a, data)
-    return y
+    normal_cutoff = tuple(c / nyq for c in cutoff) if isinstance(cutoff, tuple) else cutoff / nyq
+    sos = signal.butter(order, normal_cutoff, btype=btype, output='sos')
+    return sos
+
+
+@lru_cache(maxsize=None)
+def k_weighting_sos(samplerate: float) -> np.ndarray:
+    """K-weighting filter of ITU-R BS.1770 as second-order sections, same stages as pyln.Meter. Returned array is
+    shared between callers and must not be modified."""
+    stages = [IIRfilter(4.0, 1 / np.sqrt(2), 1500.0, samplerate, 'high_shelf'),
+              IIRfilter(0.0, 0.5, 38.0, samplerate, 'high_pass')]
+    sos = np.vstack([signal.tf2sos(stage.b * stage.passband_gain, stage.a) for stage in stages])
+    return sos
+
+
+def butter_lowpass_filter(data: np.ndarray, cutoff: float, samplerate: float, order: int = 5) -> np.ndarray:
+    return signal.sosfiltfilt(butter_sos(order, cutoff, samplerate, 'low'), data)
 
 
 def butter_highpass_filter(data: np.ndarray, cutoff: float, samplerate: float, order: int = 5) -> np.ndarray:
-    nyq = 0.5 * samplerate
-    normal_cutoff = cutoff / nyq
-    b, a = signal.butter(order, normal_cutoff, btype='high', analog=False)
-    y = signal.filtfilt(b, a, data)
-    return y
+    return signal.sosfiltfilt(butter_sos(order, cutoff, samplerate, 'high'), data)
 
 
 def butter_bandpass_filter(data: np.ndarray, lowcut: float, highcut: float, samplerate: float, order: int = 5) -> np.ndarray:
-    nyq = 0.5 * samplerate
-    low = lowcut / nyq
-    high = highcut / nyq
-    b, a = signal.butter(order, [low, high], btype='band')
-    y = signal.filtfilt(b, a, data)
-    return y
+    return signal.sosfiltfilt(butter_sos(order, (lowcut, highcut), samplerate, 'band'), data)
+
+
+class AudioFilterChain:
+    """Causal Butterworth filters applied to audio block by block.
+
+    Sections of all added filters are run with one sosfilt call per block, and the filter state is carried over to
+    the next block, so filtering blocks gives the same result as filtering the whole signal at once. Unlike the
+    zero-phase butter_*_filter functions, the chain delays the signal by the group delay of the filters, which
+    cancels out when two signals are filtered with the same chain, e.g. for synchronization.
+    """
+
+    def __init__(self, samplerate: float, order: int = 5):
+        self.samplerate = samplerate
+        self.order = order
+        self.sections: List[np.ndarray] = []
+        self.state: Optional[np.ndarray] = None
+
+    def add_lowpass(self, cutoff: float) -> 'AudioFilterChain':
+        return self._add(butter_sos(self.order, cutoff, self.samplerate, 'low'))
+
+    def add_highpass(self, cutoff: float) -> 'AudioFilterChain':
+        return self._add(butter_sos(self.order, cutoff, self.samplerate, 'high'))
+
+    def add_bandpass(self, lowcut: float, highcut: float) -> 'AudioFilterChain':
+        return self._add(butter_sos(self.order, (lowcut, highcut), self.samplerate, 'band'))
+
+    def _add(self, sos: np.ndarray) -> 'AudioFilterChain':
+        self.sections.append(sos)
+        self.state = None
+        return self
+
+    def reset(self):
+        self.state = None
+
+    def process(self, block: np.ndarray) -> np.ndarray:
+        """Filter next block of samples along the first axis."""
+        if not self.sections or len(block) == 0:
+            return block
+        sos = np.vstack(self.sections)
+        if self.state is None:
+            self.state = np.zeros((len(sos), 2) + block.shape[1:])
+        filtered, self.state = signal.sosfilt(sos, block, axis=0, zi=self.state)
+        return filtered
+
+    def filter(self, audio: np.ndarray, block_size: int = FILTER_BLOCK_SIZE,
+               dtype: Optional[np.dtype] = None) -> np.ndarray:
+        """Filter whole signal from the start block by block. Only the output is allocated, so audio can be a
+        memory map. Output dtype defaults to float32 for float32 audio and float64 otherwise."""
+        self.reset()
+        dtype = dtype or (np.float32 if audio.dtype == np.float32 else np.float64)
+        output = np.empty(audio.shape, dtype=dtype)
+        for start in range(0, len(audio), block_size):
+            output[start:start + block_size] = self.process(np.asarray(audio[start:start + block_size]))
+        return output
+
+
+class StreamingLoudnessMeter:
+    """Integrated loudness of audio measured block by block, same as pyln.Meter.integrated_loudness for mono and
+    stereo. Blocks have samples along the first axis and channels along the second.
+
+    Only the mean square of every 100 ms step is kept, so measuring a full match needs a few hundred kilobytes.
+    """
+    block_duration = 0.4
+    overlap = 0.75
+
+    def __init__(self, samplerate: float):
+        self.samplerate = samplerate
+        self.sos = k_weighting_sos(samplerate)
+        self.state: Optional[np.ndarray] = None
+        self.step_size = int(round(self.block_duration * (1 - self.overlap) * samplerate))
+        self.step_energies: List[float] = []
+        self.partial_energy = 0.0
+        self.partial_length = 0
+
+    def process(self, block: np.ndarray):
+        if self.state is None:
+            self.state = np.zeros((len(self.sos), 2) + block.shape[1:])
+        weighted, self.state = signal.sosfilt(self.sos, block, axis=0, zi=self.state)
+        # Channel gains are 1.0 for left, right and center channels
+        squared = np.square(weighted)
+        if squared.ndim > 1:
+            squared = squared.sum(axis=1)
+        position = 0
+        while position < len(squared):
+            n = min(self.step_size - self.partial_length, len(squared) - position)
+            self.partial_energy += float(np.sum(squared[position:position + n]))
+            self.partial_length += n
+            position += n
+            if self.partial_length == self.step_size:
+                self.step_energies.append(self.partial_energy)
+                self.partial_energy = 0.0
+                self.partial_length = 0
+
+    def integrated_loudness(self) -> float:
+        """Gated integrated loudness in LUFS of the audio processed so far."""
+        steps_per_block = int(round(1 / (1 - self.overlap)))
+        energies = np.array(self.step_energies)
+        if len(energies) < steps_per_block:
+            raise ValueError("Audio must be longer than the loudness block size")
+
+        # Mean square of 400 ms blocks with 75% overlap from sums of 100 ms steps
+        block_energies = np.convolve(energies, np.ones(steps_per_block), mode='valid')
+        z = block_energies / (self.step_size * steps_per_block)
+        with np.errstate(divide='ignore'):
+            block_loudness = -0.691 + 10.0 * np.log10(z)
+
+        # Absolute gate at -70 LUFS and relative gate 10 LU below the absolutely gated loudness
+        gated = z[block_loudness >= -70.0]
+        if len(gated) == 0:
+            return -np.inf
+        relative_threshold = -0.691 + 10.0 * np.log10(np.mean(gated)) - 10.0
+        gated = z[(block_loudness > relative_threshold) & (block_loudness > -70.0)]
+        if len(gated) == 0:
+            return -np.inf
+        return float(-0.691 + 10.0 * np.log10(np.mean(gated)))
 
 
 def cut_audio_clip(audio_path: str, start_time: float, end_time: float, output_path: Optional[str] = None, temp_dir: Optional[str] = None):
     """
-        Cut audio clip with ffmpeg based on start and end time.
+        Cut audio clip based on start and end time. Audio file must be in a format that soundfile can seek, like WAV.
 
         Args:
             audio_path: Path to the audio file to cut
@@ -131,9 +289,13 @@ def cut_audio_clip(audio_path: str, start_time: float, end_time: float, output_p
     if output_path is None:
         output_path = create_temporary_file_name_with_extension(temp_dir, 'wav')
 
-    audio = AudioSegment.from_file(audio_path)
-    audio = audio[start_time * 1000:end_time * 1000]
-    audio.export(output_path, format="wav")
+    # Read only the frames inside the range instead of decoding the whole file
+    info = sf.info(audio_path)
+    start_frame = max(0, int(round(start_time * info.samplerate)))
+    end_frame = min(info.frames, int(round(end_time * info.samplerate)))
+    audio, samplerate = sf.read(audio_path, start=start_frame, stop=max(start_frame, end_frame), dtype='float32',
+                                always_2d=True)
+    sf.write(output_path, audio, samplerate, subtype=info.subtype)
     logger.debug(f"Cut audio clip saved to {output_path}")
 
     return output_path
@@ -163,61 +325,70 @@ def compress_dynamic_range(audio: np.ndarray, threshold: float, ratio: float) ->
     return audio_compressed / np.max(np.abs(audio_compressed))
 
 
-def remove_wind_noise(audio: np.ndarray, frame_size: int = 2048, overlap: float = 0.75) -> np.ndarray:
+def median_filter_3(values: np.ndarray) -> np.ndarray:
+    """Median of 3 along the last axis with zero padding at both ends, same as signal.medfilt(row, 3) for every
+    row but without a Python loop."""
+    padded = np.zeros(values.shape[:-1] + (values.shape[-1] + 2,), dtype=values.dtype)
+    padded[..., 1:-1] = values
+    left, center, right = padded[..., :-2], padded[..., 1:-1], padded[..., 2:]
+    return np.maximum(np.minimum(left, center), np.minimum(np.maximum(left, center), right))
+
+
+def remove_wind_noise(audio: np.ndarray, frame_size: int = 2048, overlap: float = 0.75,
+                      batch_size: int = 1024) -> np.ndarray:
     """Remove wind noise using spectral subtraction.
-    
+
+    Frames are processed batch_size frames at a time with one FFT per batch, so memory stays bounded for full
+    matches.
+
     Args:
         audio: Input audio
         frame_size: Size of FFT frames (default 2048)
         overlap: Overlap between frames (default 0.75)
-    
+        batch_size: Number of frames processed at once (default 1024)
+
     Returns:
         Processed audio with reduced wind noise
     """
     hop_length = int(frame_size * (1 - overlap))
     frames = librosa.util.frame(audio, frame_length=frame_size, hop_length=hop_length)
     window = np.hanning(frame_size)
-    
-    processed_frames = []
-    for frame in frames.T:
-        windowed = frame * window
-        fft = np.fft.rfft(windowed)
+    n_frames = frames.shape[1]
+
+    n_bins = frame_size // 2 + 1
+    # Focus on low frequency range where wind noise typically occurs (0-200 Hz)
+    wind_region_size = int(n_bins * 0.05)  # First 5% of frequencies
+    # Only apply reduction to low frequencies
+    low_freq_idx = int(n_bins * 0.1)  # First 10% of frequencies
+
+    output = np.zeros(len(audio))
+    frame_offsets = np.arange(frame_size)
+    for batch_start in range(0, n_frames, batch_size):
+        batch = frames[:, batch_start:batch_start + batch_size].T * window
+        fft = sp_fft.rfft(batch, axis=1, workers=-1)
         magnitude = np.abs(fft)
-        phase = np.angle(fft)
-        
-        # Focus on low frequency range where wind noise typically occurs (0-200 Hz)
-        wind_region = magnitude[:int(len(magnitude) * 0.05)]  # First 5% of frequencies
-        noise_floor = np.mean(wind_region)
-        
+
+        noise_floor = np.mean(magnitude[:, :wind_region_size], axis=1, keepdims=True)
+
         # More conservative gain calculation
         gain = np.ones_like(magnitude)
-        
-        # Only apply reduction to low frequencies
-        low_freq_idx = int(len(magnitude) * 0.1)  # First 10% of frequencies
-        gain[:low_freq_idx] = np.maximum(0.3, 1 - (noise_floor / (magnitude[:low_freq_idx] + 1e-10)))
-        
+        gain[:, :low_freq_idx] = np.maximum(0.3, 1 - (noise_floor / (magnitude[:, :low_freq_idx] + 1e-10)))
+
         # Smooth transitions
-        gain = signal.medfilt(gain, 3)
-        
-        # Apply gain and reconstruct
-        magnitude_clean = magnitude * gain
-        fft_clean = magnitude_clean * np.exp(1j * phase)
-        frame_clean = np.fft.irfft(fft_clean)
-        
-        processed_frames.append(frame_clean[:frame_size])
-    
-    # Overlap-add reconstruction
-    output = np.zeros(len(audio))
-    for i, frame in enumerate(processed_frames):
-        start = i * hop_length
-        end = start + frame_size
-        if end > len(output):
-            break
-        output[start:end] += frame
-    
+        gain = median_filter_3(gain)
+
+        # Apply gain and reconstruct, scaling the spectrum keeps the phase
+        frames_clean = sp_fft.irfft(fft * gain, n=frame_size, axis=1, workers=-1)
+
+        # Overlap-add reconstruction of the whole batch at once, indices are relative to the first frame of the batch
+        span_start = batch_start * hop_length
+        indices = (np.arange(len(batch))[:, np.newaxis] * hop_length + frame_offsets).ravel()
+        span = np.bincount(indices, weights=frames_clean.ravel())
+        output[span_start:span_start + len(span)] += span
+
     # Normalize but preserve some headroom
     output = 0.95 * (output / np.max(np.abs(output)))
-    
+
     return output
 
 
@@ -0,0 +1,190 @@
+import io
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .sync_cache import get_cache_dir
+from ..logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# Least recently used entries are removed when the cache grows past this
+MAX_METADATA_ENTRIES = 4096
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS metadata (
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    value BLOB NOT NULL,
+    last_used REAL NOT NULL,
+    PRIMARY KEY (path, size, mtime_ns, kind)
+)
+"""
+
+
+def file_key(path: str) -> Tuple[str, int, int]:
+    """Cache key of a file: absolute path, size and modification time, so a changed file is never served stale."""
+    stat = os.stat(path)
+    return os.path.abspath(path), stat.st_size, stat.st_mtime_ns
+
+
+class MetadataCache:
+    """Persistent cache of per-file metadata, e.g. ffprobe output, keyframe index and thumbnails, in a SQLite
+    database keyed by path, size and modification time of the file.
+
+    Every value has a kind, e.g. 'probe' or 'thumbnail:320x180', so several values can be stored per file. Values
+    are memoized in process on top of the database, so repeated lookups during a run do not touch the disk. Like
+    SyncCache, errors reading or writing the database are logged and treated as a cache miss.
+
+    Without persistent, while in an in_memory_only context, and for files under transient directories like the
+    temporary directory of a run, values are only memoized in process and the database is never touched.
+    """
+
+    def __init__(self, cache_dir: Optional[str] = None, max_entries: int = MAX_METADATA_ENTRIES,
+                 persistent: bool = True):
+        self.cache_dir = cache_dir or get_cache_dir()
+        self.path = os.path.join(self.cache_dir, "metadata_cache.sqlite")
+        self.max_entries = max_entries
+        self.persistent = persistent
+        self.transient_dirs: List[str] = []
+        self.in_memory_scopes = 0
+        self.memo: Dict[Tuple, bytes] = {}
+        self.lock = threading.Lock()
+        self.initialized = False
+
+    @contextmanager
+    def transient_dir(self, directory: str):
+        """Do not store values of files under directory in the database while in the context."""
+        directory = os.path.join(os.path.abspath(directory), '')
+        with self.lock:
+            self.transient_dirs.append(directory)
+        try:
+            yield directory
+        finally:
+            with self.lock:
+                self.transient_dirs.remove(directory)
+
+    @contextmanager
+    def in_memory_only(self):
+        """Do not use the database while in the context, e.g. for a run without metadata cache. Contexts are
+        counted, so the database is used again only after all of them have exited."""
+        with self.lock:
+            self.in_memory_scopes += 1
+        try:
+            yield self
+        finally:
+            with self.lock:
+                self.in_memory_scopes -= 1
+
+    def is_persisted(self, path: str) -> bool:
+        """Whether values of the file at absolute path are stored in the database."""
+        with self.lock:
+            return (self.persistent and self.in_memory_scopes == 0
+                    and not path.startswith(tuple(self.transient_dirs)))
+
+    def _connect(self) -> sqlite3.Connection:
+        # New connection per operation, so the cache can be used from the worker threads of clip sorting
+        connection = sqlite3.connect(self.path, timeout=30)
+        if not self.initialized:
+            with connection:
+                connection.execute(SCHEMA)
+            self.initialized = True
+        return connection
+
+    def get(self, path: str, kind: str) -> Optional[bytes]:
+        try:
+            key = file_key(path) + (kind,)
+        except OSError:
+            return None
+
+        with self.lock:
+            if key in self.memo:
+                return self.memo[key]
+
+        if not self.is_persisted(key[0]) or not os.path.exists(self.path):
+            return None
+        try:
+            connection = self._connect()
+            try:
+                with connection:
+                    row = connection.execute(
+                        "SELECT value FROM metadata WHERE path = ? AND size = ? AND mtime_ns = ? AND kind = ?",
+                        key).fetchone()
+                    if row is not None:
+                        connection.execute(
+                            "UPDATE metadata SET last_used = ? WHERE path = ? AND size = ? AND mtime_ns = ? "
+                            "AND kind = ?", (time.time(),) + key)
+            finally:
+                connection.close()
+        except sqlite3.Error as e:
+            logger.warning(f"Could not read metadata cache {self.path}: {e}")
+            return None
+
+        if row is None:
+            return None
+        with self.lock:
+            self.memo[key] = row[0]
+        return row[0]
+
+    def put(self, path: str, kind: str, value: bytes):
+        try:
+            key = file_key(path) + (kind,)
+        except OSError:
+            return
+
+        with self.lock:
+            self.memo[key] = value
+
+        if not self.is_persisted(key[0]):
+            return
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            connection = self._connect()
+            try:
+                with connection:
+                    connection.execute("INSERT OR REPLACE INTO metadata VALUES (?, ?, ?, ?, ?, ?)",
+                                       key + (sqlite3.Binary(value), time.time()))
+                    connection.execute(
+                        "DELETE FROM metadata WHERE rowid IN (SELECT rowid FROM metadata ORDER BY last_used DESC "
+                        "LIMIT -1 OFFSET ?)", (self.max_entries,))
+            finally:
+                connection.close()
+        except (OSError, sqlite3.Error) as e:
+            logger.warning(f"Could not write metadata cache {self.path}: {e}")
+
+    def get_json(self, path: str, kind: str) -> Optional[Any]:
+        value = self.get(path, kind)
+        return json.loads(value) if value is not None else None
+
+    def put_json(self, path: str, kind: str, value: Any):
+        self.put(path, kind, json.dumps(value).encode())
+
+    def get_array(self, path: str, kind: str) -> Optional[np.ndarray]:
+        value = self.get(path, kind)
+        return np.load(io.BytesIO(value), allow_pickle=False) if value is not None else None
+
+    def put_array(self, path: str, kind: str, value: np.ndarray):
+        buffer = io.BytesIO()
+        np.save(buffer, value, allow_pickle=False)
+        self.put(path, kind, buffer.getvalue())
+
+
+_metadata_cache: Optional[MetadataCache] = None
+_metadata_cache_lock = threading.Lock()
+
+
+def get_metadata_cache() -> MetadataCache:
+    """Metadata cache shared by the whole process, in the same directory as the sync cache."""
+    global _metadata_cache
+    with _metadata_cache_lock:
+        if _metadata_cache is None:
+            _metadata_cache = MetadataCache()
+        return _metadata_cache
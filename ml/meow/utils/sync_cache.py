@@ -0,0 +1,105 @@
+import hashlib
+import json
+import os
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+from ..logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# Number of chunks hashed from every input file and their size in bytes
+FINGERPRINT_CHUNKS = 8
+FINGERPRINT_CHUNK_SIZE = 1 << 16
+
+# Least recently used entries are removed when the cache grows past this
+MAX_CACHE_ENTRIES = 256
+
+
+def get_cache_dir() -> str:
+    """Cache directory from MEOW_CACHE_DIR, defaults to ~/.cache/meow."""
+    return os.environ.get("MEOW_CACHE_DIR") or os.path.join(os.path.expanduser("~"), ".cache", "meow")
+
+
+def fingerprint_file(path: str, n_chunks: int = FINGERPRINT_CHUNKS, chunk_size: int = FINGERPRINT_CHUNK_SIZE) -> str:
+    """Fingerprint of file size, modification time and blake2b hash of n_chunks chunks spread evenly over the file.
+
+    Only n_chunks * chunk_size bytes are read, so fingerprinting a match recording is fast even though the whole
+    file is not hashed.
+    """
+    stat = os.stat(path)
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f"{stat.st_size}:{stat.st_mtime_ns}".encode())
+
+    with open(path, 'rb') as f:
+        last_offset = max(0, stat.st_size - chunk_size)
+        for i in range(n_chunks):
+            f.seek(last_offset * i // max(1, n_chunks - 1))
+            digest.update(f.read(chunk_size))
+
+    return digest.hexdigest()
+
+
+def fingerprint_sources(left_paths: List[str], right_paths: List[str], **params) -> str:
+    """Cache key for a pair of cameras. Source lists are sorted, so the key does not depend on the clip order, and
+    params (e.g. sample rate) are included as they change the result."""
+    digest = hashlib.blake2b(digest_size=16)
+    for side, paths in (("left", left_paths), ("right", right_paths)):
+        digest.update(side.encode())
+        for path in sorted(paths):
+            digest.update(fingerprint_file(path).encode())
+    digest.update(json.dumps(params, sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+class SyncCache:
+    """Persistent cache of synchronization results in a JSON file, keyed by fingerprint_sources.
+
+    Entries are dicts of e.g. delay in milliseconds, confidence and sample rate. Cache holds at most max_entries
+    entries and removes the least recently used ones first. Errors reading or writing the cache are logged and
+    treated as a cache miss, so a broken cache never stops processing.
+    """
+
+    def __init__(self, cache_dir: Optional[str] = None, max_entries: int = MAX_CACHE_ENTRIES):
+        self.cache_dir = cache_dir or get_cache_dir()
+        self.path = os.path.join(self.cache_dir, "sync_cache.json")
+        self.max_entries = max_entries
+
+    def _load(self) -> Dict[str, dict]:
+        try:
+            with open(self.path, 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not read sync cache {self.path}: {e}")
+            return {}
+
+    def _save(self, entries: Dict[str, dict]):
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            # Write to a temporary file first, so that concurrent runs never read a partially written cache
+            with tempfile.NamedTemporaryFile('w', dir=self.cache_dir, suffix='.tmp', delete=False) as f:
+                json.dump(entries, f)
+            os.replace(f.name, self.path)
+        except OSError as e:
+            logger.warning(f"Could not write sync cache {self.path}: {e}")
+
+    def get(self, key: str) -> Optional[dict]:
+        entries = self._load()
+        entry = entries.get(key)
+        if entry is None:
+            return None
+        entry['last_used'] = time.time()
+        self._save(entries)
+        return entry
+
+    def put(self, key: str, value: dict):
+        entries = self._load()
+        entries[key] = dict(value, last_used=time.time())
+        n_evicted = len(entries) - self.max_entries
+        if n_evicted > 0:
+            for old_key in sorted(entries, key=lambda k: entries[k].get('last_used', 0))[:n_evicted]:
+                del entries[old_key]
+        self._save(entries)
@@ -1,7 +1,9 @@
+from dataclasses import dataclass
 from typing import Dict, Union, List, Tuple, Optional
 
 from .eval_utils import eval_expr
 from .file_utils import create_temporary_file_name_with_extension
+from .metadata_cache import get_metadata_cache
 
 
 from tempfile import NamedTemporaryFile
@@ -12,6 +14,8 @@ from moviepy.tools import subprocess_call
 from moviepy.config import get_setting
 from moviepy.video.io.VideoFileClip import VideoFileClip
 import cv2
+import numpy as np
+from datetime import datetime
 from ..logger import setup_logger
 import subprocess
 
@@ -19,6 +23,11 @@ import os
 
 logger = setup_logger(__name__)
 
+# Encoders of re-encoded parts and bitstream filters that keep codec parameters in band, so that parts of the
+# camera's encoder and ours decode correctly after concatenation even though their parameter sets differ
+REENCODERS = {'h264': 'libx264', 'hevc': 'libx265'}
+ANNEXB_FILTERS = {'h264': 'h264_mp4toannexb', 'hevc': 'hevc_mp4toannexb'}
+
 
 def get_video_info(video_path) -> Dict[str, Union[int, float, str]]:
     """
@@ -29,7 +38,21 @@ def get_video_info(video_path) -> Dict[str, Union[int, float, str]]:
         frame rate as FPS
         duration in seconds
     """
-    probe = ffmpeg.probe(video_path)
+    return parse_video_info(probe_video(video_path))
+
+
+def probe_video(video_path: str) -> dict:
+    """ffprobe output of the video, cached by path, size and modification time of the file."""
+    cache = get_metadata_cache()
+    probe = cache.get_json(video_path, 'probe')
+    if probe is None:
+        probe = ffmpeg.probe(video_path)
+        cache.put_json(video_path, 'probe', probe)
+    return probe
+
+
+def parse_video_info(probe: dict) -> Dict[str, Union[int, float, str]]:
+    """Video info of get_video_info from ffprobe output."""
     file_path = str(probe['format']['filename'])
     file_type = os.path.splitext(file_path)[1].lower().replace(".", "")
     video_stream = next((stream for stream in probe['streams'] if stream['codec_type'] == 'video'), None)
@@ -48,8 +71,86 @@ def get_video_info(video_path) -> Dict[str, Union[int, float, str]]:
     }
 
 
+def get_video_metadata(video_path: str) -> Dict[str, Union[int, float, str, datetime, None]]:
+    """
+    Return video info of get_video_info with recording time metadata from the same ffprobe call:
+        creation time of the container as datetime, or None
+        timecode of the first frame as string HH:MM:SS:FF, or None
+    """
+    probe = probe_video(video_path)
+    video_info = parse_video_info(probe)
+
+    format_tags = probe['format'].get('tags', {})
+    creation_time = format_tags.get('creation_time')
+    timecode = format_tags.get('timecode')
+    for stream in probe['streams']:
+        tags = stream.get('tags', {})
+        creation_time = creation_time or tags.get('creation_time')
+        timecode = timecode or tags.get('timecode')
+
+    video_info['creation_time'] = parse_creation_time(creation_time) if creation_time else None
+    video_info['timecode'] = timecode
+    return video_info
+
+
+def parse_creation_time(value: str) -> Optional[datetime]:
+    try:
+        return datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        logger.debug(f"Cannot parse creation time {value}")
+        return None
+
+
+def timecode_to_seconds(timecode: str, frame_rate: float) -> float:
+    """Convert SMPTE timecode HH:MM:SS:FF (or HH:MM:SS;FF for drop frame) to seconds."""
+    hours, minutes, seconds, frames = (int(part) for part in timecode.replace(';', ':').split(':'))
+    return hours * 3600 + minutes * 60 + seconds + frames / frame_rate
+
+
+def read_thumbnail(video_path: str, width: int, height: int, last: bool = False,
+                   end_offset: float = 3.0, gray: bool = False) -> Optional[np.ndarray]:
+    """
+    Decode one BGR frame, or with gray a single channel frame, scaled to width x height with ffmpeg. First frame of
+    the video by default, or with last, the last keyframe within end_offset seconds from the end, found with -sseof
+    and decoding only keyframes, so the file is never read through. Returns None if no frame is decoded.
+
+    Thumbnails are cached like probes, so sorting the same clips again does not run ffmpeg.
+    """
+    cache = get_metadata_cache()
+    cache_kind = f"thumbnail:{width}x{height}:{'gray' if gray else 'bgr'}:{f'last{end_offset:g}' if last else 'first'}"
+    frame = cache.get_array(video_path, cache_kind)
+    if frame is not None:
+        return frame
+
+    n_channels = 1 if gray else 3
+    input_args = {'sseof': -end_offset, 'skip_frame': 'nokey'} if last else {}
+    output_args = {'vsync': 0} if last else {'vframes': 1}
+    try:
+        out, _ = (
+            ffmpeg
+            .input(video_path, **input_args)
+            .filter('scale', width, height)
+            .output('pipe:', format='rawvideo', pix_fmt='gray' if gray else 'bgr24', **output_args)
+            .global_args('-nostdin', '-loglevel', 'error')
+            .run(capture_stdout=True, capture_stderr=True)
+        )
+    except ffmpeg.Error as e:
+        logger.error(f"Error reading thumbnail from {video_path}: {e.stderr.decode(errors='ignore')}")
+        return None
+
+    frame_size = width * height * n_channels
+    if len(out) < frame_size:
+        return None
+    # Last complete frame of the output
+    n_frames = len(out) // frame_size
+    frame = np.frombuffer(out, dtype=np.uint8, count=frame_size, offset=(n_frames - 1) * frame_size)
+    frame = frame.reshape(height, width) if gray else frame.reshape(height, width, 3)
+    cache.put_array(video_path, cache_kind, frame)
+    return frame
+
+
 def get_num_frames(video_path: str) -> int:
-    video_streams = [s for s in ffmpeg.probe(video_path)["streams"] if s["codec_type"] == "video"]
+    video_streams = [s for s in probe_video(video_path)["streams"] if s["codec_type"] == "video"]
     assert len(video_streams) == 1
     return int(video_streams[0]["nb_frames"])
 
@@ -183,20 +284,191 @@ def cut_subclip_with_ffmpeg(input_path: str, output_path: str, start_time: float
         logger.error(f"Error cutting video {input_path}: {str(e)}")
         raise
 
+def cut_and_retime_with_ffmpeg(input_path: str, output_path: str, start_time: float, duration: float, speed: float,
+                               frame_rate: Union[int, str]):
+    """Cut duration seconds of output from start_time and play the video at speed, keeping frame_rate by dropping or
+    duplicating frames. Video is re-encoded with the codec and pixel format of the input, so it can be concatenated
+    with stream copied parts, audio is dropped as it is mixed separately."""
+    cut_subclip_with_ffmpeg(input_path, output_path, start_time, start_time + duration,
+                            dict(get_reencode_args(input_path, frame_rate), vf=f'setpts=PTS/{speed!r}'))
+
+
 def cut_clips_with_ffmpeg(temp_dir: str, file_type: str, start_time: float, end_time: float, left_video_path: str, right_video_path: str) -> Tuple[str, str]:
     """
-    Cut video clips with ffmpeg based on start and end time.
+    Cut video clips with ffmpeg based on start and end time, frame accurately with smart_cut_with_ffmpeg.
     Returns paths to both cut video files.
     """
     preprocessed_video_left_path = create_temporary_file_name_with_extension(temp_dir, file_type)
     preprocessed_video_right_path = create_temporary_file_name_with_extension(temp_dir, file_type)
-    ffmpeg_extract_subclip(left_video_path, start_time, end_time, preprocessed_video_left_path)
-    ffmpeg_extract_subclip(right_video_path, start_time, end_time,
-                            preprocessed_video_right_path)
+    smart_cut_with_ffmpeg(left_video_path, preprocessed_video_left_path, start_time, end_time, temp_dir)
+    smart_cut_with_ffmpeg(right_video_path, preprocessed_video_right_path, start_time, end_time, temp_dir)
     
     return preprocessed_video_left_path, preprocessed_video_right_path
 
 
+@dataclass
+class KeyframeIndex:
+    """Keyframes of the first video stream that start a closed GOP, i.e. no frame decoded after the keyframe is shown
+    before it, so the video can be cut at them. Times are seconds from the start of the video and packets positions
+    of the keyframes in decoding order."""
+    times: np.ndarray
+    packets: np.ndarray
+
+
+def get_keyframe_index(video_path: str) -> KeyframeIndex:
+    """
+    Keyframe index of the video, found with one ffprobe scan of the packet headers without decoding, and cached
+    with the probe, so every file is scanned once.
+    """
+    cache = get_metadata_cache()
+    index = cache.get_json(video_path, 'keyframe_index')
+    if index is None:
+        result = subprocess.run(['ffprobe', '-v', 'error', '-select_streams', 'v:0', '-show_entries',
+                                 'packet=pts_time,flags', '-of', 'csv=p=0', video_path],
+                                capture_output=True, text=True, check=True)
+        start_time = float(probe_video(video_path)['format'].get('start_time', 0))
+        pts_times = []
+        is_key = []
+        for line in result.stdout.splitlines():
+            pts_time, _, flags = line.partition(',')
+            pts_times.append(float(pts_time) if pts_time not in ('', 'N/A') else np.inf)
+            is_key.append('K' in flags)
+        pts_times = np.array(pts_times)
+
+        # Keyframes of open GOPs are followed in decoding order by frames shown before them, which refer to the
+        # previous GOP. Earliest time shown after every packet finds them.
+        shown_after = np.append(np.minimum.accumulate(pts_times[::-1])[::-1][1:], np.inf)
+        packets = np.flatnonzero(np.array(is_key, dtype=bool) & (shown_after >= pts_times))
+        index = {'times': (pts_times[packets] - start_time).tolist(), 'packets': packets.tolist()}
+        cache.put_json(video_path, 'keyframe_index', index)
+    return KeyframeIndex(np.array(index['times']), np.array(index['packets'], dtype=int))
+
+
+def get_video_stream(video_path: str) -> dict:
+    return next(stream for stream in probe_video(video_path)['streams'] if stream['codec_type'] == 'video')
+
+
+def get_reencode_args(video_path: str, frame_rate: Union[int, str]) -> dict:
+    """Encoder arguments for re-encoding parts of a video with the codec and pixel format of the video, so they can
+    be concatenated with stream copied parts. Headers are repeated in band at every keyframe."""
+    video_stream = get_video_stream(video_path)
+    vcodec = REENCODERS.get(video_stream['codec_name'], 'libx264')
+    return {
+        'vcodec': vcodec,
+        'pix_fmt': video_stream.get('pix_fmt', 'yuv420p'),
+        'r': frame_rate,
+        'crf': 18,
+        'preset': 'veryfast',
+        f"{vcodec.replace('lib', '')}-params": 'repeat-headers=1',
+        'an': None
+    }
+
+
+def cut_part_with_ffmpeg(input_path: str, output_path: str, seek_time: float, n_frames: int, output_args: dict):
+    """Write n_frames video frames from seek_time seconds of the input."""
+    (
+        ffmpeg
+        .input(input_path, ss=f"{max(0.0, seek_time):.6f}")
+        .output(output_path, **{'frames:v': n_frames}, **output_args)
+        .global_args('-nostdin', '-loglevel', 'error')
+        .overwrite_output()
+        .run(capture_stdout=True, capture_stderr=True)
+    )
+
+
+def check_smart_cut(output_path: str, n_frames: int, frame_rate: float, joint_times: List[float]):
+    """Raise ValueError unless the cut has n_frames frames, lasts n_frames / frame_rate seconds and decodes without
+    errors across every joint of re-encoded and stream copied parts."""
+    probe = ffmpeg.probe(output_path, select_streams='v:0', count_packets=None)
+    n_packets = int(probe['streams'][0]['nb_read_packets'])
+    duration = float(probe['format']['duration'])
+    if n_packets != n_frames or abs(duration - n_frames / frame_rate) > 1.5 / frame_rate:
+        raise ValueError(f"cut has {n_packets} frames and lasts {duration:.3f} s, expected {n_frames} frames")
+
+    for joint_time in joint_times:
+        result = subprocess.run(['ffmpeg', '-nostdin', '-v', 'fatal', '-xerror', '-ss', f"{max(0.0, joint_time - 1):.6f}",
+                                 '-i', output_path, '-t', '2', '-f', 'null', '-'], capture_output=True)
+        if result.returncode != 0:
+            raise ValueError(f"cut does not decode at {joint_time:.3f} s")
+
+
+def smart_cut_with_ffmpeg(input_path: str, output_path: str, start_time: float, end_time: float,
+                          temp_dir: Optional[str] = None):
+    """
+    Frame accurate cut of video between start_time and end_time seconds at nearly stream copy speed. GOPs fully
+    inside the range are stream copied and only the partial GOPs at both edges are re-encoded, using the keyframe
+    index of the video. Audio is dropped as it is mixed separately.
+
+    Falls back to ffmpeg_extract_subclip, which snaps to keyframes, if any step fails or the result does not have
+    the frames of the range, e.g. for codecs other than H.264 and HEVC or old ffmpeg versions.
+    """
+    try:
+        _smart_cut_with_ffmpeg(input_path, output_path, start_time, end_time, temp_dir)
+    except (OSError, ValueError, KeyError, StopIteration, subprocess.CalledProcessError, ffmpeg.Error) as e:
+        if isinstance(e, ffmpeg.Error) and e.stderr:
+            e = e.stderr.decode(errors='ignore').strip()
+        logger.warning(f"Frame accurate cut of {input_path} failed, cut snaps to keyframes: {e}")
+        ffmpeg_extract_subclip(input_path, start_time, end_time, output_path)
+
+
+def _smart_cut_with_ffmpeg(input_path: str, output_path: str, start_time: float, end_time: float,
+                           temp_dir: Optional[str]):
+    video_stream = get_video_stream(input_path)
+    codec = video_stream['codec_name']
+    if codec not in ANNEXB_FILTERS:
+        raise ValueError(f"smart cut does not support codec {codec}")
+
+    frame_rate_expr = video_stream['avg_frame_rate']
+    frame_rate = eval_expr(frame_rate_expr)
+    keyframes = get_keyframe_index(input_path)
+
+    # Cut in whole frames, frames are seeked a quarter frame before or after them so rounding never picks a neighbour
+    start_frame = int(round(start_time * frame_rate))
+    end_frame = int(round(end_time * frame_rate))
+    keyframe_frames = np.round(keyframes.times * frame_rate).astype(int)
+    inside = np.flatnonzero((keyframe_frames >= start_frame) & (keyframe_frames <= end_frame))
+
+    encode_args = get_reencode_args(input_path, frame_rate_expr)
+    if len(inside) < 2:
+        logger.debug(f"No complete GOP between {start_time:.3f} s and {end_time:.3f} s, re-encoding whole cut")
+        cut_part_with_ffmpeg(input_path, output_path, (start_frame - 0.25) / frame_rate, end_frame - start_frame,
+                             encode_args)
+        check_smart_cut(output_path, end_frame - start_frame, frame_rate, [])
+        return
+
+    first, last = inside[0], inside[-1]
+    copy_start, copy_end = keyframe_frames[first], keyframe_frames[last]
+    # Stream copy seeks to the keyframe before the seek time and copies whole GOPs by packet count, so packets after
+    # the keyframe at copy_end that are decoded before it ends are never copied
+    # Timestamps are shifted back by the quarter frame seeked past the keyframe, so the keyframe starts at zero
+    copy_args = {'vcodec': 'copy', 'an': None, 'f': 'mp4', 'bsf:v': ANNEXB_FILTERS[codec],
+                 'output_ts_offset': f"{0.25 / frame_rate:.6f}"}
+    encode_args = dict(encode_args, f='mp4', **{'bsf:v': ANNEXB_FILTERS[codec]})
+    parts = [((copy_start + 0.25) / frame_rate, int(keyframes.packets[last] - keyframes.packets[first]), copy_args)]
+    if copy_start > start_frame:
+        parts.insert(0, ((start_frame - 0.25) / frame_rate, int(copy_start - start_frame), encode_args))
+    if end_frame > copy_end:
+        parts.append(((copy_end - 0.25) / frame_rate, int(end_frame - copy_end), encode_args))
+    logger.debug(f"Cutting {input_path} from {start_time:.3f} s to {end_time:.3f} s, stream copying "
+                 f"{copy_start / frame_rate:.3f} s - {copy_end / frame_rate:.3f} s")
+
+    temp_dir = temp_dir or os.path.dirname(os.path.abspath(output_path))
+    part_paths = []
+    try:
+        for seek_time, n_frames, output_args in parts:
+            part_path = create_temporary_file_name_with_extension(temp_dir, 'mp4')
+            part_paths.append(part_path)
+            cut_part_with_ffmpeg(input_path, part_path, seek_time, n_frames, output_args)
+        ffmpeg_concatenate_video_clips(part_paths, output_path=output_path)
+    finally:
+        for part_path in part_paths:
+            if os.path.exists(part_path):
+                os.remove(part_path)
+
+    joint_times = np.cumsum([n_frames for _, n_frames, _ in parts[:-1]]) / frame_rate
+    check_smart_cut(output_path, end_frame - start_frame, frame_rate, joint_times.tolist())
+
+
 def ffmpeg_extract_subclip(filename: str, t1: float, t2: float, target_name: str = None):
     """ Makes a new video file playing video file ``filename`` between
     the times ``t1`` and ``t2``. t1 and t2 are in seconds."""
@@ -1,9 +1,238 @@
 from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional, Tuple, Type
+
 import cv2
+import numpy as np
+from tqdm import tqdm
+
+from .frame_pipeline import ThreadedFrameReader, ThreadedFrameWriter, read_frame
+from .switch_history import SwitchHistory, LEFT_CAMERA, RIGHT_CAMERA, dwell_time_to_steps
+
+# Mixer engines by name, filled by register_mixer
+MIXER_REGISTRY: Dict[str, Type["VideoMixerBase"]] = {}
+
+
+def register_mixer(name: str):
+    """Class decorator that registers mixer engine with name used in --mixer-type."""
+    def decorator(cls):
+        cls.name = name
+        MIXER_REGISTRY[name] = cls
+        return cls
+    return decorator
+
+
+@dataclass(frozen=True)
+class MixerCostProfile:
+    """How much analysis a mixer engine does by default.
+
+    analysis_fps: how many times per second of video the frames are analysed
+    analysis_scale: scale of the analysed frames relative to input resolution
+    frame_cost: relative cost of analysing one analysis size frame, 1.0 for absolute difference
+    """
+    analysis_fps: float
+    analysis_scale: float
+    frame_cost: float = 1.0
+
+    @property
+    def analysis_cost(self) -> float:
+        """Relative analysis work per second of full resolution video."""
+        return self.analysis_fps * self.analysis_scale ** 2 * self.frame_cost
 
 
 class VideoMixerBase(ABC):
+    """Base class for mixer engines.
+
+    Engine decides which camera to show for each frame: setup() is called once with the first frames of the videos,
+    reset() with the frames where the decisions start and decide() for every following frame. Engine analyses frames
+    only on analysis frames (every frames_per_flow frame) and votes for a camera, the votes are combined by
+    SwitchHistory. On other frames, decide() does not need the frames. Analysed frames can be full resolution or
+    already resized to analysis_size. mix_video() and mix_frames() implement the shared reading and writing of frames.
+
+    Engines register themselves with register_mixer and are created by name with mixer_registry.get_mixer.
+    """
+
+    name: str = None
+    cost_profile = MixerCostProfile(analysis_fps=5, analysis_scale=0.25)
+
+    def __init__(self, analysis_fps: Optional[float] = None, analysis_scale: Optional[float] = None,
+                 history_length: int = 24, hysteresis: float = 0.0, min_dwell_time: float = 0.0):
+        self.analysis_fps = analysis_fps if analysis_fps is not None else self.cost_profile.analysis_fps
+        self.analysis_scale = analysis_scale if analysis_scale is not None else self.cost_profile.analysis_scale
+        self.history_length = history_length
+        self.hysteresis = hysteresis
+        self.min_dwell_time = min_dwell_time
+
+        self.input_fps = None
+        self.frames_per_flow = 1
+        self.analysis_size: Optional[Tuple[int, int]] = None
+        self.optical_flow_history: Optional[SwitchHistory] = None
+        # Index of the last decided frame and its camera, read by the decoding threads of mix_video. Assigned as one
+        # tuple, so the threads never see the index of one decision with the camera of another
+        self.last_decision: Optional[Tuple[int, int]] = None
+
+    def setup(self, first_left: np.ndarray, first_right: np.ndarray, input_fps: float,
+              setup_state: Optional[Dict] = None):
+        """Initialize engine for the videos, e.g. detect field masks from the first frames. If setup_state from
+        another engine set up for the same videos is given, it is used instead of detecting again."""
+        self.input_fps = input_fps
+        self.frames_per_flow = max(1, round(input_fps / self.analysis_fps))  # How many frames between flow calculations
+        height, width = first_left.shape[:2]
+        self.analysis_size = (max(1, round(width * self.analysis_scale)), max(1, round(height * self.analysis_scale)))
+
+    def get_setup_state(self) -> Dict:
+        """State that setup() detected from the first frames, which can be passed to setup() of other engines."""
+        return {}
+
+    def create_history(self) -> SwitchHistory:
+        return SwitchHistory(
+            self.history_length,
+            initial_vote=LEFT_CAMERA,  # Start with left camera
+            hysteresis=self.hysteresis,
+            min_dwell=dwell_time_to_steps(self.min_dwell_time, self.input_fps, self.frames_per_flow)
+        )
+
+    def reset(self, frame_left: np.ndarray, frame_right: np.ndarray) -> int:
+        """Start deciding from these frames with empty history. Returns camera for these frames."""
+        self.optical_flow_history = self.create_history()
+        self.start_analysis(frame_left, frame_right)
+        return self.camera
 
     @abstractmethod
-    def mix_video(self, video_capture1: cv2.VideoCapture, video_capture2: cv2.VideoCapture, video_output_path: str) -> cv2.VideoWriter:
+    def start_analysis(self, frame_left: np.ndarray, frame_right: np.ndarray):
+        """Use the frames as previous frames of the next analysis."""
         pass
+
+    @abstractmethod
+    def vote(self, frame_left: np.ndarray, frame_right: np.ndarray) -> int:
+        """Analyse frames and return camera that has the action."""
+        pass
+
+    @property
+    def camera(self) -> int:
+        return self.optical_flow_history.camera
+
+    def is_analysis_frame(self, frame_index: int) -> bool:
+        return frame_index % self.frames_per_flow == 0
+
+    def decided_camera(self, frame_index: int) -> Optional[int]:
+        """Camera for a frame after the last decision, or None if it is not known yet. Camera changes only on
+        analysis frames, so it is known up to the next analysis frame after the last decision."""
+        if self.last_decision is None:
+            return None
+        decided_index, camera = self.last_decision
+        next_analysis_index = (decided_index // self.frames_per_flow + 1) * self.frames_per_flow
+        return camera if frame_index < next_analysis_index else None
+
+    def needs_frame(self, camera: int, frame_index: int) -> bool:
+        """Whether the frame of camera must be converted to an image: it is analysed, or it is written because the
+        camera is chosen for it. Frames whose camera is not decided yet are always needed, so decoding threads never
+        wait for the decisions."""
+        if self.is_analysis_frame(frame_index):
+            return True
+        decided_camera = self.decided_camera(frame_index)
+        return decided_camera is None or decided_camera == camera
+
+    def set_last_decision(self, frame_index: int, camera: int):
+        self.last_decision = (frame_index, camera)
+
+    def decide(self, frame_index: int, frame_left: Optional[np.ndarray], frame_right: Optional[np.ndarray]) -> int:
+        """Return camera for the frame. Frames are needed only on analysis frames, otherwise they can be None."""
+        if self.is_analysis_frame(frame_index):
+            self.optical_flow_history.push(self.vote(frame_left, frame_right))
+        return self.optical_flow_history.camera
+
+    def mix_frames(self, video_capture_left, video_capture_right, video_output, first_left: np.ndarray,
+                   first_right: np.ndarray, start_frame: int, end_frame: int, write_start: Optional[int] = None,
+                   progress_callback: Optional[Callable[[int], None]] = None):
+        """Write chosen frames of [write_start, end_frame) to video_output.
+
+        first_left and first_right are frames at start_frame and the captures must be positioned right after them.
+        Frames before write_start are only used to build up the decision history.
+        """
+        write_start = start_frame if write_start is None else write_start
+
+        camera = self.reset(first_left, first_right)
+        self.set_last_decision(start_frame, camera)
+        use_left = camera == LEFT_CAMERA
+        if write_start == start_frame:
+            video_output.write(first_left if use_left else first_right)
+
+        n_frames = max(1, end_frame - write_start)
+        last_progress = None
+
+        for i in tqdm(range(start_frame + 1, end_frame)):
+            # Both frames are needed only for analysis, otherwise decode only the frame that is written
+            write_frame = i >= write_start
+            analysis_frame = self.is_analysis_frame(i)
+            res_left, frame_left = read_frame(video_capture_left,
+                                              retrieve=analysis_frame or (write_frame and use_left))
+            res_right, frame_right = read_frame(video_capture_right,
+                                                retrieve=analysis_frame or (write_frame and not use_left))
+
+            if res_left is False or res_right is False:
+                break
+
+            camera = self.decide(i, frame_left, frame_right)
+            self.set_last_decision(i, camera)
+            use_left = camera == LEFT_CAMERA
+
+            if not write_frame:
+                continue
+
+            video_output.write(frame_left if use_left else frame_right)
+
+            if progress_callback:
+                progress = int(((i - write_start) / n_frames) * 100)
+                if progress != last_progress:
+                    progress_callback(progress)
+                    last_progress = progress
+
+    def mix_video(self, video_capture_left: cv2.VideoCapture, video_capture_right: cv2.VideoCapture,
+                  video_output_path: str, input_fps: int = 30, output_fps: int = 30,
+                  output_height: int = 1080, output_width: int = 1920,
+                  fourcc: cv2.VideoWriter_fourcc = cv2.VideoWriter_fourcc('M', 'J', 'P', 'G'),
+                  progress_callback: Optional[Callable[[int], None]] = None, threaded_io: bool = True,
+                  queue_size: int = 32) -> cv2.VideoWriter:
+        """Mix synchronized videos to video_output_path.
+
+        With threaded_io, both cameras are decoded on their own threads and the output is encoded on a separate
+        thread, so decoding, analysis and encoding overlap instead of running in series. queue_size bounds the number
+        of frames buffered between the stages. Decoding threads skip converting the frames that needs_frame knows are
+        not needed, which happens when decoding is slower than the analysis and the threads do not run ahead.
+        """
+        if output_fps > input_fps:
+            raise ValueError("Output fps cannot be higher than input fps")
+
+        left_n_frames = int(video_capture_left.get(cv2.CAP_PROP_FRAME_COUNT)) - 1
+        right_n_frames = int(video_capture_right.get(cv2.CAP_PROP_FRAME_COUNT)) - 1
+        total_frames = min(left_n_frames, right_n_frames)
+
+        video_writer = cv2.VideoWriter(video_output_path, fourcc, output_fps, (output_width, output_height))
+
+        if threaded_io:
+            self.last_decision = None
+            video_capture_left = ThreadedFrameReader(video_capture_left, queue_size=queue_size,
+                                                     retrieve_frame=lambda i: self.needs_frame(LEFT_CAMERA, i))
+            video_capture_right = ThreadedFrameReader(video_capture_right, queue_size=queue_size,
+                                                      retrieve_frame=lambda i: self.needs_frame(RIGHT_CAMERA, i))
+            video_output = ThreadedFrameWriter(video_writer, queue_size=queue_size)
+        else:
+            video_output = video_writer
+
+        try:
+            _, first_left = video_capture_left.read()
+            _, first_right = video_capture_right.read()
+
+            if first_left is None or first_right is None:
+                raise ValueError("Could not read first frames from videos")
+
+            self.setup(first_left, first_right, input_fps)
+            self.mix_frames(video_capture_left, video_capture_right, video_output, first_left, first_right,
+                            start_frame=0, end_frame=total_frames, progress_callback=progress_callback)
+        finally:
+            video_capture_left.release()
+            video_capture_right.release()
+            video_output.release()
+
+        return video_writer
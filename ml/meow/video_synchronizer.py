@@ -1,4 +1,4 @@
-from .utils.video_utils import get_video_info, ffmpeg_extract_subclip, get_video_info
+from .utils.video_utils import get_video_info, get_video_stream, smart_cut_with_ffmpeg, cut_and_retime_with_ffmpeg
 from .utils.file_utils import create_temporary_file_name_with_extension
 from typing import Optional, Tuple
 from .logger import setup_logger
@@ -6,10 +6,14 @@ from .logger import setup_logger
 logger = setup_logger(__name__)
 
 # If delay is positive, audio1 needs to be delayed and negative if audio2 needs to be delayed
-def synchronize_videos(video1_path: str, video2_path: str, delay: float, video1_output_path: Optional[str] = None, video2_output_path: Optional[str] = None, temp_dir: Optional[str] = None, output_file_type: Optional[str] = None) -> Tuple[str, str]:
+def synchronize_videos(video1_path: str, video2_path: str, delay: float, video1_output_path: Optional[str] = None, video2_output_path: Optional[str] = None, temp_dir: Optional[str] = None, output_file_type: Optional[str] = None, drift: float = 0.0) -> Tuple[str, str]:
     """Delay is calculated based on video1 relative position to video2. If delay is positive, video1 is playing delay
     amount of time before video2 and video1 needs to delayed, meaning that we need to cut delay amount of time from the
-    start of video1. If delay is negative, we need to do opposite."""
+    start of video1. If delay is negative, we need to do opposite.
+
+    Delay is the delay at the start of video1. If drift (change of the delay per second, see OffsetMap) adds up to
+    at least half a frame over the synchronized part, video2 is re-encoded at 1 - drift speed to keep it in sync.
+    Other cuts are frame accurate with smart_cut_with_ffmpeg, so they match the delay exactly."""
 
     logger.debug("Starting video synchronization")
 
@@ -26,6 +30,11 @@ def synchronize_videos(video1_path: str, video2_path: str, delay: float, video1_
 
     final_duration = min(video1_info['duration'], video2_info['duration']) - abs(delay)
 
+    frame_rate = video1_info['frame_rate']
+    correct_drift = abs(drift) * final_duration >= 0.5 / frame_rate
+    if drift != 0 and not correct_drift:
+        logger.debug(f"Drift is less than half a frame over {final_duration:.0f} seconds, not retiming video")
+
     if delay > 0:
         logger.debug(f"Delay {video1_path} by {delay} seconds")
 
@@ -34,9 +43,6 @@ def synchronize_videos(video1_path: str, video2_path: str, delay: float, video1_
         video2_start_time = 0
         video2_end_time = final_duration
 
-        ffmpeg_extract_subclip(video1_path, video1_start_time, video1_end_time, video1_output_path)
-        ffmpeg_extract_subclip(video2_path, video2_start_time, video2_end_time, video2_output_path)
-
     else:
         delay = abs(delay)
         logger.debug(f"Delay {video2_path} by {delay} seconds")
@@ -46,7 +52,19 @@ def synchronize_videos(video1_path: str, video2_path: str, delay: float, video1_
         video2_start_time = delay
         video2_end_time = final_duration + delay
 
-        ffmpeg_extract_subclip(video1_path, video1_start_time, video1_end_time, video1_output_path)
-        ffmpeg_extract_subclip(video2_path, video2_start_time, video2_end_time, video2_output_path)
+    if correct_drift:
+        speed = 1 - drift
+        # Retimed video2 covers (duration - start) / speed seconds of video1
+        final_duration = min(video1_info['duration'] - video1_start_time,
+                             (video2_info['duration'] - video2_start_time) / speed)
+        logger.info(f"Correcting drift of {drift * 1e6:.1f} ppm by playing {video2_path} at {speed:.6f} speed")
+        smart_cut_with_ffmpeg(video1_path, video1_output_path, video1_start_time, video1_start_time + final_duration,
+                              temp_dir)
+        # Exact frame rate of video1, e.g. 30000/1001, so the retimed frames line up with the frames of video1
+        cut_and_retime_with_ffmpeg(video2_path, video2_output_path, video2_start_time, final_duration, speed,
+                                   get_video_stream(video1_path)['avg_frame_rate'])
+    else:
+        smart_cut_with_ffmpeg(video1_path, video1_output_path, video1_start_time, video1_end_time, temp_dir)
+        smart_cut_with_ffmpeg(video2_path, video2_output_path, video2_start_time, video2_end_time, temp_dir)
 
     return video1_output_path, video2_output_path
@@ -0,0 +1,45 @@
+import cv2
+import pytest
+
+from ml.meow.benchmarks.synthetic_footage import SyntheticMatch, generate_synthetic_match
+from ml.meow.mixer_registry import get_mixer
+from ml.meow.timeline_mixer import decisions_to_timeline
+
+ANALYSIS_FPS = 5
+MIN_SEGMENT_DURATION = 2.0
+
+
+@pytest.fixture(scope="module")
+def match(tmp_path_factory) -> SyntheticMatch:
+    return generate_synthetic_match(str(tmp_path_factory.mktemp("footage")), duration=20, segment_duration=6)
+
+
+def create_timeline(mixer_type: str, match: SyntheticMatch, analysis_scale: float):
+    mixer = get_mixer(mixer_type, analysis_fps=ANALYSIS_FPS, analysis_scale=analysis_scale)
+    video_capture_left = cv2.VideoCapture(match.video_left_path)
+    video_capture_right = cv2.VideoCapture(match.video_right_path)
+    try:
+        _, frame_left = video_capture_left.read()
+        _, frame_right = video_capture_right.read()
+        mixer.setup(frame_left, frame_right, match.fps)
+        decisions = [mixer.reset(frame_left, frame_right)]
+        while True:
+            res_left, frame_left = video_capture_left.read()
+            res_right, frame_right = video_capture_right.read()
+            if not res_left or not res_right:
+                break
+            decisions.append(mixer.decide(len(decisions), frame_left, frame_right))
+    finally:
+        video_capture_left.release()
+        video_capture_right.release()
+
+    return decisions_to_timeline(decisions, match.fps, len(decisions) / match.fps, MIN_SEGMENT_DURATION)
+
+
+@pytest.mark.parametrize("mixer_type", ["abs_diff", "farneback"])
+@pytest.mark.parametrize("analysis_scale", [0.25, 0.125])
+def test_analysis_scale_keeps_switch_timeline(match, mixer_type, analysis_scale):
+    full_resolution_timeline = create_timeline(mixer_type, match, 1.0)
+
+    assert len(full_resolution_timeline) > 1
+    assert create_timeline(mixer_type, match, analysis_scale) == full_resolution_timeline
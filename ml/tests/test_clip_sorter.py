@@ -0,0 +1,142 @@
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pytest
+
+from ml.meow import clip_sorter
+from ml.meow.clip_sorter import (METADATA_OVERLAP_TOLERANCE, calculate_video_file_linking, order_by_gopro_chapters,
+                                 order_by_recording_time, solve_chain)
+
+START = datetime(2024, 5, 1, 10, 0, 0, tzinfo=timezone.utc)
+
+
+def chain_cost(link_costs: np.ndarray, order):
+    return sum(link_costs[previous, current] for previous, current in zip(order, order[1:]))
+
+
+def video_info(offset: float = None, duration: float = 60.0, timecode: str = None):
+    return {
+        'creation_time': None if offset is None else START + timedelta(seconds=offset),
+        'timecode': timecode,
+        'frame_rate': 25.0,
+        'duration': duration,
+        'frame_width': 64,
+        'frame_height': 36,
+    }
+
+
+def test_solve_chain_follows_cheapest_links():
+    link_costs = np.full((4, 4), 100.0)
+    for previous, current in [(2, 0), (0, 3), (3, 1)]:
+        link_costs[previous, current] = 1.0
+    assert solve_chain(link_costs) == [2, 0, 3, 1]
+
+
+def test_solve_chain_ignores_diagonal():
+    # Static clips look like they follow themselves, the diagonal must never be chosen
+    link_costs = np.full((3, 3), 100.0)
+    np.fill_diagonal(link_costs, 0.0)
+    link_costs[1, 2] = 1.0
+    link_costs[2, 0] = 1.0
+    assert solve_chain(link_costs) == [1, 2, 0]
+
+
+def test_solve_chain_single_node():
+    assert solve_chain(np.zeros((1, 1))) == [0]
+
+
+def test_solve_chain_merges_cycles():
+    # Pairs 0 <-> 1 and 2 <-> 3 link to each other for free, so the assignment splits into a cycle through the
+    # dummy node and a separate cycle, which must be merged into one chain
+    link_costs = np.full((4, 4), 10.0)
+    for previous, current in [(0, 1), (1, 0), (2, 3), (3, 2)]:
+        link_costs[previous, current] = 0.0
+
+    order = solve_chain(link_costs)
+
+    assert sorted(order) == [0, 1, 2, 3]
+    assert chain_cost(link_costs, order) == 10.0
+    assert abs(order.index(0) - order.index(1)) == 1
+    assert abs(order.index(2) - order.index(3)) == 1
+
+
+@pytest.mark.parametrize("n_nodes", [5, 12])
+def test_solve_chain_returns_every_node_once(n_nodes):
+    rng = np.random.default_rng(n_nodes)
+    order = solve_chain(rng.uniform(0, 255, (n_nodes, n_nodes)))
+    assert sorted(order) == list(range(n_nodes))
+
+
+@pytest.mark.parametrize("names, expected", [
+    (["GX030001.MP4", "GX010001.MP4", "GX020001.MP4"], ["GX010001.MP4", "GX020001.MP4", "GX030001.MP4"]),
+    (["GP010042.MP4", "GOPR0042.MP4"], ["GOPR0042.MP4", "GP010042.MP4"]),
+    (["gh020007.mp4", "gh030007.mp4"], ["gh020007.mp4", "gh030007.mp4"]),
+])
+def test_order_by_gopro_chapters(names, expected):
+    paths = [f"/videos/left/{name}" for name in names]
+    assert order_by_gopro_chapters(paths) == [f"/videos/left/{name}" for name in expected]
+
+
+@pytest.mark.parametrize("names", [
+    ["GX010001.MP4", "GX030001.MP4"],  # missing chapter
+    ["GX010001.MP4", "GX020002.MP4"],  # different recordings
+    ["GX010001.MP4", "GH010001.MP4"],  # same chapter twice
+    ["GX010001.MP4", "clip.mp4"],
+])
+def test_order_by_gopro_chapters_rejects(names):
+    assert order_by_gopro_chapters([f"/videos/{name}" for name in names]) is None
+
+
+def test_order_by_recording_time():
+    video_infos = {'b.mp4': video_info(60.0), 'c.mp4': video_info(125.0), 'a.mp4': video_info(0.0)}
+    assert order_by_recording_time(list(video_infos), video_infos) == ['a.mp4', 'b.mp4', 'c.mp4']
+
+
+def test_order_by_recording_time_allows_overlap_within_tolerance():
+    video_infos = {'b.mp4': video_info(60.0 - METADATA_OVERLAP_TOLERANCE), 'a.mp4': video_info(0.0)}
+    assert order_by_recording_time(list(video_infos), video_infos) == ['a.mp4', 'b.mp4']
+
+
+@pytest.mark.parametrize("video_infos", [
+    {'a.mp4': video_info(0.0), 'b.mp4': video_info(0.0)},  # equal creation times
+    {'a.mp4': video_info(0.0), 'b.mp4': video_info(30.0)},  # overlapping clips
+    {'a.mp4': video_info(0.0), 'b.mp4': video_info(None)},  # no creation time
+])
+def test_order_by_recording_time_rejects(video_infos):
+    assert order_by_recording_time(list(video_infos), video_infos) is None
+
+
+def test_order_by_recording_time_prefers_timecode():
+    # Creation times would put b first, timecodes are used as every clip has one
+    video_infos = {'a.mp4': video_info(100.0, timecode="10:00:00:00"), 'b.mp4': video_info(0.0, timecode="10:01:00:00")}
+    assert order_by_recording_time(list(video_infos), video_infos) == ['a.mp4', 'b.mp4']
+
+
+def test_linking_falls_back_from_metadata_to_thumbnails(monkeypatch):
+    # Equal creation times cannot be ordered by metadata, so clips are linked by their end frames
+    paths = ['first.mp4', 'third.mp4', 'second.mp4']
+    video_infos = {path: video_info(0.0) for path in paths}
+    rng = np.random.default_rng(0)
+    boundaries = [rng.integers(0, 256, (36, 64), dtype=np.uint8) for _ in range(4)]
+    frame_mapping = {
+        'first.mp4': {'first_frame': boundaries[0], 'last_frame': boundaries[1]},
+        'second.mp4': {'first_frame': boundaries[1], 'last_frame': boundaries[2]},
+        'third.mp4': {'first_frame': boundaries[2], 'last_frame': boundaries[3]},
+    }
+    monkeypatch.setattr(clip_sorter, 'probe_videos', lambda video_file_paths, n_workers=None: video_infos)
+    monkeypatch.setattr(clip_sorter, 'extract_end_frames',
+                        lambda video_file_paths, infos, n_workers=None: frame_mapping)
+
+    assert calculate_video_file_linking(paths) == ['first.mp4', 'second.mp4', 'third.mp4']
+
+
+def test_linking_uses_metadata_before_thumbnails(monkeypatch):
+    paths = ['b.mp4', 'a.mp4']
+    video_infos = {'a.mp4': video_info(0.0), 'b.mp4': video_info(60.0)}
+    monkeypatch.setattr(clip_sorter, 'probe_videos', lambda video_file_paths, n_workers=None: video_infos)
+
+    def fail(*args, **kwargs):
+        raise AssertionError("frames must not be extracted when metadata orders the clips")
+
+    monkeypatch.setattr(clip_sorter, 'extract_end_frames', fail)
+    assert calculate_video_file_linking(paths) == ['a.mp4', 'b.mp4']
@@ -0,0 +1,46 @@
+import os
+
+import pytest
+
+from ml.meow.utils.metadata_cache import MetadataCache
+
+
+@pytest.fixture
+def media_file(tmp_path):
+    path = tmp_path / "clip.mp4"
+    path.write_bytes(b"not really a video")
+    return str(path)
+
+
+def test_values_are_persisted(tmp_path, media_file):
+    MetadataCache(str(tmp_path / "cache")).put(media_file, 'probe', b"value")
+    assert MetadataCache(str(tmp_path / "cache")).get(media_file, 'probe') == b"value"
+
+
+def test_in_memory_only_is_scoped(tmp_path, media_file):
+    cache = MetadataCache(str(tmp_path / "cache"))
+    with cache.in_memory_only():
+        with cache.in_memory_only():
+            cache.put(media_file, 'probe', b"first")
+        # Outer context still keeps the database untouched
+        cache.put(media_file, 'thumbnail', b"second")
+        assert cache.get(media_file, 'probe') == b"first"
+    assert not os.path.exists(cache.path)
+
+    cache.put(media_file, 'probe', b"third")
+    assert MetadataCache(str(tmp_path / "cache")).get(media_file, 'probe') == b"third"
+
+
+def test_in_memory_only_exits_on_error(tmp_path, media_file):
+    cache = MetadataCache(str(tmp_path / "cache"))
+    with pytest.raises(RuntimeError):
+        with cache.in_memory_only():
+            raise RuntimeError("run failed")
+    assert cache.is_persisted(os.path.abspath(media_file))
+
+
+def test_transient_dir(tmp_path, media_file):
+    cache = MetadataCache(str(tmp_path / "cache"))
+    with cache.transient_dir(str(tmp_path)):
+        assert not cache.is_persisted(os.path.abspath(media_file))
+    assert cache.is_persisted(os.path.abspath(media_file))
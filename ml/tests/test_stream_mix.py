@@ -0,0 +1,91 @@
+import numpy as np
+import pytest
+import soundfile as sf
+
+from ml.meow.audio_synchronizer import AudioBlockReader, mix_audio_tracks, stream_mix_audio
+
+SAMPLE_RATE = 8000
+MIX_RATIO = (0.7, 0.8)
+
+
+def interpolate(audio: np.ndarray, positions: np.ndarray) -> np.ndarray:
+    """Linear interpolation at fractional positions, zeros outside the audio like AudioBlockReader."""
+    padded = np.concatenate(([0.0], audio, [0.0]))
+    return np.interp(positions, np.arange(-1, len(audio) + 1), padded, left=0.0, right=0.0)
+
+
+def mix_in_memory(y1: np.ndarray, y2: np.ndarray, delay_samples: int, mix_ratio, drift: float = 0.0) -> np.ndarray:
+    """Whole signals synchronized, normalized and mixed at once."""
+    offset1 = max(0, delay_samples)
+    rate = 1 - drift
+    start2 = offset1 * rate - delay_samples
+    n1 = len(y1) - offset1
+    n2 = int(np.ceil((len(y2) - start2) / rate))
+    n_samples = max(n1, n2)
+
+    audio1 = np.zeros(n_samples)
+    audio1[:n1] = y1[offset1:]
+    audio2 = interpolate(y2, start2 + np.arange(n_samples) * rate)
+
+    audio1 /= np.max(np.abs(y1[offset1:]))
+    audio2 /= np.max(np.abs(y2[max(0, int(start2)):]))
+    return mix_audio_tracks(audio1, audio2, mix_ratio)
+
+
+def make_signals(length1: int, length2: int):
+    rng = np.random.default_rng(length1 + length2)
+    y1 = rng.uniform(-0.5, 0.5, length1).astype(np.float32)
+    y2 = rng.uniform(-0.1, 0.1, length2).astype(np.float32)
+    return y1, y2
+
+
+@pytest.mark.parametrize("delay_samples", [1234, -987, 0])
+@pytest.mark.parametrize("drift", [0.0, 2e-3, -3e-3])
+@pytest.mark.parametrize("block_size", [777, 4096, 100000])
+def test_stream_mix_matches_in_memory_mix(tmp_path, delay_samples, drift, block_size):
+    y1, y2 = make_signals(3 * SAMPLE_RATE + 11, 3 * SAMPLE_RATE - 501)
+    output_path = str(tmp_path / "mix.wav")
+
+    n_samples = stream_mix_audio(y1, y2, SAMPLE_RATE, output_path, delay_samples, MIX_RATIO, block_size, drift)
+
+    expected = mix_in_memory(y1, y2, delay_samples, MIX_RATIO, drift)
+    mixed, sr = sf.read(output_path)
+    assert sr == SAMPLE_RATE
+    assert n_samples == len(expected)
+    np.testing.assert_allclose(mixed, expected, rtol=0, atol=1e-5)
+
+
+def test_stream_mix_normalizes_to_peak_in_mixed_range(tmp_path):
+    y1, y2 = make_signals(2 * SAMPLE_RATE, 2 * SAMPLE_RATE)
+    # Peak in the cut start of y1 must not scale the mix down
+    y1[:100] = 1.0
+    output_path = str(tmp_path / "mix.wav")
+
+    stream_mix_audio(y1, y2, SAMPLE_RATE, output_path, 500, (1.0, 1.0), block_size=1000)
+
+    mixed, _ = sf.read(output_path)
+    np.testing.assert_allclose(np.max(np.abs(mixed), axis=0), 1.0, atol=1e-6)
+    np.testing.assert_allclose(mixed, mix_in_memory(y1, y2, 500, (1.0, 1.0)), rtol=0, atol=1e-5)
+
+
+def test_stream_mix_reads_sound_files(tmp_path):
+    y1, y2 = make_signals(2 * SAMPLE_RATE, 2 * SAMPLE_RATE + 300)
+    path1 = str(tmp_path / "left.wav")
+    path2 = str(tmp_path / "right.wav")
+    # Stereo file is averaged to mono
+    sf.write(path1, np.column_stack((y1, y1)), SAMPLE_RATE, subtype='FLOAT')
+    sf.write(path2, y2, SAMPLE_RATE, subtype='FLOAT')
+    output_path = str(tmp_path / "mix.wav")
+
+    stream_mix_audio(path1, path2, SAMPLE_RATE, output_path, -250, MIX_RATIO, block_size=999, drift=1e-3)
+
+    mixed, _ = sf.read(output_path)
+    np.testing.assert_allclose(mixed, mix_in_memory(y1, y2, -250, MIX_RATIO, 1e-3), rtol=0, atol=1e-5)
+
+
+def test_block_reader_interpolates_across_blocks():
+    audio = np.arange(100, dtype=np.float32)
+    reader = AudioBlockReader(audio, offset=-2.5, rate=0.75)
+    blocks = [reader.read(n_samples) for n_samples in (7, 13, 200)]
+    positions = -2.5 + np.arange(220) * 0.75
+    np.testing.assert_allclose(np.concatenate(blocks), interpolate(audio, positions), atol=1e-4)
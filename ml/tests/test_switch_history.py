@@ -0,0 +1,107 @@
+from collections import deque
+
+import numpy as np
+import pytest
+
+from ml.meow.switch_history import LEFT_CAMERA, RIGHT_CAMERA, SwitchHistory, dwell_time_to_steps
+
+L = LEFT_CAMERA
+R = RIGHT_CAMERA
+
+
+def push_all(history: SwitchHistory, votes):
+    return [history.push(vote) for vote in votes]
+
+
+def test_invalid_history_length():
+    with pytest.raises(ValueError):
+        SwitchHistory(0)
+
+
+@pytest.mark.parametrize("initial_vote, camera", [(L, L), (R, R)])
+def test_initial_camera(initial_vote, camera):
+    history = SwitchHistory(5, initial_vote=initial_vote)
+    assert history.camera == camera
+    assert history.use_left == (camera == L)
+
+
+@pytest.mark.parametrize("history_length", [1, 3, 8])
+def test_running_mean_matches_window(history_length):
+    rng = np.random.default_rng(history_length)
+    history = SwitchHistory(history_length, initial_vote=L)
+    window = deque([L], maxlen=history_length)
+    for vote in rng.integers(0, 2, 100).tolist():
+        camera = history.push(vote)
+        window.append(vote)
+        assert history.mean == sum(window) / len(window)
+        # Without hysteresis the camera is the majority of the window, ties going right
+        assert camera == (R if sum(window) / len(window) >= 0.5 else L)
+
+
+def test_majority_of_window():
+    history = SwitchHistory(4, initial_vote=L)
+    # Windows L R, L R L, L R L R: ties of the mean go right
+    assert push_all(history, [R, L, R]) == [R, L, R]
+    # Window is full, initial vote drops out: R L R L, then L R L L
+    assert push_all(history, [L, L]) == [R, L]
+    # R L L R
+    assert push_all(history, [R]) == [R]
+
+
+def test_hysteresis_boundaries():
+    history = SwitchHistory(4, initial_vote=L, hysteresis=0.25)
+    push_all(history, [L, L, L])
+    # Mean 0.5 is not enough, 0.75 = 0.5 + hysteresis switches
+    assert push_all(history, [R, R, R]) == [L, L, R]
+    # Window R R R R, mean 0.25 = 0.5 - hysteresis stays, 0 switches back
+    assert push_all(history, [R, L, L, L]) == [R, R, R, R]
+    assert push_all(history, [L]) == [L]
+
+
+def test_min_dwell_boundaries():
+    history = SwitchHistory(1, initial_vote=L, min_dwell=3)
+    # Switch is possible only from the min_dwell-th vote after the previous switch
+    assert push_all(history, [R, R, R]) == [L, L, R]
+    assert push_all(history, [L, L, L]) == [R, R, L]
+    # Short change of vote within dwell is ignored
+    assert push_all(history, [R, L, L, L]) == [L, L, L, L]
+
+
+def test_zero_dwell_switches_immediately():
+    history = SwitchHistory(1, initial_vote=L)
+    assert push_all(history, [R, L, R, L]) == [R, L, R, L]
+
+
+def test_smoothing_ema():
+    history = SwitchHistory(1, initial_vote=L, smoothing=0.5)
+    scores = []
+    for vote in [R, R, L, L]:
+        history.push(vote)
+        scores.append(history.score)
+    assert scores == [0.5, 0.75, 0.375, 0.1875]
+
+
+def test_smoothing_delays_switch():
+    history = SwitchHistory(1, initial_vote=L, smoothing=0.25)
+    # Score 0.25, 0.4375, 0.578125 reaches 0.5 only with the third vote
+    assert push_all(history, [R, R, R]) == [L, L, R]
+
+
+def test_initial_score():
+    history = SwitchHistory(2, initial_vote=L, smoothing=0.5, initial_score=1.0)
+    assert history.camera == R
+    history.push(L)
+    assert history.score == 0.5
+    assert history.camera == R
+    history.push(L)
+    assert history.score == 0.25
+    assert history.camera == L
+
+
+@pytest.mark.parametrize("min_dwell_time, input_fps, frames_per_flow, steps", [
+    (2.0, 30.0, 5, 12),
+    (1.0, 25.0, 10, 3),
+    (0.0, 25.0, 10, 0),
+])
+def test_dwell_time_to_steps(min_dwell_time, input_fps, frames_per_flow, steps):
+    assert dwell_time_to_steps(min_dwell_time, input_fps, frames_per_flow) == steps
@@ -0,0 +1,56 @@
+import librosa
+import numpy as np
+import pytest
+from scipy import signal
+
+from ml.meow.utils.audio_utils import remove_wind_noise
+
+
+def remove_wind_noise_frame_by_frame(audio: np.ndarray, frame_size: int = 2048, overlap: float = 0.75) -> np.ndarray:
+    """remove_wind_noise before vectorizing, one frame at a time."""
+    hop_length = int(frame_size * (1 - overlap))
+    frames = librosa.util.frame(audio, frame_length=frame_size, hop_length=hop_length)
+    window = np.hanning(frame_size)
+
+    processed_frames = []
+    for frame in frames.T:
+        windowed = frame * window
+        fft = np.fft.rfft(windowed)
+        magnitude = np.abs(fft)
+        phase = np.angle(fft)
+
+        wind_region = magnitude[:int(len(magnitude) * 0.05)]
+        noise_floor = np.mean(wind_region)
+
+        gain = np.ones_like(magnitude)
+        low_freq_idx = int(len(magnitude) * 0.1)
+        gain[:low_freq_idx] = np.maximum(0.3, 1 - (noise_floor / (magnitude[:low_freq_idx] + 1e-10)))
+        gain = signal.medfilt(gain, 3)
+
+        magnitude_clean = magnitude * gain
+        fft_clean = magnitude_clean * np.exp(1j * phase)
+        frame_clean = np.fft.irfft(fft_clean)
+        processed_frames.append(frame_clean[:frame_size])
+
+    output = np.zeros(len(audio))
+    for i, frame in enumerate(processed_frames):
+        start = i * hop_length
+        end = start + frame_size
+        if end > len(output):
+            break
+        output[start:end] += frame
+
+    return 0.95 * (output / np.max(np.abs(output)))
+
+
+@pytest.mark.parametrize("frame_size, overlap, batch_size", [(2048, 0.75, 1024), (2048, 0.75, 7), (1024, 0.5, 10)])
+def test_remove_wind_noise_matches_frame_by_frame(frame_size, overlap, batch_size):
+    rng = np.random.default_rng(0)
+    # Few seconds of noise with strong low frequency rumble, length not a multiple of the hop
+    audio = rng.standard_normal(3 * 22050 + 123)
+    audio += 5 * signal.lfilter([0.01], [1, -0.99], rng.standard_normal(len(audio)))
+
+    expected = remove_wind_noise_frame_by_frame(audio, frame_size, overlap)
+    result = remove_wind_noise(audio, frame_size, overlap, batch_size=batch_size)
+
+    np.testing.assert_allclose(result, expected, rtol=0, atol=1e-12)